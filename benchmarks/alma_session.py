@@ -0,0 +1,86 @@
+"""Benchmark per-request latency of Alma API calls with and without a pooled session.
+
+Starts a local mock Alma server and times the same fund lookup made with one-off
+module-level requests calls (a new connection per request) and with the pooled
+session owned by Alma_API_Client.
+
+Run from the repository root with:
+
+    WORKSPACE=dev SSM_PATH=/dev/ pipenv run python -m benchmarks.alma_session
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from llama.alma import Alma_API_Client
+
+FUND_RESPONSE = json.dumps(
+    {
+        "fund": [{"code": "ABC", "external_id": "1234567-000001"}],
+        "total_record_count": 1,
+    }
+).encode()
+
+
+class MockAlmaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(FUND_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(FUND_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_requests(make_request, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        make_request()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAlmaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    client = Alma_API_Client("abc123", base_api_url=base_url)
+    client.set_content_headers("application/json", "application/json")
+    # Call the session directly rather than a client method so that only connection
+    # handling differs between the two runs.
+    endpoint = f"{base_url}acq/funds"
+    params = {"q": "fund_code~ABC", "view": "full"}
+
+    unpooled = time_requests(
+        lambda: requests.get(endpoint, headers=client.headers, params=params),
+        args.requests,
+    )
+    pooled = time_requests(
+        lambda: client.session.get(
+            endpoint, headers=client.headers, params=params, timeout=client.timeout
+        ),
+        args.requests,
+    )
+    server.shutdown()
+    client.close()
+
+    print(f"Requests per mode:      {args.requests}")
+    print(f"New connection/request: {unpooled * 1000:.3f} ms")
+    print(f"Pooled session:         {pooled * 1000:.3f} ms")
+    print(f"Saved per request:      {(unpooled - pooled) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark rendering credit card slips XML for large numbers of PO lines.
+
+Times xml_data_from_dicts and, in a separate pass since tracing slows rendering down
+considerably, reports the peak memory traced while rendering each batch of slips.
+
+Run from the repository root with:
+
+    WORKSPACE=dev SSM_PATH=/dev/ pipenv run python -m benchmarks.credit_card_slips
+"""
+import argparse
+import time
+import tracemalloc
+
+from llama.credit_card_slips import xml_data_from_dicts
+
+
+def po_line_dicts(count):
+    for i in range(count):
+        yield {
+            "vendor": "Corporation",
+            "poline": f"POL-{i}",
+            "item_title": f"Book title {i}",
+            "price": "$12.00",
+            "total_price": "$24.00",
+            "quantity": "2",
+            "po_date": "210513",
+            "invoice_num": "Invoice #: 210513BOO",
+            "account_1": "1234567-000001",
+            "account_2": "1234567-000002",
+            "cardholder": "abc",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slips", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'Slips':>8} {'Seconds':>10} {'Peak MiB':>10} {'Output MiB':>11}")
+    for count in args.slips:
+        start = time.perf_counter()
+        xml_data = xml_data_from_dicts(po_line_dicts(count))
+        elapsed = time.perf_counter() - start
+        del xml_data
+        tracemalloc.start()
+        xml_data = xml_data_from_dicts(po_line_dicts(count))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{count:>8} {elapsed:>10.3f} {peak / 2**20:>10.1f} "
+            f"{len(xml_data) / 2**20:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark rendering patron records from Data Warehouse rows in worker processes.
+
+Renders synthetic student rows with patronload.render.render_rows using a range of
+worker counts and reports records per second for each, so the speedup of a process
+pool on the current machine can be compared to rendering in a single process.
+
+Run from the repository root with:
+
+    WORKSPACE=dev SSM_PATH=/dev/ pipenv run python -m benchmarks.patron_rendering
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+from benchmarks.patron_templates import STUDENT_DEPARTMENTS, student_patrons
+from patronload.render import DEFAULT_CHUNK_SIZE, render_rows
+
+STUDENT_COLUMNS = [
+    "MIT_ID",
+    "LAST_NAME",
+    "FIRST_NAME",
+    "MIDDLE_NAME",
+    "TERM_STREET1",
+    "TERM_STREET2",
+    "TERM_STREET3",
+    "TERM_CITY",
+    "TERM_STATE",
+    "TERM_ZIP",
+    "TERM_PHONE1",
+    "TERM_PHONE2",
+    "OFFICE_LOCATION",
+    "OFFICE_PHONE",
+    "STUDENT_YEAR",
+    "EMAIL_ADDRESS",
+    "KRB_NAME_UPPERCASE",
+    "HOME_DEPARTMENT",
+    "LIBRARY_ID",
+]
+
+
+def student_rows(count):
+    for patron in student_patrons(count):
+        yield tuple(patron.get(column) for column in STUDENT_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patrons", type=int, default=50000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, os.cpu_count() or 1}),
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.patrons} student rows")
+    print(f"{'Workers':>7} {'Seconds':>8} {'rec/s':>8} {'Speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        rows = list(student_rows(args.patrons))
+        start = time.perf_counter()
+        for _ in render_rows(
+            "student",
+            STUDENT_COLUMNS,
+            rows,
+            STUDENT_DEPARTMENTS,
+            date(2022, 7, 7),
+            date(2024, 7, 7),
+            workers=workers,
+            chunk_size=args.chunk_size,
+        ):
+            pass
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print(
+            f"{workers:>7} {seconds:>8.2f} {args.patrons / seconds:>8.0f} "
+            f"{baseline / seconds:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
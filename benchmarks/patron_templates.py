@@ -0,0 +1,263 @@
+"""Benchmark rendering patron XML records from compiled patron templates.
+
+Renders synthetic staff and student patrons with the compiled templates used by the
+patronload scripts and with the previous approach, which parsed the template file
+from disk and searched the whole tree for every patron, and reports records per
+second for each. Both approaches are checked to render identical XML first.
+
+Run from the repository root with:
+
+    WORKSPACE=dev SSM_PATH=/dev/ pipenv run python -m benchmarks.patron_templates
+"""
+import argparse
+import io
+import re
+import time
+import xml.etree.ElementTree as ET
+from datetime import date
+
+from patronload.records import (
+    STAFF_TEMPLATE_FILE,
+    STUDENT_TEMPLATE_FILE,
+    load_staff_template,
+    load_student_template,
+    phone_format,
+    render_staff_record,
+    render_student_record,
+)
+
+SIX_MONTHS = date(2022, 7, 7)
+TWO_YEARS = date(2024, 7, 7)
+STAFF_DEPARTMENTS = {"10000001": "AA"}
+STUDENT_DEPARTMENTS = {"6": "EE"}
+
+
+def staff_patrons(count):
+    for i in range(count):
+        yield {
+            "FULL_NAME": f"Lastname {i}, Firstname",
+            "OFFICE_ADDRESS": "" if i % 7 == 0 else "77 Massachusetts Ave",
+            "OFFICE_PHONE": "" if i % 5 == 0 else "6172531000",
+            "MIT_ID": f"9{i:08}",
+            "EMAIL_ADDRESS": "" if i % 11 == 0 else f"staff{i}@mit.edu",
+            "KRB_NAME_UPPERCASE": f"STAFF{i}",
+            "LIBRARY_PERSON_TYPE_CODE": "11",
+            "LIBRARY_PERSON_TYPE": "Staff",
+            "ORG_UNIT_ID": "10000001" if i % 2 else "99999999",
+            "ORG_UNIT_TITLE": "" if i % 3 == 0 else "Libraries",
+            "LIBRARY_ID": "NONE" if i % 4 == 0 else f"39080{i:09}",
+        }
+
+
+def student_patrons(count):
+    for i in range(count):
+        yield {
+            "MIT_ID": f"8{i:08}",
+            "LAST_NAME": f"Lastname {i}",
+            "FIRST_NAME": "Firstname",
+            "MIDDLE_NAME": "" if i % 2 else "M",
+            "TERM_STREET1": "" if i % 7 == 0 else "3 Ames St",
+            "TERM_STREET2": "Room 101",
+            "TERM_CITY": "Cambridge",
+            "TERM_STATE": "MA",
+            "TERM_ZIP": "02142",
+            "TERM_PHONE1": "" if i % 3 == 0 else "6172531000",
+            "TERM_PHONE2": "6172532000",
+            "OFFICE_PHONE": "" if i % 2 else "6172533000",
+            "STUDENT_YEAR": "G" if i % 2 else "3",
+            "EMAIL_ADDRESS": f"student{i}@mit.edu",
+            "KRB_NAME_UPPERCASE": f"STUDENT{i}",
+            "HOME_DEPARTMENT": "6" if i % 5 else "NIU",
+            "LIBRARY_ID": f"39080{i:09}",
+        }
+
+
+def legacy_render_staff_record(patron, departments, six_months, two_years):
+    tree = ET.parse(STAFF_TEMPLATE_FILE)
+    root = tree.getroot()
+    for primary_id in root.iter("primary_id"):
+        if patron["KRB_NAME_UPPERCASE"]:
+            primary_id.text = patron["KRB_NAME_UPPERCASE"] + "@MIT.EDU"
+        else:
+            primary_id.text = patron["EMAIL_ADDRESS"]
+    name_split = re.split(",", patron["FULL_NAME"], 1)
+    for last_name in root.iter("last_name"):
+        last_name.text = name_split[0].strip()
+    for first_name in root.iter("first_name"):
+        first_name.text = name_split[1].strip()
+    for expiry_date in root.iter("expiry_date"):
+        expiry_date.text = six_months.strftime("%Y-%m-%d") + "Z"
+    for purge_date in root.iter("purge_date"):
+        purge_date.text = two_years.strftime("%Y-%m-%d") + "Z"
+    for user_group in root.iter("user_group"):
+        user_group.text = patron["LIBRARY_PERSON_TYPE_CODE"]
+        user_group.set("desc", patron["LIBRARY_PERSON_TYPE"])
+    _legacy_fill_identifiers(root, patron)
+    for contact_info in root.iter("contact_info"):
+        addresses = contact_info.find("addresses")
+        if patron["OFFICE_ADDRESS"]:
+            addresses[0][0].text = patron["OFFICE_ADDRESS"]
+        else:
+            addresses[0][0].text = "NO ADDRESS ON FILE IN DATA WAREHOUSE"
+        _legacy_fill_emails(contact_info, patron)
+        phones = contact_info.find("phones")
+        if patron["OFFICE_PHONE"]:
+            phones[0][0].text = phone_format(patron["OFFICE_PHONE"])
+        else:
+            for tel in phones.findall("phone"):
+                phones.remove(tel)
+    for user_statistic in root.iter("user_statistic"):
+        if user_statistic[1].text == "DEPT":
+            if patron["ORG_UNIT_ID"] in departments:
+                user_statistic[0].text = departments[patron["ORG_UNIT_ID"]]
+            else:
+                user_statistic[0].text = "ZQ"
+            if patron["ORG_UNIT_TITLE"]:
+                user_statistic[0].set("desc", patron["ORG_UNIT_TITLE"])
+            else:
+                user_statistic[0].set("desc", "Unknown")
+    return _legacy_write(tree)
+
+
+def legacy_render_student_record(patron, departments, six_months, two_years):
+    tree = ET.parse(STUDENT_TEMPLATE_FILE)
+    root = tree.getroot()
+    for primary_id in root.iter("primary_id"):
+        if patron["KRB_NAME_UPPERCASE"]:
+            primary_id.text = patron["KRB_NAME_UPPERCASE"] + "@MIT.EDU"
+        else:
+            primary_id.text = patron["EMAIL_ADDRESS"]
+    for first_name in root.iter("first_name"):
+        first_name.text = patron["FIRST_NAME"]
+    for middle_name in root.iter("middle_name"):
+        middle_name.text = patron["MIDDLE_NAME"]
+    for last_name in root.iter("last_name"):
+        last_name.text = patron["LAST_NAME"]
+    for expiry_date in root.iter("expiry_date"):
+        expiry_date.text = six_months.strftime("%Y-%m-%d") + "Z"
+    for purge_date in root.iter("purge_date"):
+        purge_date.text = two_years.strftime("%Y-%m-%d") + "Z"
+    for contact_info in root.iter("contact_info"):
+        addresses = contact_info.find("addresses")
+        if patron["TERM_STREET1"]:
+            addresses[0][0].text = patron["TERM_STREET1"]
+        else:
+            addresses[0][0].text = "NO ADDRESS ON FILE IN DATA WAREHOUSE"
+        addresses[0][1].text = patron["TERM_STREET2"]
+        addresses[0][2].text = patron["TERM_CITY"]
+        addresses[0][3].text = patron["TERM_STATE"]
+        addresses[0][4].text = patron["TERM_ZIP"]
+        _legacy_fill_emails(contact_info, patron)
+        phones = contact_info.find("phones")
+        if patron["OFFICE_PHONE"] and patron["TERM_PHONE1"]:
+            phones[0][0].text = phone_format(patron["OFFICE_PHONE"])
+            phones[1][0].text = phone_format(patron["TERM_PHONE1"])
+        elif patron["OFFICE_PHONE"]:
+            phones[0][0].text = phone_format(patron["OFFICE_PHONE"])
+        elif patron["TERM_PHONE1"]:
+            phones[0][0].text = phone_format(patron["TERM_PHONE1"])
+        elif patron["TERM_PHONE2"]:
+            phones[0][0].text = phone_format(patron["TERM_PHONE2"])
+        for tel in phones.findall("phone"):
+            if not tel.findall("phone_number")[0].text:
+                phones.remove(tel)
+    _legacy_fill_identifiers(root, patron)
+    for user_statistic in root.iter("user_statistic"):
+        if user_statistic[1].text == "DEPT":
+            if patron["HOME_DEPARTMENT"] in departments:
+                user_statistic[0].text = departments[patron["HOME_DEPARTMENT"]]
+            else:
+                user_statistic[0].text = "ZZ"
+    for user_group in root.iter("user_group"):
+        status = ""
+        if re.search("^[1234Uu]$", patron["STUDENT_YEAR"]):
+            status = "31"
+        elif re.search("^[Gg]$", patron["STUDENT_YEAR"]):
+            status = "32"
+        if re.search("^NI[UVWTRH]$", patron["HOME_DEPARTMENT"]):
+            status = "54"
+        user_group.text = status
+    return _legacy_write(tree)
+
+
+def _legacy_fill_identifiers(root, patron):
+    for user_identifiers in root.iter("user_identifiers"):
+        for user_identifier in user_identifiers:
+            id_type = user_identifier.findall("id_type")[0]
+            value = user_identifier.findall("value")[0]
+            if id_type.text == "02":
+                value.text = patron["MIT_ID"]
+            elif id_type.text == "01":
+                if patron["LIBRARY_ID"] and patron["LIBRARY_ID"] != "NONE":
+                    value.text = patron["LIBRARY_ID"]
+                else:
+                    user_identifiers.remove(user_identifier)
+
+
+def _legacy_fill_emails(contact_info, patron):
+    emails = contact_info.find("emails")
+    if patron["EMAIL_ADDRESS"]:
+        emails[0][0].text = patron["EMAIL_ADDRESS"]
+    else:
+        for em in emails.findall("email"):
+            emails.remove(em)
+
+
+def _legacy_write(tree):
+    out = io.BytesIO()
+    tree.write(out, encoding="UTF-8", xml_declaration=False)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patrons", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+    staff_template = load_staff_template()
+    student_template = load_student_template()
+    renderers = {
+        "staff": (
+            staff_patrons,
+            lambda p: legacy_render_staff_record(
+                p, STAFF_DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+            ),
+            lambda p: render_staff_record(
+                staff_template, p, STAFF_DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+            ),
+        ),
+        "student": (
+            student_patrons,
+            lambda p: legacy_render_student_record(
+                p, STUDENT_DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+            ),
+            lambda p: render_student_record(
+                student_template, p, STUDENT_DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+            ),
+        ),
+    }
+
+    for name, (patrons, legacy, compiled) in renderers.items():
+        for patron in patrons(100):
+            assert legacy(patron) == compiled(patron), patron
+
+    print(
+        f"{'Patrons':<8} {'Count':>7} {'Before rec/s':>13} {'After rec/s':>12} "
+        f"{'Speedup':>8}"
+    )
+    for count in args.patrons:
+        for name, (patrons, legacy, compiled) in renderers.items():
+            rates = []
+            for render in (legacy, compiled):
+                population = list(patrons(count))
+                start = time.perf_counter()
+                for patron in population:
+                    render(patron)
+                rates.append(count / (time.perf_counter() - start))
+            print(
+                f"{name:<8} {count:>7} {rates[0]:>13.0f} {rates[1]:>12.0f} "
+                f"{rates[1] / rates[0]:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
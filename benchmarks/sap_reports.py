@@ -0,0 +1,82 @@
+"""Benchmark building SAP reports and data files for large numbers of invoices.
+
+Times generate_report, generate_sap_data and generate_summary over synthetic invoice
+sets and reports the time per invoice, which stays flat as the number of invoices
+grows if the builders scale linearly.
+
+Run from the repository root with:
+
+    WORKSPACE=dev SSM_PATH=/dev/ pipenv run python -m benchmarks.sap_reports
+"""
+import argparse
+import time
+from datetime import datetime
+
+from llama.sap import generate_report, generate_sap_data, generate_summary
+
+
+def synthetic_invoices(count):
+    invoices = []
+    for i in range(count):
+        invoices.append(
+            {
+                "date": datetime(2021, 5, 12),
+                "id": f"{i:016}",
+                "number": f"{i:06}",
+                "type": "monograph",
+                "payment method": "ACCOUNTINGDEPARTMENT" if i % 10 else "BAZ",
+                "total amount": 150 + i % 100,
+                "currency": "USD",
+                "vendor": {
+                    "name": f"Vendor {i % 500}",
+                    "code": f"VEND-{i % 500}",
+                    "address": {
+                        "lines": ["123 Salad Street", "Second Floor"],
+                        "city": "San Francisco",
+                        "state or province": "CA",
+                        "postal code": "94109",
+                        "country": "US",
+                    },
+                },
+                "funds": {
+                    f"123456-00000{f}": {
+                        "amount": 50 + i % 33,
+                        "cost object": "123456",
+                        "G/L account": f"00000{f}",
+                    }
+                    for f in range(1 + i % 3)
+                },
+            }
+        )
+    return invoices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--invoices", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    args = parser.parse_args()
+    today = datetime(2021, 5, 18)
+    builders = {
+        "report": lambda invoices: generate_report(today, invoices),
+        "sap data": lambda invoices: generate_sap_data(today, invoices),
+        "summary": lambda invoices: generate_summary(
+            [], invoices, "dlibsapg.1001.20210518000000", "clibsapg.1001.20210518000000"
+        ),
+    }
+
+    print(f"{'Builder':<10} {'Invoices':>9} {'Seconds':>9} {'us/invoice':>11}")
+    for count in args.invoices:
+        invoices = synthetic_invoices(count)
+        for name, build in builders.items():
+            start = time.perf_counter()
+            build(invoices)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<10} {count:>9} {elapsed:>9.3f} {elapsed / count * 1e6:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
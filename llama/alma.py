@@ -1,20 +1,99 @@
+import asyncio
+import collections
 import json
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import NamedTuple
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 
 from llama import CONFIG
+from llama.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Alma's API request limit is shared by every integration at the institution, so
+# clients in this process share a single limiter with a configurable budget.
+ALMA_RATE_LIMITER = RateLimiter(
+    requests_per_second=float(CONFIG.ALMA_API_REQUESTS_PER_SECOND)
+)
+
+
+class PageMetrics(NamedTuple):
+    """Metrics for a single page retrieved from a paged Alma API endpoint."""
+
+    offset: int
+    records: int
+    bytes: int
+    elapsed: float
 
 
 class Alma_API_Client:
     """An Alma_API_Client class that provides a client for interacting with the Alma API
     and specific functionality necessary for llama scripts.
+
+    All requests are made through a single pooled requests.Session, so connections to
+    the Alma API gateway are reused across calls instead of paying a new TCP and TLS
+    handshake for every request.
+
+    Args:
+        api_key: The Alma API key to authorize requests with.
+        base_api_url: The base URL of the Alma API, including the trailing slash.
+        pool_connections: The number of connection pools to cache, one per host.
+        pool_maxsize: The maximum number of connections to keep in each pool. Should
+            be at least the number of threads sharing the client.
+        connect_timeout: Seconds to wait when establishing a connection.
+        read_timeout: Seconds to wait for the server to send a response.
+        keep_alive: If False, connections are closed after each request.
+        rate_limiter: The RateLimiter used to throttle requests. Defaults to the
+            module-level ALMA_RATE_LIMITER shared by all clients.
+        page_workers: The default number of pages paged methods fetch concurrently.
+            Should be no more than pool_maxsize.
+        cache: Optional MetadataCache that vendor and fund lookups are read from and
+            stored in, so they persist between runs.
     """
 
-    def __init__(self, api_key, base_api_url=CONFIG.ALMA_API_URL):
+    def __init__(
+        self,
+        api_key,
+        base_api_url=CONFIG.ALMA_API_URL,
+        pool_connections=1,
+        pool_maxsize=10,
+        connect_timeout=10,
+        read_timeout=60,
+        keep_alive=True,
+        rate_limiter=None,
+        page_workers=1,
+        cache=None,
+    ):
         self.base_url = base_api_url
         self.headers = {"Authorization": f"apikey {api_key}"}
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.rate_limiter = rate_limiter or ALMA_RATE_LIMITER
+        self.page_workers = page_workers
+        self.cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the client session and any pooled connections."""
+        self.session.close()
 
     def set_content_headers(self, accept, content_type):
         """Set headers for requesting and receiving content from the Alma API."""
@@ -23,25 +102,38 @@ class Alma_API_Client:
 
     def create_invoice(self, invoice_json):
         endpoint = f"{self.base_url}acq/invoices"
-        r = requests.post(endpoint, headers=self.headers, data=json.dumps(invoice_json))
+        self.rate_limiter.acquire()
+        r = self.session.post(
+            endpoint,
+            headers=self.headers,
+            data=json.dumps(invoice_json),
+            timeout=self.timeout,
+        )
         r.raise_for_status()
-        time.sleep(0.1)
         return r.json()
 
     def create_invoice_line(self, invoice_id, invoice_line_json):
         endpoint = f"{self.base_url}acq/invoices/{invoice_id}/lines"
-        r = requests.post(
-            endpoint, headers=self.headers, data=json.dumps(invoice_line_json)
+        self.rate_limiter.acquire()
+        r = self.session.post(
+            endpoint,
+            headers=self.headers,
+            data=json.dumps(invoice_line_json),
+            timeout=self.timeout,
         )
         r.raise_for_status()
-        time.sleep(0.1)
         return r.json()
 
     def create_vendor(self, vendor_json):
         endpoint = f"{self.base_url}acq/vendors"
-        r = requests.post(endpoint, headers=self.headers, data=json.dumps(vendor_json))
+        self.rate_limiter.acquire()
+        r = self.session.post(
+            endpoint,
+            headers=self.headers,
+            data=json.dumps(vendor_json),
+            timeout=self.timeout,
+        )
         r.raise_for_status()
-        time.sleep(0.1)
         return r.json()
 
     def get_paged(
@@ -50,8 +142,9 @@ class Alma_API_Client:
         record_type,
         params=None,
         limit=100,
-        _offset=0,
-        _records_retrieved=0,
+        workers=None,
+        max_records=None,
+        on_page=None,
     ):
         """Retrieve paginated results from the Alma API for a given endpoint.
         Args:
@@ -63,92 +156,196 @@ class Alma_API_Client:
             params: Any endpoint-specific params to supply to the GET request.
             limit: The maximum number of records to retrieve per page. Valid values are
                 0-100.
-            _offset: The offset value to supply to paged request. Should only be used
-                internally by this method's recursion.
-            _records_retrieved: The number of records retrieved so far for a given
-                paged endpoint. Should only be used internally by this method's
-                recursion.
+            workers: The number of pages to fetch concurrently once the total record
+                count is known. Records are still yielded in order. Defaults to the
+                client's page_workers.
+            max_records: The maximum number of records to retrieve in total, e.g. for
+                sampling runs. Defaults to all records.
+            on_page: Optional callable that is passed a PageMetrics tuple for each
+                page retrieved.
         """
-        params = params or {}
-        params["limit"] = limit
-        params["offset"] = _offset
-        response = requests.get(
+        workers = workers or self.page_workers
+        if workers > 1:
+            pages = self._get_pages_concurrently(
+                endpoint, record_type, params, limit, workers, max_records
+            )
+        else:
+            pages = self._get_pages(endpoint, record_type, params, limit, max_records)
+        records_yielded = 0
+        for page, metrics in pages:
+            logger.debug(f"Retrieved page from {endpoint}: {metrics}")
+            if on_page is not None:
+                on_page(metrics)
+            for record in page.get(record_type, []):
+                if max_records is not None and records_yielded >= max_records:
+                    return
+                yield record
+                records_yielded += 1
+
+    def _get_page(self, endpoint, record_type, params, limit, offset):
+        """Retrieve and decode a single page from a paged Alma API endpoint.
+
+        Returns the decoded page and a PageMetrics tuple for the request.
+        """
+        page_params = dict(params or {}, limit=limit, offset=offset)
+        self.rate_limiter.acquire()
+        start = time.perf_counter()
+        response = self.session.get(
             url=f"{self.base_url}{endpoint}",
-            params=params,
+            params=page_params,
             headers=self.headers,
+            timeout=self.timeout,
         )
         response.raise_for_status()
-        time.sleep(0.1)
-        total_record_count = response.json()["total_record_count"]
-        records = response.json().get(record_type, [])
-        records_retrieved = _records_retrieved + len(records)
-        for record in records:
-            yield record
-        if records_retrieved < total_record_count:
-            yield from self.get_paged(
-                endpoint,
-                record_type,
-                params=params,
-                limit=limit,
-                _offset=_offset + limit,
-                _records_retrieved=records_retrieved,
-            )
+        page = response.json()
+        metrics = PageMetrics(
+            offset=offset,
+            records=len(page.get(record_type, [])),
+            bytes=len(response.content),
+            elapsed=time.perf_counter() - start,
+        )
+        return page, metrics
 
-    def get_brief_po_lines(self, acquisition_method=""):
-        """Get brief PO lines with an option to narrow by acquisition_method. The
-        PO line records retrieved from this endpoint do not contain all of the PO line
-        data and users may wish to retrieve the full PO line record with the
-        get_full_po_line method."""
+    def _get_pages(self, endpoint, record_type, params, limit, max_records):
+        """Retrieve pages one at a time until all records, or max_records records,
+        have been retrieved."""
+        offset = 0
+        while True:
+            page, metrics = self._get_page(endpoint, record_type, params, limit, offset)
+            yield page, metrics
+            offset += limit
+            total_record_count = page["total_record_count"]
+            if max_records is not None:
+                total_record_count = min(total_record_count, max_records)
+            if metrics.records == 0 or offset >= total_record_count:
+                return
+
+    def _get_pages_concurrently(
+        self, endpoint, record_type, params, limit, workers, max_records
+    ):
+        """Retrieve pages, prefetching up to `workers` pages at a time.
+
+        The first page is fetched on its own to learn the total record count, then the
+        remaining offsets are fetched by a thread pool. At most twice as many pages as
+        workers are held in memory, and pages are yielded in offset order.
+        """
+        first_page, metrics = self._get_page(endpoint, record_type, params, limit, 0)
+        yield first_page, metrics
+        total_record_count = first_page["total_record_count"]
+        if max_records is not None:
+            total_record_count = min(total_record_count, max_records)
+        offsets = range(limit, total_record_count, limit)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            try:
+                for offset in offsets:
+                    pending.append(
+                        executor.submit(
+                            self._get_page,
+                            endpoint,
+                            record_type,
+                            params,
+                            limit,
+                            offset,
+                        )
+                    )
+                    if len(pending) >= workers * 2:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def get_brief_po_lines(
+        self, acquisition_method="", workers=None, order_by=None, direction=None
+    ):
+        """Get brief PO lines with an option to narrow by acquisition_method and to
+        sort with the Alma order_by and direction parameters. The PO line records
+        retrieved from this endpoint do not contain all of the PO line data and users
+        may wish to retrieve the full PO line record with the get_full_po_line
+        method."""
         po_line_params = {
             "status": "ACTIVE",
             "acquisition_method": acquisition_method,
         }
-        return self.get_paged("acq/po-lines", "po_line", params=po_line_params)
+        if order_by is not None:
+            po_line_params["order_by"] = order_by
+        if direction is not None:
+            po_line_params["direction"] = direction
+        return self.get_paged(
+            "acq/po-lines", "po_line", params=po_line_params, workers=workers
+        )
 
     def get_full_po_line(self, po_line_id):
         """Get a full PO line record using the PO line ID."""
-        full_po_line = requests.get(
-            f"{self.base_url}acq/po-lines/{po_line_id}",
-            headers=self.headers,
-        ).json()
-        time.sleep(0.1)
-        return full_po_line
+        endpoint = f"{self.base_url}acq/po-lines/{po_line_id}"
+        self.rate_limiter.acquire()
+        r = self.session.get(endpoint, headers=self.headers, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
 
     def get_fund_by_code(self, fund_code):
-        """Get fund details using the fund code."""
+        """Get fund details using the fund code. Searches that find a fund are cached
+        if the client has a cache, searches that find nothing are not."""
         endpoint = f"{self.base_url}acq/funds"
         params = {"q": f"fund_code~{fund_code}", "view": "full"}
-        r = requests.get(endpoint, headers=self.headers, params=params)
+        cache_key = f"{endpoint}?q={params['q']}&view=full"
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        self.rate_limiter.acquire()
+        r = self.session.get(
+            endpoint, headers=self.headers, params=params, timeout=self.timeout
+        )
         r.raise_for_status()
-        time.sleep(0.1)
-        return r.json()
+        fund = r.json()
+        if self.cache is not None and fund.get("total_record_count", 0) > 0:
+            self.cache.set(cache_key, fund)
+        return fund
+
+    def get_funds(self, workers=None):
+        """Get full records for all funds."""
+        return self.get_paged(
+            "acq/funds", "fund", params={"view": "full"}, workers=workers
+        )
 
     def get_invoice(self, invoice_id):
         """Get an invoice by ID."""
         endpoint = f"{self.base_url}acq/invoices/{invoice_id}"
-        r = requests.get(endpoint, headers=self.headers)
+        self.rate_limiter.acquire()
+        r = self.session.get(endpoint, headers=self.headers, timeout=self.timeout)
         r.raise_for_status()
-        time.sleep(0.1)
         return r.json()
 
-    def get_invoices_by_status(self, status):
+    def get_invoices_by_status(self, status, workers=None):
         """Get all invoices with a provided status."""
         invoice_params = {
             "invoice_workflow_status": status,
         }
-        return self.get_paged("acq/invoices", "invoice", params=invoice_params)
+        return self.get_paged(
+            "acq/invoices", "invoice", params=invoice_params, workers=workers
+        )
 
     def get_vendor_details(self, vendor_code):
-        """Get vendor info from Alma."""
+        """Get vendor info from Alma, from the client's cache if it has one."""
         endpoint = f"{self.base_url}acq/vendors/{vendor_code}"
-        r = requests.get(endpoint, headers=self.headers)
+        if self.cache is not None:
+            cached = self.cache.get(endpoint)
+            if cached is not None:
+                return cached
+        self.rate_limiter.acquire()
+        r = self.session.get(endpoint, headers=self.headers, timeout=self.timeout)
         r.raise_for_status()
-        time.sleep(0.1)
-        return r.json()
+        vendor = r.json()
+        if self.cache is not None:
+            self.cache.set(endpoint, vendor)
+        return vendor
 
-    def get_vendor_invoices(self, vendor_code):
+    def get_vendor_invoices(self, vendor_code, workers=None):
         endpoint = f"acq/vendors/{vendor_code}/invoices"
-        return self.get_paged(endpoint, "invoice")
+        return self.get_paged(endpoint, "invoice", workers=workers)
 
     def mark_invoice_paid(
         self,
@@ -167,14 +364,15 @@ class Alma_API_Client:
                 "voucher_currency": {"value": payment_currency},
             }
         }
-        r = requests.post(
+        self.rate_limiter.acquire()
+        r = self.session.post(
             endpoint,
             headers=self.headers,
             params=params,
             data=json.dumps(invoice_payment_data),
+            timeout=self.timeout,
         )
         r.raise_for_status()
-        time.sleep(0.1)
         # TODO: check for Alma-specific error codes. Do we also need to check for
         # alerts? See https://developers.exlibrisgroup.com/alma/apis/docs/acq/
         # UE9TVCAvYWxtYXdzL3YxL2FjcS9pbnZvaWNlcy97aW52b2ljZV9pZH0=/ and https://
@@ -186,7 +384,225 @@ class Alma_API_Client:
         """Move an invoice to in process using the invoice process endpoint."""
         endpoint = f"{self.base_url}acq/invoices/{invoice_id}"
         params = {"op": "process_invoice"}
-        r = requests.post(endpoint, headers=self.headers, params=params, data="{}")
+        self.rate_limiter.acquire()
+        r = self.session.post(
+            endpoint,
+            headers=self.headers,
+            params=params,
+            data="{}",
+            timeout=self.timeout,
+        )
         r.raise_for_status()
-        time.sleep(0.1)
         return r.json()
+
+
+class AsyncAlmaClient:
+    """An asyncio Alma API client with the same method surface as Alma_API_Client.
+
+    Intended for workloads dominated by independent lookups, such as retrieving a full
+    PO line per brief PO line or a fund per fund code. Requests can be issued together
+    with asyncio.gather and the client runs at most max_concurrency of them at once,
+    drawing from the same rate limiter as Alma_API_Client.
+
+    The client must be used as an async context manager so its aiohttp session is
+    opened and closed inside the running event loop:
+
+        async with AsyncAlmaClient(api_key) as client:
+            funds = await asyncio.gather(
+                *[client.get_fund_by_code(code) for code in fund_codes]
+            )
+
+    Args:
+        api_key: The Alma API key to authorize requests with.
+        base_api_url: The base URL of the Alma API, including the trailing slash.
+        max_concurrency: The maximum number of requests in flight at once.
+        connect_timeout: Seconds to wait when establishing a connection.
+        read_timeout: Seconds to wait for the server to send data.
+        keep_alive: If False, connections are closed after each request.
+        rate_limiter: The RateLimiter used to throttle requests. Defaults to the
+            module-level ALMA_RATE_LIMITER shared by all clients.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_api_url=CONFIG.ALMA_API_URL,
+        max_concurrency=10,
+        connect_timeout=10,
+        read_timeout=60,
+        keep_alive=True,
+        rate_limiter=None,
+    ):
+        self.base_url = base_api_url
+        self.headers = {"Authorization": f"apikey {api_key}"}
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self.keep_alive = keep_alive
+        self.rate_limiter = rate_limiter or ALMA_RATE_LIMITER
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_concurrency, force_close=not self.keep_alive
+            ),
+            timeout=self.timeout,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Close the client session and any pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def set_content_headers(self, accept, content_type):
+        """Set headers for requesting and receiving content from the Alma API."""
+        self.headers["Accept"] = accept
+        self.headers["Content-Type"] = content_type
+
+    async def _request(self, method, endpoint, params=None, data=None):
+        """Make a rate-limited request to the Alma API and return the decoded JSON
+        response. Raises aiohttp.ClientResponseError for error responses."""
+        async with self._semaphore:
+            await self.rate_limiter.acquire_async()
+            async with self.session.request(
+                method,
+                f"{self.base_url}{endpoint}",
+                headers=self.headers,
+                params=params,
+                data=data,
+            ) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def create_invoice(self, invoice_json):
+        return await self._request(
+            "POST", "acq/invoices", data=json.dumps(invoice_json)
+        )
+
+    async def create_invoice_line(self, invoice_id, invoice_line_json):
+        return await self._request(
+            "POST",
+            f"acq/invoices/{invoice_id}/lines",
+            data=json.dumps(invoice_line_json),
+        )
+
+    async def create_vendor(self, vendor_json):
+        return await self._request("POST", "acq/vendors", data=json.dumps(vendor_json))
+
+    async def get_paged(
+        self, endpoint, record_type, params=None, limit=100, max_records=None
+    ):
+        """Retrieve paginated results from the Alma API for a given endpoint.
+
+        Behaves like Alma_API_Client.get_paged, as an async generator. After the
+        first page, up to max_concurrency pages are fetched at once and records are
+        yielded in order.
+        """
+        first_page = await self._get_page(endpoint, params, limit, 0)
+        total_record_count = first_page["total_record_count"]
+        if max_records is not None:
+            total_record_count = min(total_record_count, max_records)
+        records_yielded = 0
+        pending = collections.deque()
+        offsets = iter(range(limit, total_record_count, limit))
+        try:
+            page = first_page
+            while True:
+                for offset in offsets:
+                    pending.append(
+                        asyncio.ensure_future(
+                            self._get_page(endpoint, params, limit, offset)
+                        )
+                    )
+                    if len(pending) >= self.max_concurrency * 2:
+                        break
+                for record in page.get(record_type, []):
+                    if records_yielded >= total_record_count:
+                        return
+                    yield record
+                    records_yielded += 1
+                if not pending:
+                    return
+                page = await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_page(self, endpoint, params, limit, offset):
+        page_params = dict(params or {}, limit=limit, offset=offset)
+        return await self._request("GET", endpoint, params=page_params)
+
+    def get_brief_po_lines(self, acquisition_method=""):
+        """Get brief PO lines with an option to narrow by acquisition_method."""
+        po_line_params = {
+            "status": "ACTIVE",
+            "acquisition_method": acquisition_method,
+        }
+        return self.get_paged("acq/po-lines", "po_line", params=po_line_params)
+
+    async def get_full_po_line(self, po_line_id):
+        """Get a full PO line record using the PO line ID."""
+        return await self._request("GET", f"acq/po-lines/{po_line_id}")
+
+    async def get_fund_by_code(self, fund_code):
+        """Get fund details using the fund code."""
+        params = {"q": f"fund_code~{fund_code}", "view": "full"}
+        return await self._request("GET", "acq/funds", params=params)
+
+    async def get_invoice(self, invoice_id):
+        """Get an invoice by ID."""
+        return await self._request("GET", f"acq/invoices/{invoice_id}")
+
+    def get_invoices_by_status(self, status):
+        """Get all invoices with a provided status."""
+        invoice_params = {
+            "invoice_workflow_status": status,
+        }
+        return self.get_paged("acq/invoices", "invoice", params=invoice_params)
+
+    async def get_vendor_details(self, vendor_code):
+        """Get vendor info from Alma."""
+        return await self._request("GET", f"acq/vendors/{vendor_code}")
+
+    def get_vendor_invoices(self, vendor_code):
+        return self.get_paged(f"acq/vendors/{vendor_code}/invoices", "invoice")
+
+    async def mark_invoice_paid(
+        self,
+        invoice_id: str,
+        payment_date: datetime,
+        payment_amount: str,
+        payment_currency: str,
+    ) -> str:
+        """Mark an invoice as paid using the invoice process endpoint."""
+        invoice_payment_data = {
+            "payment": {
+                "voucher_date": payment_date.strftime("%Y-%m-%dT12:00:00Z"),
+                "voucher_amount": payment_amount,
+                "voucher_currency": {"value": payment_currency},
+            }
+        }
+        return await self._request(
+            "POST",
+            f"acq/invoices/{invoice_id}",
+            params={"op": "paid"},
+            data=json.dumps(invoice_payment_data),
+        )
+
+    async def process_invoice(self, invoice_id):
+        """Move an invoice to in process using the invoice process endpoint."""
+        return await self._request(
+            "POST",
+            f"acq/invoices/{invoice_id}",
+            params={"op": "process_invoice"},
+            data="{}",
+        )
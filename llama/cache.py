@@ -0,0 +1,125 @@
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = "alma_metadata.sqlite3"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class MetadataCache:
+    """A thread-safe, SQLite backed cache of JSON API responses that persists between
+    runs.
+
+    Entries expire `ttl` seconds after they were stored. When the stored responses
+    exceed `max_bytes`, the least recently used entries are evicted. If `refresh` is
+    True, existing entries are ignored and replaced as responses are stored.
+
+    Attributes:
+        path: Path of the SQLite database file.
+        ttl: Number of seconds an entry stays valid.
+        max_bytes: Maximum total size of stored responses.
+        refresh: Whether existing entries are ignored.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups not found in the cache.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        refresh: bool = False,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, "
+            "size INTEGER, stored REAL, accessed REAL)"
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connection to the cache database."""
+        self._connection.close()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Get the cached response for a key, or None if it is missing or expired."""
+        with self._lock:
+            row = None
+            if not self.refresh:
+                row = self._connection.execute(
+                    "SELECT value FROM responses WHERE key = ? AND stored > ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+            return json.loads(row[0])
+
+    def set(self, key: str, response: dict):
+        """Store a response for a key, evicting the least recently used entries if the
+        cache is over its size limit."""
+        value = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        self._connection.execute(
+            "DELETE FROM responses WHERE stored <= ?", (time.time() - self.ttl,)
+        )
+        total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall():
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            evicted += 1
+            if total_size <= self.max_bytes:
+                break
+        logger.debug(f"Evicted {evicted} entries from metadata cache {self.path}")
+
+
+def open_metadata_cache(cache_dir: Optional[str], refresh: bool = False):
+    """Open the metadata cache in cache_dir, creating the directory if needed. Returns a
+    null context if no cache directory is given, so callers can use the result in a
+    with statement either way."""
+    if not cache_dir:
+        return contextlib.nullcontext()
+    os.makedirs(cache_dir, exist_ok=True)
+    return MetadataCache(os.path.join(cache_dir, CACHE_FILE_NAME), refresh=refresh)
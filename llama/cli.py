@@ -1,17 +1,32 @@
 import datetime
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
-from llama import CONFIG, credit_card_slips, sap
+from llama import CONFIG, alma, credit_card_slips, sap
 from llama.alma import Alma_API_Client
+from llama.cache import open_metadata_cache
 from llama.email import Email
+from llama.journal import RunJournal
+from llama.run_logs import RunLogBuffer
 from llama.s3 import S3
 from llama.sample_data import load_sample_data
 
 logger = logging.getLogger(__name__)
 
+# Number of pages of Alma API results to prefetch concurrently when crawling large
+# paged endpoints such as brief PO lines and invoices.
+ALMA_PAGE_WORKERS = 4
+
+# Number of full PO line records to fetch concurrently when building credit card slips.
+ALMA_PO_LINE_WORKERS = 4
+
+# Number of vendor and fund records to retrieve concurrently before parsing invoices.
+ALMA_LOOKUP_WORKERS = 4
+
 
 @click.group()
 @click.pass_context
@@ -44,20 +59,26 @@ def cc_slips(ctx, date, source_email, recipient_email):
     if date is None:
         date = (ctx.obj["today"] - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
     alma_api_key = CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_KEY")
-    alma_api_client = Alma_API_Client(alma_api_key)
-    alma_api_client.set_content_headers("application/json", "application/json")
-    credit_card_full_po_lines = (
-        credit_card_slips.get_credit_card_full_po_lines_from_date(alma_api_client, date)
-    )
-    if len(credit_card_full_po_lines) > 0:
-        po_line_dicts = credit_card_slips.create_po_line_dicts(
-            alma_api_client, credit_card_full_po_lines
-        )
-        credit_card_slip_xml_data = credit_card_slips.xml_data_from_dicts(po_line_dicts)
-    else:
-        credit_card_slip_xml_data = (
-            "<html><p>No credit card orders on this date</p></html>"
+    with Alma_API_Client(
+        alma_api_key, page_workers=ALMA_PAGE_WORKERS
+    ) as alma_api_client:
+        alma_api_client.set_content_headers("application/json", "application/json")
+        credit_card_full_po_lines = (
+            credit_card_slips.get_credit_card_full_po_lines_from_date(
+                alma_api_client, date, workers=ALMA_PO_LINE_WORKERS
+            )
         )
+        if len(credit_card_full_po_lines) > 0:
+            po_line_dicts = credit_card_slips.create_po_line_dicts(
+                alma_api_client, credit_card_full_po_lines
+            )
+            credit_card_slip_xml_data = credit_card_slips.xml_data_from_dicts(
+                po_line_dicts
+            )
+        else:
+            credit_card_slip_xml_data = (
+                "<html><p>No credit card orders on this date</p></html>"
+            )
     message = Email()
     message.populate(
         source_email,
@@ -72,6 +93,10 @@ def cc_slips(ctx, date, source_email, recipient_email):
     )
     response = message.send()
     logger.info(f'Email sent! Message ID: {response["MessageId"]}')
+    logger.info(
+        "Alma API requests throttled for "
+        f"{alma_api_client.rate_limiter.throttled_seconds:.2f} seconds"
+    )
 
 
 @cli.command()
@@ -133,11 +158,11 @@ def create_sandbox_sap_data(ctx):
         )
         raise click.Abort()
     alma_key = CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_WRITE_KEY")
-    alma_client = Alma_API_Client(alma_key)
-    alma_client.set_content_headers("application/json", "application/json")
     with open("sample-data/sample-sap-invoice-data.json") as f:
         contents = json.load(f)
-    invoices_created = load_sample_data(alma_client, contents)
+    with Alma_API_Client(alma_key) as alma_client:
+        alma_client.set_content_headers("application/json", "application/json")
+        invoices_created = load_sample_data(alma_client, contents)
     logger.info(
         f"{invoices_created} sample invoices created and ready for manual approval "
         "in the Alma sandbox UI"
@@ -165,8 +190,62 @@ def create_sandbox_sap_data(ctx):
     "their contents will be logged for review, and invoices will also not be marked as "
     "paid in Alma.",
 )
+@click.option(
+    "--preload-funds",
+    is_flag=True,
+    help="Retrieve all funds from Alma in one paged crawl before parsing invoices, "
+    "rather than searching for each fund code as it is found in an invoice.",
+)
+@click.option(
+    "--cache-dir",
+    envvar="LLAMA_CACHE_DIR",
+    help="Directory of a cache of Alma vendor and fund records that persists between "
+    "runs, e.g. so a final run can reuse the records retrieved by that day's review "
+    "run. Cached records expire after 24 hours. Records are not cached if this option "
+    "is not set.",
+)
+@click.option(
+    "--refresh-cache",
+    is_flag=True,
+    help="Ignore cached vendor and fund records and replace them with records "
+    "retrieved from Alma, e.g. after correcting vendor or fund records in Alma.",
+)
+@click.option(
+    "--journal-dir",
+    envvar="LLAMA_JOURNAL_DIR",
+    default="journals",
+    show_default=True,
+    help="Directory of the journals recording the progress of final real runs, which "
+    "are used to resume runs that fail partway through.",
+)
+@click.option(
+    "--resume",
+    metavar="RUN-ID",
+    help="Resume a failed final real run, using its journal to skip any steps it "
+    "completed. Files already sent to SAP are not sent again and invoices already "
+    "marked as paid in Alma are not marked again. Must be passed with the "
+    "'--final-run' and '--real-run' flags.",
+)
+@click.option(
+    "--parallel",
+    is_flag=True,
+    help="Do the monograph and serial runs at the same time rather than one after the "
+    "other. Each run uses its own Alma, SFTP and SES clients, and Alma API requests "
+    "share the usual rate limit. Logs of each run are held back until both finish and "
+    "then logged in full, monographs first.",
+)
 @click.pass_context
-def sap_invoices(ctx, final_run, real_run):
+def sap_invoices(
+    ctx,
+    final_run,
+    real_run,
+    preload_funds,
+    cache_dir,
+    refresh_cache,
+    journal_dir,
+    resume,
+    parallel,
+):
     """Process invoices for payment via SAP.
 
     Retrieves "Waiting to be sent" invoices from Alma, extracts and formats data
@@ -175,60 +254,177 @@ def sap_invoices(ctx, final_run, real_run):
     formatted cover sheets and summary reports to Acquisitions staff, submits data and
     control files to SAP, and marks invoices as paid in Alma after submission to SAP.
     """
-    logger.info(
-        f"Starting SAP invoices process with options:\n"
-        f"    Date: {ctx.obj['today']}\n"
-        f"    Final run: {final_run}\n"
-        f"    Real run: {real_run}"
-    )
-
-    # Retrieve and sort invoices from Alma, log result or abort process if no invoices
-    # retrieved
-    alma_client = Alma_API_Client(CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_KEY"))
-    alma_client.set_content_headers("application/json", "application/json")
-    invoice_records = sap.retrieve_sorted_invoices(alma_client)
-    if len(invoice_records) > 0:
-        logger.info(f"{len(invoice_records)} invoices retrieved from Alma")
-    else:
+    if resume and not (final_run and real_run):
+        raise click.UsageError(
+            "'--resume' may only be used with the '--final-run' and '--real-run' flags"
+        )
+    journal = None
+    if final_run and real_run:
+        run_id = resume or ctx.obj["today"].strftime("%Y%m%d%H%M%S")
+        journal_path = os.path.join(journal_dir, f"{run_id}.jsonl")
+        if resume and not os.path.exists(journal_path):
+            raise click.BadParameter(
+                f"no journal found for run '{resume}' in '{journal_dir}'",
+                param_hint="'--resume'",
+            )
+        os.makedirs(journal_dir, exist_ok=True)
+        journal = RunJournal(journal_path)
         logger.info(
-            "No invoices waiting to be sent in Alma, aborting SAP invoice process"
+            f"Recording progress of run '{run_id}' in {journal_path}, if the run "
+            "fails it can be finished with 'llama sap-invoices --final-run --real-run "
+            f"--resume {run_id}'"
+        )
+    try:
+        run_started = journal.find("run_started") if journal else None
+        if run_started:
+            date = datetime.datetime.fromisoformat(run_started["date"])
+        else:
+            date = ctx.obj["today"]
+        logger.info(
+            f"Starting SAP invoices process with options:\n"
+            f"    Date: {date}\n"
+            f"    Final run: {final_run}\n"
+            f"    Real run: {real_run}\n"
+            f"    Preload funds: {preload_funds}\n"
+            f"    Resume: {resume}\n"
+            f"    Parallel: {parallel}"
         )
-        raise click.Abort()
 
-    # Parse retrieved invoices and extract data needed for SAP
-    problem_invoices, parsed_invoices = sap.parse_invoice_records(
-        alma_client, invoice_records
-    )
-    logger.info(f"{len(problem_invoices)} problem invoices found.")
+        # Retrieve and sort invoices from Alma, log result or abort process if no
+        # invoices retrieved. A resumed run may have marked all its invoices paid
+        # already but still have other steps to finish, so it is never aborted.
+        with open_metadata_cache(cache_dir, refresh_cache) as cache, Alma_API_Client(
+            CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_KEY"),
+            page_workers=ALMA_PAGE_WORKERS,
+            cache=cache,
+        ) as alma_client:
+            alma_client.set_content_headers("application/json", "application/json")
+            invoice_records = sap.retrieve_sorted_invoices(alma_client)
+            if len(invoice_records) > 0:
+                logger.info(f"{len(invoice_records)} invoices retrieved from Alma")
+            elif not run_started:
+                logger.info(
+                    "No invoices waiting to be sent in Alma, aborting SAP invoice "
+                    "process"
+                )
+                raise click.Abort()
 
-    # Split invoices into monographs and serials
-    monograph_invoices, serial_invoices = sap.split_invoices_by_field_value(
-        parsed_invoices, "type", "monograph", "serial"
-    )
-    logger.info(f"{len(monograph_invoices)} monograph invoices retrieved and parsed.")
-    logger.info(f"{len(serial_invoices)} serial invoices retrieved and parsed.")
-
-    # Do the SAP run for monograph invoices, then serial invoices
-    monograph_sequence_number = sap.generate_next_sap_sequence_number()
-    serial_sequence_number = str(int(monograph_sequence_number) + 1)
-    monograph_result = sap.run(
-        problem_invoices,
-        monograph_invoices,
-        "monograph",
-        monograph_sequence_number,
-        ctx.obj["today"],
-        final_run,
-        real_run,
-    )
-    serial_result = sap.run(
-        problem_invoices,
-        serial_invoices,
-        "serial",
-        serial_sequence_number,
-        ctx.obj["today"],
-        final_run,
-        real_run,
-    )
+            # Parse retrieved invoices and extract data needed for SAP
+            retrieved_funds = sap.preload_funds(alma_client) if preload_funds else None
+            retrieved_vendors, retrieved_funds = sap.prefetch_vendors_and_funds(
+                alma_client,
+                invoice_records,
+                retrieved_funds,
+                workers=ALMA_LOOKUP_WORKERS,
+            )
+            problem_invoices, parsed_invoices = sap.parse_invoice_records(
+                alma_client, invoice_records, retrieved_funds, retrieved_vendors
+            )
+            if cache is not None:
+                logger.info(
+                    f"Alma metadata cache: {cache.hits} hits, {cache.misses} misses"
+                )
+        logger.info(f"{len(problem_invoices)} problem invoices found.")
+
+        # Split invoices into monographs and serials. If resuming a run that already
+        # sent files to SAP, use the invoices in those files rather than the invoices
+        # still waiting to be sent, which exclude any already marked paid.
+        invoices_by_type = dict(
+            zip(
+                ("monograph", "serial"),
+                sap.split_invoices_by_field_value(
+                    parsed_invoices, "type", "monograph", "serial"
+                ),
+            )
+        )
+        for invoices_type in invoices_by_type:
+            files_sent = journal and journal.find(
+                "files_sent", invoices_type=invoices_type
+            )
+            if files_sent:
+                invoices_by_type[invoices_type] = sap.deserialize_invoices(
+                    files_sent["invoices"]
+                )
+        monograph_invoices = invoices_by_type["monograph"]
+        serial_invoices = invoices_by_type["serial"]
+        logger.info(
+            f"{len(monograph_invoices)} monograph invoices retrieved and parsed."
+        )
+        logger.info(f"{len(serial_invoices)} serial invoices retrieved and parsed.")
+
+        # Do the SAP run for monograph invoices, then serial invoices, or both at once
+        # if running in parallel
+        if run_started:
+            monograph_sequence_number = run_started["monograph_sequence_number"]
+            serial_sequence_number = run_started["serial_sequence_number"]
+        else:
+            monograph_sequence_number = sap.generate_next_sap_sequence_number()
+            serial_sequence_number = str(int(monograph_sequence_number) + 1)
+            if journal:
+                journal.record(
+                    "run_started",
+                    date=date.isoformat(),
+                    monograph_sequence_number=monograph_sequence_number,
+                    serial_sequence_number=serial_sequence_number,
+                )
+        runs = [
+            (monograph_invoices, "monograph", monograph_sequence_number),
+            (serial_invoices, "serial", serial_sequence_number),
+        ]
+        if parallel:
+            with RunLogBuffer() as run_logs, ThreadPoolExecutor(
+                max_workers=len(runs)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        run_logs.capture(sap.run),
+                        problem_invoices,
+                        invoices,
+                        invoices_type,
+                        sequence_number,
+                        date,
+                        final_run,
+                        real_run,
+                        journal=journal,
+                        update_sequence=False,
+                    )
+                    for invoices, invoices_type, sequence_number in runs
+                ]
+                monograph_result, serial_result = [f.result() for f in futures]
+            # Both runs are complete, so the sequence can be updated once to the last
+            # sequence number used
+            if final_run and real_run:
+                if journal and journal.find("sequence_updated", invoices_type="serial"):
+                    logger.info("Resuming run, SAP sequence was already updated")
+                else:
+                    logger.info("Real run, updating SAP sequence in Parameter Store")
+                    sap.update_sap_sequence(serial_sequence_number, date, "ser")
+                    if journal:
+                        for _, invoices_type, _ in runs:
+                            journal.record(
+                                "sequence_updated", invoices_type=invoices_type
+                            )
+        else:
+            monograph_result, serial_result = [
+                sap.run(
+                    problem_invoices,
+                    invoices,
+                    invoices_type,
+                    sequence_number,
+                    date,
+                    final_run,
+                    real_run,
+                    journal=journal,
+                )
+                for invoices, invoices_type, sequence_number in runs
+            ]
+    finally:
+        if journal:
+            journal.close()
+        logger.info(
+            "Alma API requests throttled for "
+            f"{alma.ALMA_RATE_LIMITER.throttled_seconds:.2f} seconds"
+        )
 
     # Log the final outcome
     logger.info(
@@ -26,6 +26,12 @@ EXPECTED_CONFIG_VALUES = {
     "SES_SEND_FROM_EMAIL": "SES_SEND_FROM_EMAIL",
 }
 
+# Optional configuration values in the form
+# "name_of_config_value": ("name_of_env_variable_or_ssm_parameter", "default_value")
+OPTIONAL_CONFIG_VALUES = {
+    "ALMA_API_REQUESTS_PER_SECOND": ("ALMA_API_REQUESTS_PER_SECOND", "10"),
+}
+
 SSM_ENVS = ("prod", "stage")
 
 
@@ -59,10 +65,17 @@ class Config:
                     raise Exception(
                         f"Parameter does not exist: {self.SSM_PATH + value}"
                     ) from e
+            for key, (value, default) in OPTIONAL_CONFIG_VALUES.items():
+                try:
+                    setattr(self, key, ssm.get_parameter_value(self.SSM_PATH + value))
+                except ssm.client.exceptions.ParameterNotFound:
+                    setattr(self, key, default)
 
         else:
             for key, value in EXPECTED_CONFIG_VALUES.items():
                 setattr(self, key, os.getenv(value))
+            for key, (value, default) in OPTIONAL_CONFIG_VALUES.items():
+                setattr(self, key, os.getenv(value, default))
 
     @staticmethod
     def get_required_env_variable(variable_name: str) -> None:
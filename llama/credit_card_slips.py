@@ -1,9 +1,63 @@
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
 from defusedxml import ElementTree as ET
+from requests import HTTPError
+
+logger = logging.getLogger(__name__)
+
+# Number of consecutive brief PO lines older than the requested date to see before
+# ending a newest first scan early, which guards against Alma ignoring the ordering.
+EARLY_STOP_CONFIRMATION = 100
+
+SLIP_TEMPLATE_FILE = "config/credit_card_slip_template.xml"
+# Precompiled slot index for SLIP_TEMPLATE_FILE, regenerate with save_slot_index after
+# changing the template.
+SLIP_SLOT_INDEX_FILE = "config/credit_card_slip_template.index.json"
+
+
+class FundAccountCache:
+    """Cache of fund code to account number lookups for a single run.
+
+    Most credit card slips share a handful of fund codes, so each code is only looked
+    up in Alma once per run. Entries expire after `ttl` seconds if one is given.
+
+    Attributes:
+        client: Alma_API_Client used to look up uncached fund codes.
+        ttl: Optional number of seconds an account number stays cached.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that required an Alma API call.
+    """
 
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._accounts = {}
 
-def create_po_line_dict(alma_api_client, po_line_record):
+    def get_account(self, fund_code):
+        """Get account number for a fund code, calling Alma only on a cache miss."""
+        cached = self._accounts.get(fund_code)
+        if cached is not None and (self.ttl is None or cached[1] > time.monotonic()):
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        response = self.client.get_fund_by_code(fund_code)
+        account = response.get("fund", [{}])[0].get("external_id")
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._accounts[fund_code] = (account, expires)
+        return account
+
+
+def create_po_line_dict(alma_api_client, po_line_record, fund_cache=None):
     """Create dict of the required data for credit card slips from a PO line record. The
-    keys of the dict map to the appropriate element classes in the XML template."""
+    keys of the dict map to the appropriate element classes in the XML template. Fund
+    lookups go through fund_cache if one is provided."""
     po_line_dict = {}
     po_line_dict["vendor"] = po_line_record.get("vendor_account", "No vendor found")
     po_line_dict["poline"] = po_line_record.get("number", "No PO Line number found")
@@ -30,33 +84,44 @@ def create_po_line_dict(alma_api_client, po_line_record):
         .get("fund_code", {})
         .get("value")
     )
-    po_line_dict["account_1"] = get_account_from_fund_code(alma_api_client, fund_code_1)
+    po_line_dict["account_1"] = get_account_from_fund_code(
+        alma_api_client, fund_code_1, fund_cache
+    )
     if len(po_line_record.get("fund_distribution", [{}])) > 1:
         fund_code_2 = (
             po_line_record["fund_distribution"][1].get("fund_code", {}).get("value")
         )
         po_line_dict["account_2"] = get_account_from_fund_code(
-            alma_api_client, fund_code_2
+            alma_api_client, fund_code_2, fund_cache
         )
     po_line_dict["cardholder"] = get_cardholder_from_notes(po_line_record)
     return po_line_dict
 
 
-def create_po_line_dicts(alma_api_client, full_po_line_records):
+def create_po_line_dicts(alma_api_client, full_po_line_records, fund_cache=None):
     """Create PO line dicts from a set of full PO line records and return a generator for
-    easier use by other functions."""
+    easier use by other functions. Fund lookups are shared across all records through
+    a FundAccountCache, which is created for the run if one is not provided."""
+    if fund_cache is None:
+        fund_cache = FundAccountCache(alma_api_client)
     for full_po_line_record in full_po_line_records:
         po_line_dict = create_po_line_dict(
             alma_api_client,
             full_po_line_record,
+            fund_cache,
         )
         yield po_line_dict
+    logger.info(
+        f"Fund lookups: {fund_cache.hits} cache hits, {fund_cache.misses} Alma API calls"
+    )
 
 
-def get_account_from_fund_code(client, fund_code):
-    """Get account number based on a fund code."""
+def get_account_from_fund_code(client, fund_code, fund_cache=None):
+    """Get account number based on a fund code, using fund_cache if provided."""
     if fund_code is None:
         account = "No fund code found"
+    elif fund_cache is not None:
+        account = fund_cache.get_account(fund_code)
     else:
         response = client.get_fund_by_code(fund_code)
         account = response.get("fund", [{}])[0].get("external_id")
@@ -75,19 +140,84 @@ def get_cardholder_from_notes(po_line_record):
     return cardholder
 
 
-def get_credit_card_full_po_lines_from_date(alma_api_client, date):
+def get_credit_card_full_po_lines_from_date(alma_api_client, date, workers=1):
     """Get a list of full PO line records for credit card purchases (acquisition_methood =
-    "PURCHASE_NOLETTER" from the specified date."""
-    brief_po_lines = alma_api_client.get_brief_po_lines("PURCHASE_NOLETTER")
-    credit_card_full_po_lines = []
-    for brief_po_line in (
-        p
-        for p in brief_po_lines
-        if p.get("created_date") == f"{date}Z" and p.get("number") is not None
-    ):
-        full_po_line = alma_api_client.get_full_po_line(brief_po_line.get("number"))
-        credit_card_full_po_lines.append(full_po_line)
-    return credit_card_full_po_lines
+    "PURCHASE_NOLETTER" from the specified date.
+
+    If workers is greater than 1, full PO lines are fetched concurrently with up to that
+    many threads. Records are always returned in the same order as the brief PO lines,
+    and an HTTPError from any single fetch is raised rather than skipped.
+    """
+    po_line_numbers = get_credit_card_po_line_numbers_from_date(alma_api_client, date)
+    if workers <= 1 or len(po_line_numbers) <= 1:
+        return [alma_api_client.get_full_po_line(n) for n in po_line_numbers]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(alma_api_client.get_full_po_line, po_line_numbers))
+
+
+def get_credit_card_po_line_numbers_from_date(alma_api_client, date):
+    """Get the PO line numbers of credit card purchases from the specified date.
+
+    The Alma PO line API cannot filter by created date, so brief PO lines are requested
+    newest first and paging stops once they are older than the date. If Alma rejects
+    the ordering, all brief PO lines are scanned and filtered instead.
+    """
+    created_date = f"{date}Z"
+    try:
+        brief_po_lines = alma_api_client.get_brief_po_lines(
+            "PURCHASE_NOLETTER", order_by="created_date", direction="desc"
+        )
+        po_line_numbers, scanned = filter_po_lines_by_created_date(
+            brief_po_lines, created_date, newest_first=True
+        )
+    except HTTPError as e:
+        if e.response is None or e.response.status_code != 400:
+            raise
+        logger.warning(
+            "Alma could not order PO lines by created date, scanning all PO lines"
+        )
+        brief_po_lines = alma_api_client.get_brief_po_lines("PURCHASE_NOLETTER")
+        po_line_numbers, scanned = filter_po_lines_by_created_date(
+            brief_po_lines, created_date
+        )
+    logger.info(
+        f"Scanned {scanned} brief PO lines, kept {len(po_line_numbers)} created on "
+        f"{date}"
+    )
+    return po_line_numbers
+
+
+def filter_po_lines_by_created_date(brief_po_lines, created_date, newest_first=False):
+    """Get the numbers of brief PO lines created on created_date and the number of brief
+    PO lines scanned to find them.
+
+    If newest_first is True, scanning stops once EARLY_STOP_CONFIRMATION consecutive
+    brief PO lines in order are older than created_date, so an ordering that Alma did
+    not apply cannot end the scan early. If a brief PO line is found out of order, the
+    rest are scanned in full.
+    """
+    po_line_numbers = []
+    scanned = 0
+    older = 0
+    previous_date = None
+    for brief_po_line in brief_po_lines:
+        scanned += 1
+        po_line_date = brief_po_line.get("created_date")
+        if newest_first and po_line_date is not None:
+            if previous_date is not None and po_line_date > previous_date:
+                logger.warning(
+                    "Brief PO lines are not ordered by created date, scanning all PO "
+                    "lines"
+                )
+                newest_first = False
+            elif po_line_date < created_date:
+                older += 1
+                if older >= EARLY_STOP_CONFIRMATION:
+                    break
+            previous_date = po_line_date
+        if po_line_date == created_date and brief_po_line.get("number") is not None:
+            po_line_numbers.append(brief_po_line["number"])
+    return po_line_numbers, scanned
 
 
 def get_po_line_created_date(po_line_record):
@@ -140,6 +270,52 @@ def get_total_price(po_line_record, unit_price):
     return total_price
 
 
+def compile_slot_index(xml_template):
+    """Create an index from each td element class in an XML template to the child index
+    paths of the elements with that class, in document order."""
+    slot_index = {}
+    stack = [(xml_template, [])]
+    while stack:
+        element, path = stack.pop()
+        for i, child in reversed(list(enumerate(element))):
+            child_path = path + [i]
+            stack.append((child, child_path))
+        if element.tag == "td" and element.get("class") and path:
+            slot_index.setdefault(element.get("class"), []).append(path)
+    return slot_index
+
+
+def load_slot_index(template_file, index_file):
+    """Load the compiled slot index for an XML template from the index file, or compile
+    it from the template if the index file is missing or was built from a different
+    version of the template."""
+    with open(template_file, "rb") as f:
+        template_hash = hashlib.sha256(f.read()).hexdigest()
+    try:
+        with open(index_file) as f:
+            compiled = json.load(f)
+        if compiled.get("template_sha256") == template_hash:
+            return compiled["slots"]
+        logger.warning(f"Slot index {index_file} is out of date with {template_file}")
+    except FileNotFoundError:
+        logger.warning(f"Slot index {index_file} not found")
+    return compile_slot_index(load_xml_template(template_file))
+
+
+def save_slot_index(template_file, index_file):
+    """Compile the slot index for an XML template and save it to the index file along
+    with a hash of the template it was compiled from."""
+    with open(template_file, "rb") as f:
+        template_hash = hashlib.sha256(f.read()).hexdigest()
+    compiled = {
+        "template_sha256": template_hash,
+        "slots": compile_slot_index(load_xml_template(template_file)),
+    }
+    with open(index_file, "w") as f:
+        json.dump(compiled, f, indent=2)
+        f.write("\n")
+
+
 def load_xml_template(xml_file):
     """Create Elementree object using XML template."""
     tree = ET.parse(xml_file)
@@ -147,22 +323,36 @@ def load_xml_template(xml_file):
     return xml_template
 
 
-def populate_credit_card_slip(xml_template, po_line_dict):
+def populate_credit_card_slip(xml_template, po_line_dict, slot_index=None):
     """Populate XML template with credit card slip data using a PO line dict with keys
-    that correspond to the element classes in the XML template."""
+    that correspond to the element classes in the XML template. Elements are located
+    with the template's compiled slot index, which is compiled here if not provided."""
+    if slot_index is None:
+        slot_index = compile_slot_index(xml_template)
     for k, v in po_line_dict.items():
-        for element in xml_template.findall(f'.//td[@class="{k}"]'):
+        for path in slot_index.get(k, []):
+            element = xml_template
+            for i in path:
+                element = element[i]
             element.text = v
     return xml_template
 
 
-def xml_data_from_dicts(po_line_dicts):
-    """Create credit card slips XML data from a set of PO line dicts."""
+def xml_data_from_dicts(
+    po_line_dicts,
+    template_file=SLIP_TEMPLATE_FILE,
+    index_file=SLIP_SLOT_INDEX_FILE,
+):
+    """Create credit card slips XML data from a set of PO line dicts.
+
+    The template and its slot index are loaded once and the template is copied for
+    each slip. The document is serialized once after all slips have been added.
+    """
+    xml_template = load_xml_template(template_file)
+    slot_index = load_slot_index(template_file, index_file)
     xml_root = ET.fromstring("<html></html>")
     for po_line_dict in po_line_dicts:
-        xml_template = load_xml_template("config/credit_card_slip_template.xml")
-        xml_root.append(populate_credit_card_slip(xml_template, po_line_dict))
-        credit_card_slips_xml_data = ET.tostring(
-            xml_root, encoding="unicode", method="xml"
+        xml_root.append(
+            populate_credit_card_slip(deepcopy(xml_template), po_line_dict, slot_index)
         )
-    return credit_card_slips_xml_data
+    return ET.tostring(xml_root, encoding="unicode", method="xml")
@@ -58,7 +58,9 @@ class Email(EmailMessage):
 
         Currently uses SES but could easily be switched out for another method if needed.
         """
-        ses = boto3.client("ses", region_name="us-east-1")
+        # Each send gets its own session because the default boto3 session is not
+        # thread-safe and emails may be sent from concurrent runs
+        ses = boto3.session.Session().client("ses", region_name="us-east-1")
         destinations = self["To"].split(",")
         if self["Cc"]:
             destinations.extend(self["Cc"].split(","))
@@ -0,0 +1,145 @@
+"""Module for declaring, writing and parsing fixed-width record layouts."""
+
+from math import fsum
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, TextIO
+
+
+class Field(NamedTuple):
+    """A field in a fixed-width record.
+
+    Attributes:
+        name: Key of the field's value in the mappings passed to
+            FixedWidthLayout.pack and returned from FixedWidthLayout.parse. Must be a
+            valid Python identifier.
+        width: Number of characters the field occupies.
+        value: Constant value for fields that are the same in every record. Constant
+            fields are not passed to pack.
+        align: "<" to left align or ">" to right align the value in the field.
+        fill: Character used to pad the value to the field width.
+        decimals: Number of decimal places for amount fields, which are formatted as
+            numbers and parsed as floats.
+        truncate: Whether text values longer than the field are cut to fit. If False, a
+            value that does not fit raises a ValueError when packed.
+    """
+
+    name: str
+    width: int
+    value: Optional[str] = None
+    align: str = "<"
+    fill: str = " "
+    decimals: Optional[int] = None
+    truncate: bool = True
+
+    @property
+    def format_spec(self) -> str:
+        if self.decimals is not None:
+            return f"{self.fill}{self.align}{self.width}.{self.decimals}f"
+        if self.truncate:
+            return f"{self.fill}{self.align}{self.width}.{self.width}"
+        return f"{self.fill}{self.align}{self.width}"
+
+
+class FixedWidthLayout:
+    """A fixed-width record layout compiled from a list of fields.
+
+    The fields are compiled once into a single format string, with constant fields
+    already filled in, so packing a record is one str.format call. The field offsets
+    are compiled into slices for parsing records back into values.
+
+    Attributes:
+        fields: The fields of the record, in order.
+        width: Total number of characters in a record, excluding the line ending.
+    """
+
+    def __init__(self, fields: List[Field]):
+        self.fields = fields
+        self.width = sum(f.width for f in fields)
+        template = []
+        for field in fields:
+            if field.value is None:
+                template.append(f"{{{field.name}:{field.format_spec}}}")
+            else:
+                constant = format(field.value, field.format_spec)
+                template.append(constant.replace("{", "{{").replace("}", "}}"))
+        self._template = "".join(template)
+        self._slices = []
+        start = 0
+        for field in fields:
+            self._slices.append((field, slice(start, start + field.width)))
+            start += field.width
+
+    def pack(self, values: Mapping[str, Any]) -> str:
+        """Pack a mapping of values for the non-constant fields into a record, without
+        a line ending. Raises a ValueError if a value does not fit in its field."""
+        record = self._template.format_map(values)
+        if len(record) != self.width:
+            raise ValueError(
+                f"Packed record is {len(record)} characters but the layout is "
+                f"{self.width}: {record!r}"
+            )
+        return record
+
+    def parse(self, record: str) -> Dict[str, Any]:
+        """Parse a record into a dict of field values, with padding removed and amount
+        fields converted to floats."""
+        record = record.rstrip("\n")
+        if len(record) != self.width:
+            raise ValueError(
+                f"Record is {len(record)} characters but the layout is {self.width}: "
+                f"{record!r}"
+            )
+        values = {}
+        for field, field_slice in self._slices:
+            value = record[field_slice]
+            if field.decimals is not None:
+                values[field.name] = float(value)
+            elif field.align == "<":
+                values[field.name] = value.rstrip(field.fill)
+            else:
+                values[field.name] = value.lstrip(field.fill)
+        return values
+
+
+class FileTotals(NamedTuple):
+    """Totals of the records written by a FixedWidthWriter."""
+
+    bytes: int
+    lines: int
+    amount: float
+
+
+class FixedWidthWriter:
+    """Write fixed-width records to a text file-like object, one record per line,
+    keeping running totals of the bytes, lines and amounts written so summaries of the
+    file need no second pass over it.
+
+    Attributes:
+        out: The text file-like object records are written to.
+        encoding: Encoding used to count the bytes written.
+    """
+
+    def __init__(self, out: TextIO, encoding: str = "utf-8"):
+        self.out = out
+        self.encoding = encoding
+        self._bytes = 0
+        self._lines = 0
+        self._amounts = []
+
+    def write(
+        self,
+        layout: FixedWidthLayout,
+        values: Mapping[str, Any],
+        add_amount: Optional[float] = None,
+    ):
+        """Pack and write a record. If add_amount is given, it is added to the amount
+        total of the file."""
+        line = layout.pack(values) + "\n"
+        self.out.write(line)
+        self._bytes += len(line) if line.isascii() else len(line.encode(self.encoding))
+        self._lines += 1
+        if add_amount is not None:
+            self._amounts.append(add_amount)
+
+    @property
+    def totals(self) -> FileTotals:
+        return FileTotals(self._bytes, self._lines, fsum(self._amounts))
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """A durable, append-only journal of the steps completed by a run.
+
+    Each entry is written as a JSON line and flushed to disk with fsync before record
+    returns, so the journal reflects every completed step even if the process dies.
+    Opening an existing journal loads its entries, which lets a crashed run be resumed
+    without repeating steps that already had side effects. Entries may be recorded
+    from multiple threads.
+
+    Attributes:
+        path: Path of the journal file.
+        entries: All entries in the journal, in the order they were recorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.read().splitlines()
+            for count, line in enumerate(lines):
+                try:
+                    self.entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The process may have died partway through writing the last entry
+                    if count != len(lines) - 1:
+                        raise
+                    logger.warning(f"Ignoring incomplete last entry in journal {path}")
+        self._file = open(path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
+
+    def record(self, event: str, **data):
+        """Durably append an entry for an event with any additional data."""
+        entry = {"event": event, "recorded": datetime.now().isoformat(), **data}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.entries.append(entry)
+
+    def find(self, event: str, **data) -> Optional[dict]:
+        """Return the first entry for an event whose data matches, or None."""
+        for entry in self.entries:
+            if entry["event"] == event and all(
+                entry.get(k) == v for k, v in data.items()
+            ):
+                return entry
+        return None
+
+    def invoice_ids(self, event: str) -> set:
+        """Return the ids of invoices recorded with an event, e.g. "invoice_paid"."""
+        return {e["invoice_id"] for e in self.entries if e["event"] == event}
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """A thread-safe token bucket rate limiter.
+
+    The bucket holds up to `burst` tokens and refills at `requests_per_second`. Each
+    call to acquire takes one token and only blocks when the bucket is empty, so fast
+    requests are not delayed while the budget allows. A single RateLimiter can be
+    shared between clients and worker threads to enforce one combined budget.
+
+    Attributes:
+        requests_per_second: Rate at which tokens are added to the bucket.
+        burst: Maximum number of tokens the bucket can hold.
+        throttled_seconds: Total time callers have been told to wait for a token.
+        throttled_requests: Number of acquired tokens that required waiting.
+    """
+
+    def __init__(self, requests_per_second: float, burst: Optional[int] = None):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be greater than 0")
+        if burst is not None and burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst is not None else max(1, int(requests_per_second))
+        self.throttled_seconds = 0.0
+        self.throttled_requests = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token from the bucket and return the number of seconds the caller
+        must wait before using it.
+
+        Tokens may be reserved ahead of time, so the bucket can go into debt and
+        subsequent callers wait their turn in the order they reserved.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # The clock can appear to move backwards (e.g. when patched in tests), so
+            # never let a negative interval drain the bucket.
+            elapsed = max(0.0, now - self._updated)
+            self._tokens = min(
+                self.burst, self._tokens + elapsed * self.requests_per_second
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.requests_per_second
+            self.throttled_seconds += wait
+            self.throttled_requests += 1
+            return wait
+
+    def acquire(self) -> float:
+        """Block until a token is available and return the time spent waiting."""
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """Wait without blocking the event loop until a token is available and return
+        the time spent waiting."""
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
@@ -0,0 +1,64 @@
+import functools
+import logging
+import threading
+from typing import Callable, Dict, List
+
+
+class RunLogBuffer:
+    """Hold back log records emitted by concurrent runs and replay them run by run.
+
+    While the buffer is open, records logged from a thread running a function wrapped
+    with capture are held back from the root logger's handlers instead of being
+    emitted as they happen. When the buffer is closed, the held records are emitted
+    in the order the runs were captured, so the log of each run stays contiguous and
+    the overall log is the same however the runs interleaved. Records logged from any
+    other thread are emitted immediately as usual.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: List[List[logging.LogRecord]] = []
+        self._threads: Dict[int, List[logging.LogRecord]] = {}
+        self._handlers: List[logging.Handler] = []
+
+    def __enter__(self):
+        self._handlers = list(logging.getLogger().handlers)
+        for handler in self._handlers:
+            handler.addFilter(self._hold)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for handler in self._handlers:
+            handler.removeFilter(self._hold)
+        for records in self._runs:
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+        self._runs = []
+
+    def capture(self, function: Callable) -> Callable:
+        """Wrap a function so the records it logs are held back as a run. Runs are
+        replayed in the order their functions were wrapped."""
+        records: List[logging.LogRecord] = []
+        self._runs.append(records)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            thread = threading.get_ident()
+            with self._lock:
+                self._threads[thread] = records
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self._lock:
+                    del self._threads[thread]
+
+        return wrapper
+
+    def _hold(self, record: logging.LogRecord) -> bool:
+        records = self._threads.get(record.thread)
+        if records is None:
+            return True
+        # The filter runs once per handler, so only hold the record the first time
+        if not records or records[-1] is not record:
+            records.append(record)
+        return False
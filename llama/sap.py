@@ -1,17 +1,21 @@
 """Module with functions necessary for processing invoices to send to SAP."""
 
 import collections
+import io
 import json
 import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from math import fsum
-from typing import List, Literal, Optional, Tuple
-
-import flatdict
+from typing import List, Literal, Optional, TextIO, Tuple
 
 from llama import CONFIG
 from llama.alma import Alma_API_Client
 from llama.email import Email
+from llama.fixed_width import Field, FileTotals, FixedWidthLayout, FixedWidthWriter
+from llama.journal import RunJournal
 from llama.sftp import SFTP
 from llama.ssm import SSM
 
@@ -20,6 +24,72 @@ logger = logging.getLogger(__name__)
 with open("config/countries.json") as f:
     COUNTRIES = json.load(f)
 
+MULTIBYTE_CHARACTER = re.compile(r"[^\x00-\x7f]")
+
+
+# SAP data and control file layouts, see
+# https://docs.google.com/spreadsheets/d/1PSEYSlPaQ0g2LTEIR6hdyBPzWrZLRK2K/
+# edit#gid=1667272331 and
+# https://wikis.mit.edu/confluence/display/SAPdev/MIT+SAP+Dropbox
+SAP_DATA_HEADER_LAYOUT = FixedWidthLayout(
+    [
+        Field("record_type", 1, value="B"),
+        # date string is supposed to be listed twice
+        Field("document_date", 8),
+        Field("baseline_date", 8),
+        Field("external_reference", 16),
+        Field("company_code", 4, value="X000"),
+        Field("vendor_number", 6, value="400000"),
+        Field("total_amount", 16, align=">", decimals=2),
+        # sign of total amount. we don't send credits so this will always be blank
+        # (positive)
+        Field("sign", 1, value=" "),
+        Field("payment_method", 1, value=" "),
+        Field("payment_method_supplement", 2, value=" "),
+        Field("payment_terms", 4, value=" "),
+        Field("payment_block", 1, value=" "),
+        Field("individual_payee", 1, value="X"),
+        Field("vendor_name", 35),
+        Field("city", 35),
+        Field("payee_name_line_2", 35),
+        # We treat all addresses as street addresses. PO Box indicator should always
+        # be blank.
+        Field("po_box_indicator", 1, value=" "),
+        Field("street_or_po_box_num", 35),
+        Field("postal_code", 10),
+        Field("state_or_province", 3),
+        Field("country", 3),
+        Field("text", 50, value=" "),
+        Field("payee_name_line_3", 35),
+    ]
+)
+SAP_DATA_DISTRIBUTION_LAYOUT = FixedWidthLayout(
+    [
+        Field("record_type", 1),
+        Field("gl_account", 10),
+        Field("cost_object", 12),
+        Field("amount", 16, align=">", decimals=2),
+        # sign of fund amount. we don't send credits so this will always be blank
+        # (positive)
+        Field("sign", 1, value=" "),
+    ]
+)
+SAP_CONTROL_LAYOUT = FixedWidthLayout(
+    [
+        Field("byte_count", 16, align=">", fill="0", truncate=False),
+        # the spec says "record count", but accounts payable says that this should be
+        # a count of the number of lines in the data file
+        Field("line_count", 16, align=">", fill="0", truncate=False),
+        # we don't send credits to SAP so this will always be 20 0's
+        Field("credit_total", 20, value="0", align=">", fill="0"),
+        Field("debit_total", 20, align=">", fill="0", truncate=False),
+        # we just repeat the invoice total here
+        Field("control_3", 20, align=">", fill="0", truncate=False),
+        # Accounts payable told us to use this string
+        Field("control_4", 20, value="00100100000000000000"),
+    ]
+)
+
 
 class FundError(Exception):
     """Exception raised for errors when retrieving a fund by code.
@@ -53,14 +123,101 @@ def retrieve_sorted_invoices(alma_client):
     return sorted(data, key=lambda i: (i["vendor"].get("value", 0), i.get("number", 0)))
 
 
+def preload_funds(alma_client: Alma_API_Client) -> dict:
+    """Retrieve all funds from Alma and index them by fund code.
+
+    Returns a dict of fund records in the same form as the retrieved funds passed to
+    populate_fund_data, so it can seed that lookup with one paged crawl of the funds
+    endpoint instead of one fund code search per fund. Funds are matched on their exact
+    code, unlike the contains search used by get_fund_by_code.
+    """
+    retrieved_funds = {}
+    for fund in alma_client.get_funds():
+        retrieved_funds[fund["code"]] = {"fund": [fund], "total_record_count": 1}
+    logger.info(f"{len(retrieved_funds)} funds preloaded from Alma")
+    return retrieved_funds
+
+
+def prefetch_vendors_and_funds(
+    alma_client: Alma_API_Client,
+    invoice_records: List[dict],
+    retrieved_funds: Optional[dict] = None,
+    workers: int = 4,
+) -> Tuple[dict, dict]:
+    """Retrieve the vendors and funds used by a list of invoice records concurrently.
+
+    Collects the distinct vendor codes and fund codes across all invoice records and
+    retrieves them with up to `workers` threads sharing the client's rate limiter. Fund
+    codes already in retrieved_funds are not retrieved again. Returns dicts of
+    retrieved vendors and funds that parse_invoice_records can use without calling
+    Alma. Vendors without a usable address are returned as None.
+    """
+    retrieved_funds = dict(retrieved_funds or {})
+    vendor_codes = [i["vendor"]["value"] for i in invoice_records]
+    fund_codes = [
+        fund_distribution["fund_code"]["value"]
+        for invoice_record in invoice_records
+        for invoice_line in invoice_record["invoice_lines"]["invoice_line"]
+        for fund_distribution in invoice_line["fund_distribution"]
+    ]
+    distinct_vendor_codes = list(dict.fromkeys(vendor_codes))
+    distinct_fund_codes = [
+        c for c in dict.fromkeys(fund_codes) if c not in retrieved_funds
+    ]
+
+    def timed(function, *args):
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+        except VendorAddressError:
+            result = None
+        return result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        vendor_results = executor.map(
+            lambda c: timed(populate_vendor_data, alma_client, c),
+            distinct_vendor_codes,
+        )
+        fund_results = executor.map(
+            lambda c: timed(alma_client.get_fund_by_code, c), distinct_fund_codes
+        )
+        retrieved_vendors = {}
+        serial_seconds = 0.0
+        for vendor_code, (vendor_data, seconds) in zip(
+            distinct_vendor_codes, vendor_results
+        ):
+            retrieved_vendors[vendor_code] = vendor_data
+            serial_seconds += seconds
+        for fund_code, (fund_record, seconds) in zip(distinct_fund_codes, fund_results):
+            retrieved_funds[fund_code] = fund_record
+            serial_seconds += seconds
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Prefetched {len(distinct_vendor_codes)} distinct vendors for "
+        f"{len(vendor_codes)} vendor lookups and {len(distinct_fund_codes)} distinct "
+        f"funds for {len(fund_codes)} fund lookups in {elapsed:.2f} seconds, "
+        f"{max(0.0, serial_seconds - elapsed):.2f} seconds faster than one at a time"
+    )
+    return retrieved_vendors, retrieved_funds
+
+
 def parse_invoice_records(
-    alma_client: Alma_API_Client, invoice_records: List[dict]
+    alma_client: Alma_API_Client,
+    invoice_records: List[dict],
+    retrieved_funds: Optional[dict] = None,
+    retrieved_vendors: Optional[dict] = None,
 ) -> List[dict]:
-    """Parse a list of invoice records from Alma and return extracted SAP data."""
+    """Parse a list of invoice records from Alma and return extracted SAP data.
+
+    Vendors and funds are looked up in retrieved_vendors and retrieved_funds, e.g. from
+    prefetch_vendors_and_funds or preload_funds, before being retrieved individually
+    from Alma.
+    """
     parsed_invoices = []
     problem_invoices = []
-    retrieved_vendors = {}
-    retrieved_funds = {}
+    retrieved_vendors = dict(retrieved_vendors or {})
+    retrieved_funds = dict(retrieved_funds or {})
     for count, invoice_record in enumerate(invoice_records):
         logger.info(
             f"Extracting data for invoice {invoice_record['id']}, "
@@ -68,17 +225,18 @@ def parse_invoice_records(
         )
         invoice_data = extract_invoice_data(invoice_record)
         vendor_code = invoice_record["vendor"]["value"]
-        try:
-            invoice_data["vendor"] = retrieved_vendors[vendor_code]
-        except KeyError:
+        if vendor_code not in retrieved_vendors:
             logger.debug(f"Retrieving data for vendor {vendor_code}")
             try:
                 retrieved_vendors[vendor_code] = populate_vendor_data(
                     alma_client, vendor_code
                 )
-                invoice_data["vendor"] = retrieved_vendors[vendor_code]
             except VendorAddressError:
-                invoice_data["vendor_address_error"] = vendor_code
+                retrieved_vendors[vendor_code] = None
+        if retrieved_vendors[vendor_code] is None:
+            invoice_data["vendor_address_error"] = vendor_code
+        else:
+            invoice_data["vendor"] = retrieved_vendors[vendor_code]
         try:
             invoice_data["funds"], retrieved_funds = populate_fund_data(
                 alma_client, invoice_record, retrieved_funds
@@ -104,16 +262,37 @@ def check_for_multibyte(invoice) -> list:
     one byte to be represented in UTF-8
 
     WHY?: SAP system does not support multibyte characters
+
+    Walks the nested invoice dict without flattening it. Any character outside ASCII
+    takes more than one byte in UTF-8, so pure ASCII strings are accepted with a
+    single str.isascii check and only the others are scanned for the offending
+    characters and their positions. Fields are named by their nested keys and list
+    indexes joined with ":".
     """
     multibyte_characters = []
-
-    for nested_key, value in flatdict.FlatterDict(invoice).items():
+    stack = [("", invoice)]
+    while stack:
+        field, value = stack.pop()
         if isinstance(value, str):
-            for char in value:
-                if len(char.encode("utf-8")) > 1:
+            if not value.isascii():
+                for match in MULTIBYTE_CHARACTER.finditer(value):
                     multibyte_characters.append(
-                        {"field": nested_key, "character": char}
+                        {
+                            "field": field,
+                            "character": match.group(),
+                            "position": match.start(),
+                        }
                     )
+        elif isinstance(value, dict):
+            stack.extend(
+                (f"{field}:{k}" if field else str(k), v)
+                for k, v in reversed(list(value.items()))
+            )
+        elif isinstance(value, (list, tuple)):
+            stack.extend(
+                (f"{field}:{i}" if field else str(i), v)
+                for i, v in reversed(list(enumerate(value)))
+            )
     return multibyte_characters
 
 
@@ -236,12 +415,12 @@ def populate_fund_data(
             except KeyError:
                 logger.debug(f"Retrieving data for fund {fund_code}")
                 fund_record = alma_client.get_fund_by_code(fund_code)
-                # If alma does not return fund information add the fund code to the
-                # list of fund code errors and move on to the next fund code
-                if fund_record["total_record_count"] == 0:
-                    fund_code_errors.append(fund_code)
-                    continue
                 retrieved_funds[fund_code] = fund_record
+            # If alma does not return fund information add the fund code to the
+            # list of fund code errors and move on to the next fund code
+            if fund_record["total_record_count"] == 0:
+                fund_code_errors.append(fund_code)
+                continue
             external_id = fund_record["fund"][0]["external_id"].strip()
             try:
                 # Combine amounts for funds that have the same external ID (AKA the
@@ -285,49 +464,56 @@ def split_invoices_by_field_value(
 
 
 def generate_report(today: datetime, invoices: List[dict]) -> str:
+    """Return the cover sheet report for a list of invoices as a string."""
+    report = io.StringIO()
+    write_report(report, today, invoices)
+    return report.getvalue()
+
+
+def write_report(out: TextIO, today: datetime, invoices: List[dict]):
+    """Write the cover sheet report for a list of invoices to a text file-like
+    object."""
     today_string = today.strftime("%m/%d/%Y")
-    report = ""
     for invoice in invoices:
-        report += f"\n\n{'':33}MIT LIBRARIES\n\n\n"
-        report += (
+        out.write(f"\n\n{'':33}MIT LIBRARIES\n\n\n")
+        out.write(
             f"Date: {today_string:<36}Vendor code   : {invoice['vendor']['code']}\n"
         )
-        report += f"{'Accounting ID :':>57}\n\n"
-        report += f"Vendor:  {invoice['vendor']['name']}\n"
+        out.write(f"{'Accounting ID :':>57}\n\n")
+        out.write(f"Vendor:  {invoice['vendor']['name']}\n")
         for line in invoice["vendor"]["address"]["lines"]:
-            report += f"         {line}\n"
-        report += "         "
+            out.write(f"         {line}\n")
+        out.write("         ")
         if invoice["vendor"]["address"]["city"]:
-            report += f"{invoice['vendor']['address']['city']}, "
+            out.write(f"{invoice['vendor']['address']['city']}, ")
         if invoice["vendor"]["address"]["state or province"]:
-            report += f"{invoice['vendor']['address']['state or province']} "
+            out.write(f"{invoice['vendor']['address']['state or province']} ")
         if invoice["vendor"]["address"]["postal code"]:
-            report += f"{invoice['vendor']['address']['postal code']}"
-        report += f"\n         {invoice['vendor']['address']['country']}\n\n"
-        report += (
+            out.write(f"{invoice['vendor']['address']['postal code']}")
+        out.write(f"\n         {invoice['vendor']['address']['country']}\n\n")
+        out.write(
             "Invoice no.            Fiscal Account     Amount            Inv. Date\n"
         )
-        report += (
+        out.write(
             "------------------     -----------------  -------------     ----------\n"
         )
         for fund in invoice["funds"]:
-            report += f"{invoice['number'] + invoice['date'].strftime('%y%m%d'):<23}"
-            report += (
+            out.write(f"{invoice['number'] + invoice['date'].strftime('%y%m%d'):<23}")
+            out.write(
                 f"{invoice['funds'][fund]['cost object']} "
                 f"{invoice['funds'][fund]['G/L account']}     "
             )
-            report += f"{invoice['funds'][fund]['amount']:<18,.2f}"
-            report += f"{invoice['date'].strftime('%m/%d/%Y')}\n"
-        report += "\n\n"
-        report += (
+            out.write(f"{invoice['funds'][fund]['amount']:<18,.2f}")
+            out.write(f"{invoice['date'].strftime('%m/%d/%Y')}\n")
+        out.write("\n\n")
+        out.write(
             f"Total/Currency:             {invoice['total amount']:,.2f}      "
             f"{invoice['currency']}\n\n"
         )
-        report += f"Payment Method:  {invoice['payment method']}\n\n\n"
-        report += f"{'Departmental Approval':>44} {'':_<34}\n\n"
-        report += f"{'Financial Services Approval':>50} {'':_<28}\n\n\n"
-        report += "\f"
-    return report
+        out.write(f"Payment Method:  {invoice['payment method']}\n\n\n")
+        out.write(f"{'Departmental Approval':>44} {'':_<34}\n\n")
+        out.write(f"{'Financial Services Approval':>50} {'':_<28}\n\n\n")
+        out.write("\f")
 
 
 def generate_sap_report_email(
@@ -392,88 +578,104 @@ def generate_sap_data(today: datetime, invoices: List[dict]) -> str:
     data formatted according to Accounts Payable's specifications.
     See https://docs.google.com/spreadsheets/d/1PSEYSlPaQ0g2LTEIR6hdyBPzWrZLRK2K/
     edit#gid=1667272331 for specifications for data file"""
+    sap_data = io.StringIO()
+    write_sap_data(sap_data, today, invoices)
+    return sap_data.getvalue()
+
+
+def write_sap_data(out: TextIO, today: datetime, invoices: List[dict]) -> FileTotals:
+    """Write SAP invoice data for a list of pre-processed invoices to a text file-like
+    object, see generate_sap_data. Returns the byte, line and invoice amount totals of
+    the data written, for generating the control file."""
     today_string = today.strftime("%Y%m%d")
-    sap_data = ""
+    writer = FixedWidthWriter(out)
     for invoice in invoices:
         (
             payee_name_line_2,
             street_or_po_box_num,
             payee_name_line_3,
         ) = format_address_for_sap(invoice["vendor"]["address"]["lines"])
-        sap_data += "B"
-        # date string is supposed to be listed twice
-        sap_data += f"{today_string}"  # Document Date
-        sap_data += f"{today_string}"  # Baseline Date
-        # we add the invoice date to the invoice number to create a hopefully unique
-        # External Reference number
-        sap_data += f"{invoice['number'] + invoice['date'].strftime('%y%m%d'): <16.16}"
-        sap_data += "X000"
-        sap_data += "400000"
-        sap_data += f"{invoice['total amount']:16.2f}"
-        # sign of total amount. we don't send credits
-        # so this will always be blank (positive)
-        sap_data += " "
-        sap_data += " "  # payment method
-        sap_data += "  "  # payment method supplement
-        sap_data += "    "  # payment terms
-        sap_data += " "  # payment block
-        sap_data += "X"  # individual payee in document
-        sap_data += f"{invoice['vendor']['name']: <35.35}"
-        sap_data += f"{invoice['vendor']['address']['city'] or ' ': <35.35}"
-        sap_data += f"{payee_name_line_2: <35.35}"
-        # We treat all addresses as street addresses.
-        # PO Box indicator should always be blank.
-        sap_data += " "  # PO Box indicator
-        sap_data += f"{street_or_po_box_num: <35.35}"
-        sap_data += f"{invoice['vendor']['address']['postal code'] or ' ': <10.10}"
-        sap_data += f"{invoice['vendor']['address']['state or province'] or ' ': <3.3}"
-        sap_data += f"{invoice['vendor']['address']['country'] or ' ': <3.3}"
-        sap_data += f"{' ': <50.50}"  # Text: 50
-        sap_data += f"{payee_name_line_3: <35.35}"
-        sap_data += "\n"
+        address = invoice["vendor"]["address"]
+        writer.write(
+            SAP_DATA_HEADER_LAYOUT,
+            {
+                "document_date": today_string,
+                "baseline_date": today_string,
+                # we add the invoice date to the invoice number to create a hopefully
+                # unique External Reference number
+                "external_reference": invoice["number"]
+                + invoice["date"].strftime("%y%m%d"),
+                "total_amount": invoice["total amount"],
+                "vendor_name": invoice["vendor"]["name"],
+                "city": address["city"] or " ",
+                "payee_name_line_2": payee_name_line_2,
+                "street_or_po_box_num": street_or_po_box_num,
+                "postal_code": address["postal code"] or " ",
+                "state_or_province": address["state or province"] or " ",
+                "country": address["country"] or " ",
+                "payee_name_line_3": payee_name_line_3,
+            },
+            add_amount=invoice["total amount"],
+        )
         # write a line for each fund distribution in the invoice
         # the final line should begin with a "D"
         # all previous lines should begin with a "C"
         for i, fund in enumerate(invoice["funds"]):
-            sap_data += "D" if i == len(invoice["funds"]) - 1 else "C"
-            sap_data += (
-                f"{invoice['funds'][fund]['G/L account']: <10.10}"
-                f"{invoice['funds'][fund]['cost object']: <12.12}"
+            writer.write(
+                SAP_DATA_DISTRIBUTION_LAYOUT,
+                {
+                    "record_type": "D" if i == len(invoice["funds"]) - 1 else "C",
+                    "gl_account": invoice["funds"][fund]["G/L account"],
+                    "cost_object": invoice["funds"][fund]["cost object"],
+                    "amount": invoice["funds"][fund]["amount"],
+                },
             )
-            sap_data += f"{invoice['funds'][fund]['amount']:16.2f}"
-            # sign of fund amount. we don't send credits
-            # so this will always be blank (positive)
-            sap_data += " "
-            sap_data += "\n"
-    return sap_data
+    return writer.totals
+
+
+def parse_sap_data(sap_data: str) -> List[dict]:
+    """Parse an SAP data file back into a list of records for verification. Header
+    records begin with "B" and fund distribution records with "C" or "D"."""
+    records = []
+    for line in sap_data.splitlines():
+        if line.startswith("B"):
+            records.append(SAP_DATA_HEADER_LAYOUT.parse(line))
+        else:
+            records.append(SAP_DATA_DISTRIBUTION_LAYOUT.parse(line))
+    return records
 
 
 def generate_summary_warning(problem_invoices: list) -> str:
     """Generates a warning messages about invoice problems that need
     to be resolved before a final-run can take place
     """
-    warning = ""
+    warning = io.StringIO()
+    write_summary_warning(warning, problem_invoices)
+    return warning.getvalue()
+
+
+def write_summary_warning(out: TextIO, problem_invoices: list):
+    """Write the warning messages about invoice problems to a text file-like object."""
     for invoice in problem_invoices:
-        warning += f'Warning! Invoice: {invoice["id"]}\n'
+        out.write(f'Warning! Invoice: {invoice["id"]}\n')
         if "fund_errors" in invoice:
             for fund_code in invoice["fund_errors"]:
-                warning += (
+                out.write(
                     f"There was a problem retrieving data\n"
                     f"for fund: {fund_code}\n\n"
                 )
         if "multibyte_errors" in invoice:
             for multibyte in invoice["multibyte_errors"]:
-                warning += (
+                out.write(
                     f'Invoice field: {multibyte["field"]}\n'
                     f"Contains multibyte "
                     f'character: {multibyte["character"]}\n\n'
                 )
         if "vendor_address_error" in invoice:
-            warning += (
+            out.write(
                 f'No addresses found for vendor: {invoice["vendor_address_error"]}\n\n'
             )
-    warning += "Please fix the above before starting a final-run\n\n"
-    return warning
+    out.write("Please fix the above before starting a final-run\n\n")
 
 
 def generate_summary(
@@ -482,33 +684,50 @@ def generate_summary(
     data_file_name: str,
     control_file_name: str,
 ) -> str:
-    excluded_invoices = ""
+    """Return the summary of an SAP run as a string."""
+    summary = io.StringIO()
+    write_summary(
+        summary, problem_invoices, invoices, data_file_name, control_file_name
+    )
+    return summary.getvalue()
+
+
+def write_summary(
+    out: TextIO,
+    problem_invoices: list,
+    invoices: List[dict],
+    data_file_name: str,
+    control_file_name: str,
+):
+    """Write the summary of an SAP run to a text file-like object."""
+    excluded_invoices = []
     invoice_count = 0
     sum_of_invoices = 0
-    summary = "--- MIT Libraries--- Alma to SAP Invoice Feed\n\n\n\n"
-    summary += f"Data file: {data_file_name}\n\n"
-    summary += f"Control file: {control_file_name}\n\n\n\n"
+    out.write("--- MIT Libraries--- Alma to SAP Invoice Feed\n\n\n\n")
+    out.write(f"Data file: {data_file_name}\n\n")
+    out.write(f"Control file: {control_file_name}\n\n\n\n")
     if problem_invoices:
-        summary += generate_summary_warning(problem_invoices)
+        write_summary_warning(out, problem_invoices)
     for invoice in invoices:
         if invoice["payment method"] == "ACCOUNTINGDEPARTMENT":
-            summary += f"{invoice['vendor']['name']: <39.39}"
-            summary += (
+            out.write(f"{invoice['vendor']['name']: <39.39}")
+            out.write(
                 f"{invoice['number'] + invoice['date'].strftime('%y%m%d'): <20.20}"
             )
-            summary += f"{invoice['total amount']:.2f}\n"
+            out.write(f"{invoice['total amount']:.2f}\n")
             sum_of_invoices += float(invoice["total amount"])
             invoice_count += 1
         else:
-            excluded_invoices += f"{invoice['payment method']}:\t"
-            excluded_invoices += f"{invoice['number']}\t"
-            excluded_invoices += f"{invoice['vendor']['name']}\t"
-            excluded_invoices += f"{invoice['vendor']['code']}\n"
-    summary += f"\nTotal payment:       ${sum_of_invoices:,.2f}\n\n"
-    summary += f"Invoice count:       {invoice_count}\n\n\n"
-    summary += "Authorized signature __________________________________\n\n\n"
-    summary += f"{excluded_invoices}"
-    return summary
+            excluded_invoices.append(
+                f"{invoice['payment method']}:\t"
+                f"{invoice['number']}\t"
+                f"{invoice['vendor']['name']}\t"
+                f"{invoice['vendor']['code']}\n"
+            )
+    out.write(f"\nTotal payment:       ${sum_of_invoices:,.2f}\n\n")
+    out.write(f"Invoice count:       {invoice_count}\n\n\n")
+    out.write("Authorized signature __________________________________\n\n\n")
+    out.writelines(excluded_invoices)
 
 
 def generate_sap_control(sap_data_file: str, invoice_total: float) -> str:
@@ -517,35 +736,32 @@ def generate_sap_control(sap_data_file: str, invoice_total: float) -> str:
     representing the corresponding control file. see
     https://wikis.mit.edu/confluence/display/SAPdev/MIT+SAP+Dropbox for
     control file format"""
+    return generate_sap_control_from_totals(
+        FileTotals(
+            len(sap_data_file.encode("utf-8")),
+            len(sap_data_file.splitlines()),
+            invoice_total,
+        )
+    )
 
-    # 0-16 count bytes
-    sap_control_file = f"{len(sap_data_file.encode('utf-8')):016}"
-
-    # 17-32 the spec says "record count", but accounts payable says that
-    # this should be a count of the number of lines in the data file.
-    sap_control_file += f"{len(sap_data_file.splitlines()):016}"
-
-    # 33-52 credit total
-    # we don't send credits to SAP so this will always be 20 0's
-    sap_control_file += "0" * 20
-
-    # 53-72 debit total - convert invoice total to string
-    # remove decimal to convert dollars to cents
-    # and 0-pad to 20 characters
-    sap_control_file += f"{'{:.2f}'.format(invoice_total).replace('.', ''):0>20}"
-
-    # 73-92 control 3 summarizing the data file
-    # we just repeat the invoice total here
-    sap_control_file += f"{'{:.2f}'.format(invoice_total).replace('.', ''):0>20}"
-
-    # 93-112 control 4 summarizing the data file
-    # Accounts payable told us to use this string
-    sap_control_file += "00100100000000000000"
 
+def generate_sap_control_from_totals(totals: FileTotals) -> str:
+    """Given the totals returned by write_sap_data, returns a string representing the
+    corresponding control file without another pass over the data file."""
+    # Remove decimal to convert dollars to cents
+    invoice_total_cents = f"{totals.amount:.2f}".replace(".", "")
     # control file ends with a new line
-    sap_control_file += "\n"
-
-    return sap_control_file
+    return (
+        SAP_CONTROL_LAYOUT.pack(
+            {
+                "byte_count": totals.bytes,
+                "line_count": totals.lines,
+                "debit_total": invoice_total_cents,
+                "control_3": invoice_total_cents,
+            }
+        )
+        + "\n"
+    )
 
 
 def generate_next_sap_sequence_number() -> str:
@@ -583,27 +799,68 @@ def generate_sap_file_names(sequence_number: str, date: datetime) -> Tuple[str,
     return data_file_name, control_file_name
 
 
-def mark_invoices_paid(invoices: List[dict], date: datetime):
-    paid_invoice_count = 0
-    alma_client = Alma_API_Client(
-        CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_WRITE_KEY")
-    )
-    alma_client.set_content_headers("application/json", "application/json")
-    for invoice in invoices:
-        invoice_id = invoice["id"]
-        logger.debug(f"Marking invoice '{invoice_id}' paid")
-        response = alma_client.mark_invoice_paid(
-            invoice_id, date, invoice["total amount"], invoice["currency"]
+def mark_invoices_paid(
+    invoices: List[dict],
+    date: datetime,
+    journal: Optional[RunJournal] = None,
+    workers: int = 4,
+) -> int:
+    """Mark invoices paid in Alma, up to `workers` at a time.
+
+    Requests share the Alma client's rate limiter, so adding workers never exceeds the
+    configured request rate. If a journal is given, each invoice is recorded in it as
+    soon as Alma confirms it is paid, and invoices the journal already records as paid
+    are skipped, so a resumed run never re-posts a payment.
+
+    Returns the number of invoices marked paid, including any skipped because the
+    journal records them as already paid.
+    """
+    already_paid = journal.invoice_ids("invoice_paid") if journal else set()
+    unpaid_invoices = [i for i in invoices if i["id"] not in already_paid]
+    if len(unpaid_invoices) < len(invoices):
+        logger.info(
+            f"Skipping {len(invoices) - len(unpaid_invoices)} invoices already marked "
+            "paid in this run"
         )
-        if response["payment"]["payment_status"]["value"] == "PAID":
-            logger.debug(f"Invoice '{invoice_id}' marked as paid in Alma")
-            paid_invoice_count += 1
+    with Alma_API_Client(
+        CONFIG.get_alma_api_key("ALMA_API_ACQ_READ_WRITE_KEY")
+    ) as alma_client:
+        alma_client.set_content_headers("application/json", "application/json")
+
+        def mark_invoice_paid(invoice: dict) -> bool:
+            response = alma_client.mark_invoice_paid(
+                invoice["id"], date, invoice["total amount"], invoice["currency"]
+            )
+            paid = response["payment"]["payment_status"]["value"] == "PAID"
+            if paid and journal:
+                journal.record("invoice_paid", invoice_id=invoice["id"])
+            return paid
+
+        logger.debug(f"Marking {len(unpaid_invoices)} invoices paid")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(mark_invoice_paid, unpaid_invoices))
+
+    # Log outcomes from the calling thread, in invoice order, so the log does not
+    # depend on the order the requests completed in
+    for invoice, paid in zip(unpaid_invoices, results):
+        if paid:
+            logger.debug(f"Invoice '{invoice['id']}' marked as paid in Alma")
         else:
             logger.error(
-                f"Something went wrong marking invoice '{invoice_id}' paid in Alma, it "
-                "should be investigated manually"
+                f"Something went wrong marking invoice '{invoice['id']}' paid in "
+                "Alma, it should be investigated manually"
             )
-    return paid_invoice_count
+    return len(invoices) - len(unpaid_invoices) + sum(results)
+
+
+def serialize_invoices(invoices: List[dict]) -> List[dict]:
+    """Return copies of parsed invoices that can be stored as JSON."""
+    return [{**i, "date": i["date"].isoformat()} for i in invoices]
+
+
+def deserialize_invoices(invoices: List[dict]) -> List[dict]:
+    """Return parsed invoices from copies created by serialize_invoices."""
+    return [{**i, "date": datetime.fromisoformat(i["date"])} for i in invoices]
 
 
 def run(
@@ -614,7 +871,15 @@ def run(
     date: datetime,
     final_run: bool,
     real_run: bool,
+    journal: Optional[RunJournal] = None,
+    update_sequence: bool = True,
 ):
+    """Run the SAP process for invoices of one purchase type.
+
+    If update_sequence is False, a final real run does not update the SAP sequence in
+    Parameter Store, so that a caller running several purchase types concurrently can
+    update it once all the runs finish.
+    """
     logger.info(f"Starting file generation process for {invoices_type} run")
     data_file_name, control_file_name = generate_sap_file_names(
         sap_sequence_number, date
@@ -634,13 +899,11 @@ def run(
     )
 
     if final_run:
-        sap_invoices_total_amount = calculate_invoices_total_amount(sap_invoices)
-
         logger.info("Final run, generating files for SAP")
-        data_file_contents = generate_sap_data(date, sap_invoices)
-        control_file_contents = generate_sap_control(
-            data_file_contents, sap_invoices_total_amount
-        )
+        data_file = io.StringIO()
+        data_file_totals = write_sap_data(data_file, date, sap_invoices)
+        data_file_contents = data_file.getvalue()
+        control_file_contents = generate_sap_control_from_totals(data_file_totals)
         logger.info(
             f"{invoices_type.title()}s data file contents:\n{data_file_contents}"
         )
@@ -649,41 +912,87 @@ def run(
         )
 
         if real_run:
-            # Send data and control files to SAP dropbox via SFTP
-            logger.info("Real run, sending files to SAP dropbox")
-            sftp = SFTP()
-            sftp.authenticate(
-                CONFIG.SAP_DROPBOX_HOST,
-                CONFIG.SAP_DROPBOX_PORT,
-                CONFIG.SAP_DROPBOX_USER,
-                CONFIG.SAP_DROPBOX_KEY,
+            files_sent = journal and journal.find(
+                "files_sent", invoices_type=invoices_type
             )
-            sftp.send_file(data_file_contents, f"dropbox/{data_file_name}")
-            logger.info(
-                f"Sent data file '{data_file_name}' to SAP dropbox {CONFIG.ENV}"
-            )
-            sftp.send_file(control_file_contents, f"dropbox/{control_file_name}")
-            logger.info(
-                f"Sent control file '{control_file_name}' to SAP dropbox {CONFIG.ENV}"
-            )
-            sftp.client.close()
+            if files_sent:
+                logger.info(
+                    f"Resuming run, {invoices_type} files were already sent to SAP "
+                    "dropbox"
+                )
+            else:
+                # Send data and control files to SAP dropbox via SFTP
+                logger.info("Real run, sending files to SAP dropbox")
+                with SFTP() as sftp:
+                    sftp.authenticate(
+                        CONFIG.SAP_DROPBOX_HOST,
+                        CONFIG.SAP_DROPBOX_PORT,
+                        CONFIG.SAP_DROPBOX_USER,
+                        CONFIG.SAP_DROPBOX_KEY,
+                    )
+                    # SAP picks up a data file once its control file arrives, so the
+                    # data file must be complete under its final name first.
+                    # send_file only returns once the verified file has been renamed
+                    # into place, so sending the data file first guarantees that.
+                    sftp.send_file(
+                        data_file_contents,
+                        f"dropbox/{data_file_name}",
+                        verify_checksum=True,
+                    )
+                    logger.info(
+                        f"Sent data file '{data_file_name}' to SAP dropbox "
+                        f"{CONFIG.ENV}"
+                    )
+                    sftp.send_file(
+                        control_file_contents,
+                        f"dropbox/{control_file_name}",
+                        verify_checksum=True,
+                    )
+                    logger.info(
+                        f"Sent control file '{control_file_name}' to SAP dropbox "
+                        f"{CONFIG.ENV}"
+                    )
+                if journal:
+                    journal.record(
+                        "files_sent",
+                        invoices_type=invoices_type,
+                        data_file_name=data_file_name,
+                        control_file_name=control_file_name,
+                        invoices=serialize_invoices(invoices),
+                    )
 
             # Update sequence numbers in SSM
-            logger.info("Real run, updating SAP sequence in Parameter Store")
-            update_sap_sequence(
-                sap_sequence_number,
-                date,
-                "mono" if invoices_type == "monograph" else "ser",
-            )
+            if not update_sequence:
+                logger.info(
+                    "SAP sequence will be updated in Parameter Store once all runs "
+                    "finish"
+                )
+            elif journal and journal.find(
+                "sequence_updated", invoices_type=invoices_type
+            ):
+                logger.info(
+                    f"Resuming run, {invoices_type} SAP sequence was already updated"
+                )
+            else:
+                logger.info("Real run, updating SAP sequence in Parameter Store")
+                update_sap_sequence(
+                    sap_sequence_number,
+                    date,
+                    "mono" if invoices_type == "monograph" else "ser",
+                )
+                if journal:
+                    journal.record("sequence_updated", invoices_type=invoices_type)
 
             # Update invoice statuses in Alma
             logger.info("Real run, marking invoices PAID in Alma")
-            count = mark_invoices_paid(invoices, date)
+            count = mark_invoices_paid(invoices, date, journal=journal)
             logger.info(
                 f"{count} {invoices_type} invoices successfully marked as paid in Alma"
             )
 
-    if real_run:
+    if real_run and journal and journal.find("email_sent", invoices_type=invoices_type):
+        logger.info(f"Resuming run, {invoices_type}s email was already sent")
+    elif real_run:
         email = generate_sap_report_email(
             summary,
             report,
@@ -696,6 +1005,8 @@ def run(
             f"{invoices_type.title()}s email sent with message ID: "
             f"{response['MessageId']}"
         )
+        if journal:
+            journal.record("email_sent", invoices_type=invoices_type)
     else:
         logger.info(f"{invoices_type.title()}s summary:\n{summary}\n")
         logger.info(f"{invoices_type.title()}s report:\n{report}\n")
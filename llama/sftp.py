@@ -1,13 +1,71 @@
+import hashlib
+import logging
+import time
 from io import StringIO
+from typing import BinaryIO, Iterable, NamedTuple, Optional, Union
 
 import paramiko
 
+logger = logging.getLogger(__name__)
+
+# Default number of bytes read from the source and written to the server per write.
+DEFAULT_BUFFER_SIZE = 32768
+
+# Suffix of the temporary name a file is written to before it is renamed into place.
+PARTIAL_FILE_SUFFIX = ".part"
+
+
+class SFTPUploadError(Exception):
+    """Exception raised when a file sent to the SFTP server does not match its source.
+
+    Attributes:
+        file_path: path of the file on the server
+        message: explanation of the error
+    """
+
+    def __init__(self, file_path, message):
+        self.file_path = file_path
+        self.message = message
+        super().__init__(self.message)
+
+
+class SFTPUpload(NamedTuple):
+    """Statistics for a file sent by SFTP.send_file."""
+
+    file_path: str
+    bytes: int
+    seconds: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else float(self.bytes)
+
 
 class SFTP:
-    """An SFTP class with functionality for connecting to a host and sending files."""
+    """An SFTP class with functionality for connecting to a host and sending files.
+
+    One SFTP session is opened per connection, on the first upload, and reused for
+    every file sent until the connection is closed. Use as a context manager to close
+    the session and connection when done.
 
-    def __init__(self):
+    Attributes:
+        client: The SSH client connected to the host.
+        buffer_size: Number of bytes read from the source and written to the server at
+            a time when sending files.
+        uploads: Statistics for each file sent on this connection.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
         self.client = paramiko.SSHClient()
+        self.buffer_size = buffer_size
+        self.uploads = []
+        self._sftp_session: Optional[paramiko.SFTPClient] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def authenticate(
         self, host: str, port: str, username: str, private_key: str
@@ -26,10 +84,39 @@ class SFTP:
             disabled_algorithms={"pubkeys": ["rsa-sha2-256", "rsa-sha2-512"]},
         )
 
+    @property
+    def sftp_session(self) -> paramiko.SFTPClient:
+        """The SFTP session for this connection, opened on first use."""
+        if self._sftp_session is None:
+            self._sftp_session = self.client.open_sftp()
+        return self._sftp_session
+
+    def close(self) -> None:
+        """Close the SFTP session, if open, and the connection to the host."""
+        if self._sftp_session is not None:
+            self._sftp_session.close()
+            self._sftp_session = None
+        self.client.close()
+
     def send_file(
-        self, file_contents: str, file_path: str
+        self,
+        file_contents: Union[str, bytes, BinaryIO, Iterable[bytes]],
+        file_path: str,
+        verify_checksum: bool = False,
     ) -> paramiko.sftp_attr.SFTPAttributes:
-        """Send the string contents of a file to specified path on the SFTP server.
+        """Send the contents of a file to specified path on the SFTP server.
+
+        The contents may be a string, which is sent UTF-8 encoded, bytes, a binary
+        file-like object, or an iterable of bytes chunks. File-like objects and
+        iterables are streamed to the server without being read into memory first.
+
+        The file is written to a temporary name with a ".part" suffix, verified, and
+        only then renamed to file_path, so a file at file_path is always complete and
+        this method returns only once it is in place. The size of the file on the server
+        is verified against the number of bytes sent. If verify_checksum is True, the
+        file is also read back from the server and its SHA-256 checksum compared to the
+        checksum of the bytes sent. If verification fails, the temporary file is removed
+        and an SFTPUploadError is raised.
 
         The file_path parameter should include the path and file name e.g.
         "path/to/file.txt", if no path is included the file will be sent to the home
@@ -38,5 +125,78 @@ class SFTP:
 
         Returns: SFTPAttributes object containing attributes of sent file on the server
         """
-        sftp_session = self.client.open_sftp()
-        return sftp_session.putfo(StringIO(file_contents), file_path)
+        start = time.perf_counter()
+        partial_file_path = file_path + PARTIAL_FILE_SUFFIX
+        bytes_sent = 0
+        checksum = hashlib.sha256() if verify_checksum else None
+        with self.sftp_session.open(
+            partial_file_path, "wb", self.buffer_size
+        ) as remote_file:
+            remote_file.set_pipelined(True)
+            for chunk in self._chunks(file_contents):
+                remote_file.write(chunk)
+                bytes_sent += len(chunk)
+                if checksum:
+                    checksum.update(chunk)
+        try:
+            self._verify(
+                partial_file_path, bytes_sent, checksum and checksum.hexdigest()
+            )
+        except SFTPUploadError:
+            self.sftp_session.remove(partial_file_path)
+            raise
+        self._rename(partial_file_path, file_path)
+        attributes = self.sftp_session.stat(file_path)
+        upload = SFTPUpload(file_path, bytes_sent, time.perf_counter() - start)
+        self.uploads.append(upload)
+        logger.info(
+            f"Sent {upload.bytes} bytes to '{file_path}' in {upload.seconds:.2f} "
+            f"seconds ({upload.bytes_per_second / 1024:.1f} KiB/s)"
+        )
+        return attributes
+
+    def _verify(self, file_path: str, bytes_sent: int, checksum: Optional[str]) -> None:
+        remote_size = self.sftp_session.stat(file_path).st_size
+        if remote_size != bytes_sent:
+            raise SFTPUploadError(
+                file_path,
+                f"File '{file_path}' is {remote_size} bytes on the server but "
+                f"{bytes_sent} bytes were sent",
+            )
+        if checksum:
+            remote_checksum = hashlib.sha256()
+            with self.sftp_session.open(file_path, "rb", self.buffer_size) as f:
+                f.prefetch(remote_size)
+                while chunk := f.read(self.buffer_size):
+                    remote_checksum.update(chunk)
+            if remote_checksum.hexdigest() != checksum:
+                raise SFTPUploadError(
+                    file_path,
+                    f"SHA-256 checksum of file '{file_path}' on the server does not "
+                    "match the checksum of the bytes sent",
+                )
+
+    def _rename(self, source_path: str, file_path: str) -> None:
+        # The posix-rename extension atomically replaces any existing file, but not
+        # every server supports it. A standard SFTP rename is also atomic, it just
+        # fails if file_path already exists.
+        try:
+            self.sftp_session.posix_rename(source_path, file_path)
+        except IOError:
+            self.sftp_session.rename(source_path, file_path)
+
+    def _chunks(
+        self, file_contents: Union[str, bytes, BinaryIO, Iterable[bytes]]
+    ) -> Iterable[bytes]:
+        if isinstance(file_contents, str):
+            file_contents = file_contents.encode("utf-8")
+        if isinstance(file_contents, (bytes, bytearray)):
+            view = memoryview(file_contents)
+            for offset in range(0, len(view), self.buffer_size):
+                yield view[offset : offset + self.buffer_size]
+        elif hasattr(file_contents, "read"):
+            while chunk := file_contents.read(self.buffer_size):
+                yield chunk
+        else:
+            for chunk in file_contents:
+                yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
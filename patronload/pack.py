@@ -0,0 +1,145 @@
+"""Pack rendered patron records into zip archives for the Alma patron load."""
+
+import os
+import zipfile
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from patronload.render import RenderedRow
+from patronload.state import PatronDelta
+
+RECORDS_HEADER = b"<?xml version='1.0' encoding='UTF-8'?>\n<userRecords>\n"
+RECORDS_FOOTER = b"</userRecords>\n"
+
+# Largest size of the XML file in each zip archive, before compression
+DEFAULT_MAX_ARCHIVE_BYTES = 50 * 1024 * 1024
+
+
+class RecordArchives:
+    """Write patron records into zip archives of a <userRecords> XML file each.
+
+    An archive is started when the first record is added, and a new one whenever the
+    next record would take its XML file over max_bytes. Archives are named
+    <prefix>_<timestamp>_<number>.zip and are only given that name once complete, so
+    a partly written archive is never picked up. If an error is raised while the
+    context is open, the archive being written is removed.
+
+    :param directory: the directory to write the archives to
+    :param prefix: the kind of patron, e.g. "staff"
+    :param timestamp: the timestamp of the run, e.g. "20221007010000"
+    :param max_bytes: the largest size of the XML file in each archive
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        timestamp: str,
+        max_bytes: int = DEFAULT_MAX_ARCHIVE_BYTES,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.timestamp = timestamp
+        self.max_bytes = max_bytes
+        self.paths: List[str] = []
+        self.records = 0
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._xml = None
+        self._size = 0
+
+    def add(self, xml: bytes):
+        """Add a rendered patron record to the current archive."""
+        size = len(xml) + 1
+        if self._zip and self._size + size + len(RECORDS_FOOTER) > self.max_bytes:
+            self._finish()
+        if not self._zip:
+            self._start()
+        self._xml.write(xml + b"\n")
+        self._size += size
+        self.records += 1
+
+    def close(self):
+        """Finish the current archive, if any."""
+        if self._zip:
+            self._finish()
+
+    def _start(self):
+        name = f"{self.prefix}_{self.timestamp}_{len(self.paths) + 1}"
+        path = os.path.join(self.directory, name + ".zip")
+        self._zip = zipfile.ZipFile(
+            path + ".part", "w", compression=zipfile.ZIP_DEFLATED
+        )
+        self._xml = self._zip.open(name + ".xml", "w", force_zip64=True)
+        self._xml.write(RECORDS_HEADER)
+        self._size = len(RECORDS_HEADER)
+        self.paths.append(path)
+
+    def _finish(self):
+        self._xml.write(RECORDS_FOOTER)
+        self._xml.close()
+        self._zip.close()
+        os.replace(self.paths[-1] + ".part", self.paths[-1])
+        self._zip = None
+        self._xml = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._zip:
+            self._xml.close()
+            self._zip.close()
+            os.remove(self.paths.pop() + ".part")
+
+
+class PackedPatrons(NamedTuple):
+    """The outcome of packing one kind of patron."""
+
+    paths: List[str]
+    records: int
+    patrons: int
+    removed: List[str]
+
+
+def pack_patrons(
+    staff: Iterable[RenderedRow],
+    students: Iterable[RenderedRow],
+    staff_delta: PatronDelta,
+    student_delta: PatronDelta,
+    directory: str,
+    timestamp: str,
+    max_bytes: int = DEFAULT_MAX_ARCHIVE_BYTES,
+) -> Tuple[PackedPatrons, PackedPatrons]:
+    """Pack the new and changed staff and student records into zip archives.
+
+    Staff take precedence over students: the staff records are packed first, and
+    students with the MIT ID of a staff member are left out of the student archives,
+    so the students are only read once every staff record has been read. The deltas
+    are not saved.
+
+    :param staff: the rendered staff records
+    :param students: the rendered student records
+    :param staff_delta: the PatronDelta of the staff
+    :param student_delta: the PatronDelta of the students. The MIT IDs of the staff
+        are added to its excluded MIT IDs.
+    :param directory: the directory to write the archives to
+    :param timestamp: the timestamp of the run, used in the archive names
+    :param max_bytes: the largest size of the XML file in each archive
+
+    Returns the PackedPatrons of the staff and of the students.
+    """
+    packed_staff = _pack(staff, staff_delta, directory, timestamp, max_bytes)
+    student_delta.exclude.update(staff_delta.current)
+    packed_students = _pack(students, student_delta, directory, timestamp, max_bytes)
+    return packed_staff, packed_students
+
+
+def _pack(records, delta, directory, timestamp, max_bytes):
+    with RecordArchives(directory, delta.kind, timestamp, max_bytes) as archives:
+        for record in records:
+            if delta.emit(record.mit_id, record.xml):
+                archives.add(record.xml)
+    return PackedPatrons(
+        archives.paths, archives.records, len(delta.current), delta.removed()
+    )
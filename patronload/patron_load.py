@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sys
+from datetime import date, datetime
+
+import cx_Oracle
+from dateutil.relativedelta import relativedelta
+
+sys.path.append("..")
+from llama import CONFIG  # noqa: E402
+from patronload.pack import DEFAULT_MAX_ARCHIVE_BYTES, pack_patrons  # noqa: E402
+from patronload.records import load_departments  # noqa: E402
+from patronload.render import DEFAULT_CHUNK_SIZE, read_patrons  # noqa: E402
+from patronload.staff import STAFF_QUERY  # noqa: E402
+from patronload.state import (  # noqa: E402
+    DEFAULT_STATE_FILE,
+    PatronDelta,
+    PatronState,
+)
+from patronload.student import STUDENT_QUERY  # noqa: E402
+from patronload.warehouse import DEFAULT_BATCH_SIZE  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create zipped Alma patron load files for MIT staff and students "
+        "from the Data Warehouse, with staff records taking precedence over student "
+        "records."
+    )
+    parser.add_argument(
+        "--send-dir",
+        default="SEND",
+        help="Directory to write the zip files to (default: SEND)",
+    )
+    parser.add_argument(
+        "--max-zip-size",
+        type=int,
+        default=DEFAULT_MAX_ARCHIVE_BYTES,
+        help="Largest size in bytes of the XML file in each zip file, before "
+        f"compression (default: {DEFAULT_MAX_ARCHIVE_BYTES})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of rows to fetch from the Data Warehouse per round trip "
+        f"(default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes rendering patron records, 1 to render them in this "
+        "process (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of rows sent to a rendering process at a time "
+        f"(default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--state",
+        default=DEFAULT_STATE_FILE,
+        help="SQLite file of the records sent by the last run, used to pack only new "
+        f"and changed patron records (default: {DEFAULT_STATE_FILE})",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Pack every patron record, whether it changed or not",
+    )
+    args = parser.parse_args()
+
+    # make some dates for later
+    six_months = date.today() + relativedelta(months=+6)
+    two_years = six_months + relativedelta(years=+2)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    staff_departments = load_departments("staff_departments.txt")
+    student_departments = load_departments("student_departments.txt")
+    os.makedirs(args.send_dir, exist_ok=True)
+
+    state = PatronState(args.state)
+    staff_delta = PatronDelta(state, "staff", full=args.full)
+    student_delta = PatronDelta(state, "student", full=args.full)
+
+    dsn = cx_Oracle.makedsn(
+        CONFIG.DATA_WAREHOUSE_HOST,
+        CONFIG.DATA_WAREHOUSE_PORT,
+        CONFIG.DATA_WAREHOUSE_SID,
+    )
+    cx_Oracle.init_oracle_client()
+    connection = cx_Oracle.connect(
+        CONFIG.DATA_WAREHOUSE_USER,
+        CONFIG.DATA_WAREHOUSE_PASSWORD,
+        dsn,
+    )
+    render_options = {
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "chunk_size": args.chunk_size,
+    }
+    # Records are packed as they are rendered, and the student query only runs once
+    # every staff record has been packed
+    with open("rejects_staff_script.txt", "w") as staff_rejects, open(
+        "rejects_students_script.txt", "w"
+    ) as student_rejects:
+        staff, students = pack_patrons(
+            read_patrons(
+                connection.cursor(),
+                "staff",
+                STAFF_QUERY,
+                staff_departments,
+                six_months,
+                two_years,
+                staff_rejects,
+                **render_options,
+            ),
+            read_patrons(
+                connection.cursor(),
+                "student",
+                STUDENT_QUERY,
+                student_departments,
+                six_months,
+                two_years,
+                student_rejects,
+                **render_options,
+            ),
+            staff_delta,
+            student_delta,
+            args.send_dir,
+            timestamp,
+            args.max_zip_size,
+        )
+    connection.close()
+
+    for kind, packed, removed_file in (
+        ("staff", staff, "removed_staff.txt"),
+        ("student", students, "removed_students.txt"),
+    ):
+        with open(removed_file, "w") as removed:
+            removed.writelines(mit_id + "\n" for mit_id in packed.removed)
+        print(
+            f"Packed {packed.records} of {packed.patrons} {kind} patron records, "
+            f"{len(packed.removed)} {kind} patrons removed since the last run"
+        )
+        for path in packed.paths:
+            print(path)
+    staff_delta.save()
+    student_delta.save()
+    state.close()
+
+
+if __name__ == "__main__":
+    main()
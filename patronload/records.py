@@ -0,0 +1,197 @@
+"""Transform Data Warehouse rows into Alma patron XML records."""
+
+import ast
+import os
+import re
+
+from patronload.template import PatronTemplate
+from patronload.warehouse import reject_line, xstr
+
+PATRONLOAD_DIR = os.path.dirname(os.path.abspath(__file__))
+STAFF_TEMPLATE_FILE = os.path.join(PATRONLOAD_DIR, "staff_template.xml")
+STUDENT_TEMPLATE_FILE = os.path.join(PATRONLOAD_DIR, "student_template.xml")
+
+
+def phone_format(n):
+    """Return a pretty phone format
+
+    The data warehouse send back 1234567890
+    we want 123-456-7890
+
+    :param n: a ten digit number to parse
+    """
+
+    if n is None:
+        return ""
+    return re.sub(r"(\d{3})(\d{3})(\d{4})", r"\1-\2-\3", n)
+
+
+def load_departments(path):
+    """Return the dict of department codes in a departments file"""
+    with open(path, "r") as file:
+        return ast.literal_eval(file.read())
+
+
+def staff_from_row(col_name, row):
+    """Return a staff dict from an Oracle row, or None if the row is rejected
+
+    Rows without a Kerberos name are rejected.
+
+    :param col_name: the column names of the row
+    :param row: a LIBRARY_EMPLOYEE row
+    """
+    if not row[6]:
+        return None
+    # note APPOINTMENT_END_DATE (row[5]) is kept as a date
+    return {
+        name: value if index == 5 else xstr(value)
+        for index, (name, value) in enumerate(zip(col_name, row))
+    }
+
+
+def staff_reject_line(row):
+    """Return the rejects file line for a rejected LIBRARY_EMPLOYEE row"""
+    end_date = "Unknown"
+    if row[5]:
+        end_date = row[5].strftime("%Y-%m-%d")
+    return reject_line(row[:5] + (end_date,) + row[6:])
+
+
+def student_from_row(col_name, row):
+    """Return a student dict from an Oracle row, or None if the row is rejected
+
+    Rows without a Kerberos name are rejected.
+
+    :param col_name: the column names of the row
+    :param row: a LIBRARY_STUDENT row
+    """
+    if not row[16]:
+        return None
+    # MIT_ID (row[0]) is kept as returned by Oracle
+    return {
+        name: value if index == 0 else xstr(value)
+        for index, (name, value) in enumerate(zip(col_name, row))
+    }
+
+
+def student_reject_line(row):
+    """Return the rejects file line for a rejected LIBRARY_STUDENT row"""
+    return reject_line(row)
+
+
+def _common_values(patron, six_months, two_years):
+    values = {
+        "expiry_date": six_months.strftime("%Y-%m-%d") + "Z",
+        "purge_date": two_years.strftime("%Y-%m-%d") + "Z",
+        "mit_id": patron["MIT_ID"],
+        "email_address": patron["EMAIL_ADDRESS"],
+    }
+    if patron["KRB_NAME_UPPERCASE"]:
+        values["primary_id"] = patron["KRB_NAME_UPPERCASE"] + "@MIT.EDU"
+    else:
+        values["primary_id"] = patron["EMAIL_ADDRESS"]
+    removed = set()
+    if patron["LIBRARY_ID"] and patron["LIBRARY_ID"] != "NONE":
+        values["barcode"] = patron["LIBRARY_ID"]
+    else:
+        removed.add("barcode_identifier")
+    if not patron["EMAIL_ADDRESS"]:
+        removed.add("email")
+    return values, removed
+
+
+def render_staff_record(template, patron, departments, six_months, two_years):
+    """Return the Alma patron XML for a staff dict
+
+    :param template: the compiled staff PatronTemplate
+    :param patron: a staff dict from staff_from_row
+    :param departments: the staff departments dict
+    :param six_months: the expiry date
+    :param two_years: the purge date
+    """
+    values, removed = _common_values(patron, six_months, two_years)
+
+    name_split = re.split(",", patron["FULL_NAME"], 1)
+    values["last_name"] = name_split[0].strip()
+    values["first_name"] = name_split[1].strip()
+
+    values["user_group"] = patron["LIBRARY_PERSON_TYPE_CODE"]
+    values["user_group_desc"] = patron["LIBRARY_PERSON_TYPE"]
+
+    if patron["OFFICE_ADDRESS"]:
+        values["line1"] = patron["OFFICE_ADDRESS"]
+    else:
+        values["line1"] = "NO ADDRESS ON FILE IN DATA WAREHOUSE"
+
+    if patron["OFFICE_PHONE"]:
+        values["phone_number_1"] = phone_format(patron["OFFICE_PHONE"])
+    else:
+        removed.add("phone_1")
+
+    values["dept_statistic"] = departments.get(patron["ORG_UNIT_ID"], "ZQ")
+    values["dept_statistic_desc"] = patron["ORG_UNIT_TITLE"] or "Unknown"
+
+    return template.render(values, removed)
+
+
+def render_student_record(template, patron, departments, six_months, two_years):
+    """Return the Alma patron XML for a student dict
+
+    :param template: the compiled student PatronTemplate
+    :param patron: a student dict from student_from_row
+    :param departments: the student departments dict
+    :param six_months: the expiry date
+    :param two_years: the purge date
+    """
+    values, removed = _common_values(patron, six_months, two_years)
+
+    values["first_name"] = patron["FIRST_NAME"]
+    values["middle_name"] = patron["MIDDLE_NAME"]
+    values["last_name"] = patron["LAST_NAME"]
+
+    if patron["TERM_STREET1"]:
+        values["line1"] = patron["TERM_STREET1"]
+    else:
+        values["line1"] = "NO ADDRESS ON FILE IN DATA WAREHOUSE"
+    values["line3"] = patron["TERM_STREET2"]
+    values["city"] = patron["TERM_CITY"]
+    values["state_province"] = patron["TERM_STATE"]
+    values["postal_code"] = patron["TERM_ZIP"]
+
+    phone_numbers = ["", ""]
+    if patron["OFFICE_PHONE"] and patron["TERM_PHONE1"]:
+        phone_numbers = [patron["OFFICE_PHONE"], patron["TERM_PHONE1"]]
+    elif patron["OFFICE_PHONE"]:
+        phone_numbers[0] = patron["OFFICE_PHONE"]
+    elif patron["TERM_PHONE1"]:
+        phone_numbers[0] = patron["TERM_PHONE1"]
+    elif patron["TERM_PHONE2"]:
+        phone_numbers[0] = patron["TERM_PHONE2"]
+    for count, phone_number in enumerate(phone_numbers, start=1):
+        if phone_number:
+            values[f"phone_number_{count}"] = phone_format(phone_number)
+        else:
+            removed.add(f"phone_{count}")
+
+    values["dept_statistic"] = departments.get(patron["HOME_DEPARTMENT"], "ZZ")
+
+    status = ""
+    if re.search("^[1234Uu]$", patron["STUDENT_YEAR"]):
+        status = "31"
+    elif re.search("^[Gg]$", patron["STUDENT_YEAR"]):
+        status = "32"
+    if re.search("^NI[UVWTRH]$", patron["HOME_DEPARTMENT"]):
+        status = "54"
+    values["user_group"] = status
+
+    return template.render(values, removed)
+
+
+def load_staff_template():
+    """Return the compiled staff PatronTemplate"""
+    return PatronTemplate(STAFF_TEMPLATE_FILE)
+
+
+def load_student_template():
+    """Return the compiled student PatronTemplate"""
+    return PatronTemplate(STUDENT_TEMPLATE_FILE)
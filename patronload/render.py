@@ -0,0 +1,192 @@
+"""Render patron records from Data Warehouse rows, optionally in a process pool."""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from patronload.records import (
+    load_staff_template,
+    load_student_template,
+    render_staff_record,
+    render_student_record,
+    staff_from_row,
+    staff_reject_line,
+    student_from_row,
+    student_reject_line,
+)
+from patronload.warehouse import (
+    DEFAULT_BATCH_SIZE,
+    column_names,
+    reject_line,
+    stream_rows,
+)
+
+# Number of rows sent to a worker process at a time. Large enough that pickling and
+# inter-process overhead is small next to the rendering, small enough that every
+# worker gets a share of each Data Warehouse batch.
+DEFAULT_CHUNK_SIZE = 250
+
+
+class PatronKind(NamedTuple):
+    from_row: Callable
+    reject_line: Callable
+    render: Callable
+    load_template: Callable
+
+
+PATRON_KINDS: Dict[str, PatronKind] = {
+    "staff": PatronKind(
+        staff_from_row, staff_reject_line, render_staff_record, load_staff_template
+    ),
+    "student": PatronKind(
+        student_from_row,
+        student_reject_line,
+        render_student_record,
+        load_student_template,
+    ),
+}
+
+
+class RenderedRow(NamedTuple):
+    """The result of rendering one row: either the patron's MIT ID and record XML,
+    or the rejects file line for a rejected row."""
+
+    mit_id: Optional[str] = None
+    xml: Optional[bytes] = None
+    reject_line: Optional[str] = None
+
+
+class _RowRenderer:
+    def __init__(self, kind, col_name, departments, six_months, two_years):
+        self.kind = PATRON_KINDS[kind]
+        self.template = self.kind.load_template()
+        self.col_name = col_name
+        self.departments = departments
+        self.six_months = six_months
+        self.two_years = two_years
+
+    def __call__(self, rows: Iterable) -> List[RenderedRow]:
+        rendered = []
+        for row in rows:
+            patron = self.kind.from_row(self.col_name, row)
+            if patron:
+                xml = self.kind.render(
+                    self.template,
+                    patron,
+                    self.departments,
+                    self.six_months,
+                    self.two_years,
+                )
+                rendered.append(RenderedRow(mit_id=patron["MIT_ID"], xml=xml))
+            else:
+                rendered.append(RenderedRow(reject_line=self.kind.reject_line(row)))
+        return rendered
+
+
+# The renderer of a worker process, created once per process by _init_worker so the
+# template is compiled and the departments sent once per worker rather than per chunk
+_worker_renderer: Optional[_RowRenderer] = None
+
+
+def _init_worker(*args):
+    global _worker_renderer
+    _worker_renderer = _RowRenderer(*args)
+
+
+def _render_chunk(rows: List) -> List[RenderedRow]:
+    return _worker_renderer(rows)
+
+
+def render_rows(
+    kind: str,
+    col_name: List[str],
+    rows: Iterable,
+    departments: dict,
+    six_months,
+    two_years,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[RenderedRow]:
+    """Render Data Warehouse rows into patron records, yielded in row order.
+
+    With more than one worker, chunks of rows are rendered in a pool of worker
+    processes while the rows are still being read. At most two chunks per worker are
+    in flight at a time, so memory stays bounded however many rows there are.
+
+    :param kind: "staff" or "student"
+    :param col_name: the column names of the rows
+    :param rows: the rows, e.g. from warehouse.stream_rows
+    :param departments: the departments dict for the kind of patron
+    :param six_months: the expiry date
+    :param two_years: the purge date
+    :param workers: the number of worker processes, 1 to render in this process
+    :param chunk_size: the number of rows sent to a worker at a time
+    """
+    args = (kind, col_name, departments, six_months, two_years)
+    rows = iter(rows)
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    if workers <= 1:
+        renderer = _RowRenderer(*args)
+        for chunk in chunks:
+            yield from renderer(chunk)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=args) as pool:
+        in_flight = [
+            pool.submit(_render_chunk, chunk)
+            for chunk in itertools.islice(chunks, workers * 2)
+        ]
+        while in_flight:
+            rendered = in_flight.pop(0).result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                in_flight.append(pool.submit(_render_chunk, chunk))
+            yield from rendered
+
+
+def read_patrons(
+    cursor,
+    kind: str,
+    query: str,
+    departments: dict,
+    six_months,
+    two_years,
+    rejects: IO[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[RenderedRow]:
+    """Query the Data Warehouse for patrons and yield their rendered records.
+
+    Rows are rendered as they are fetched, so memory use is bounded by the batch and
+    chunk sizes rather than the number of patrons. Rejected rows are written to the
+    rejects file, after a header line of the column names.
+
+    :param cursor: an open cx_Oracle cursor
+    :param kind: "staff" or "student"
+    :param query: the patron query
+    :param departments: the departments dict for the kind of patron
+    :param six_months: the expiry date
+    :param two_years: the purge date
+    :param rejects: the open rejects file
+    :param batch_size: the number of rows to fetch per round trip
+    :param workers: the number of worker processes, 1 to render in this process
+    :param chunk_size: the number of rows sent to a worker at a time
+    """
+    rows = stream_rows(cursor, query, batch_size)
+    col_name = column_names(cursor)
+    rejects.write(reject_line(col_name))
+    for rendered in render_rows(
+        kind,
+        col_name,
+        rows,
+        departments,
+        six_months,
+        two_years,
+        workers=workers,
+        chunk_size=chunk_size,
+    ):
+        if rendered.xml:
+            yield rendered
+        else:
+            rejects.write(rendered.reject_line)
@@ -1,280 +1,124 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import ast
-import re
+import argparse
 import sys
-import xml.etree.ElementTree as ET
 from datetime import date
-from dateutil.relativedelta import relativedelta
 
 import cx_Oracle
+from dateutil.relativedelta import relativedelta
 
 sys.path.append("..")
-from llama import CONFIG
-
-
-
-def xstr(s):
-    """Return an empty string if the type is NoneType
-
-    This avoids error when we're looking for a string throughout the script
-
-    :param s: an object to be checked if it is NoneType
-    """
-
-    if s is None:
-        return ""
-    return str(s)
-
-
-def phone_format(n):
-    """Return a pretty phone format
-
-    The data warehouse send back 1234567890
-    we want 123-456-7890
-
-    :param n: a ten digit number to parse
-    """
-
-    if n is None:
-        return ""
-    return re.sub(r"(\d{3})(\d{3})(\d{4})", r"\1-\2-\3", n)
-
-
-# make some dates for later
-six_months = date.today() + relativedelta(months=+6)
-two_years = six_months + relativedelta(years=+2)
-
-# Start import staff departments #
-file = open("staff_departments.txt", "r")
-
-contents = file.read()
-departments = ast.literal_eval(contents)
-
-file.close()
-
-# End import staff departments #
-
-staff_rejects = open("rejects_staff_script.txt", "w")
-
-# Start Oracle data import #
-dsn = cx_Oracle.makedsn(
-    CONFIG.DATA_WAREHOUSE_HOST, CONFIG.DATA_WAREHOUSE_PORT, CONFIG.DATA_WAREHOUSE_SID
+from llama import CONFIG  # noqa: E402
+from patronload.records import load_departments  # noqa: E402
+from patronload.render import DEFAULT_CHUNK_SIZE, read_patrons  # noqa: E402
+from patronload.state import (  # noqa: E402
+    DEFAULT_STATE_FILE,
+    PatronDelta,
+    PatronState,
 )
+from patronload.warehouse import DEFAULT_BATCH_SIZE  # noqa: E402
 
-cx_Oracle.init_oracle_client()
-connection = cx_Oracle.connect(
-    CONFIG.DATA_WAREHOUSE_USER,
-    CONFIG.DATA_WAREHOUSE_PASSWORD,
-    dsn,
-)
-cursor = connection.cursor()
-cursor.execute(
-    """
+STAFF_QUERY = """
         SELECT *
         FROM LIBRARY_EMPLOYEE
        """
-)
 #        WHERE rownum <= 10
 
-res = cursor.fetchall()
-
-# get list of column names from oracle
-col_name = []
-for i in range(0, len(cursor.description)):
-    col_name.append(cursor.description[i][0])
-
-# print column headers for rejects file
-staff_rejects.write(
-    xstr(col_name[0])
-    + "|"
-    + col_name[1]
-    + "|"
-    + col_name[2]
-    + "|"
-    + col_name[3]
-    + "|"
-    + col_name[4]
-    + "|"
-    + col_name[5]
-    + "|"
-    + col_name[6]
-    + "|"
-    + col_name[7]
-    + "|"
-    + col_name[8]
-    + "|"
-    + col_name[9]
-    + "|"
-    + col_name[10]
-    + "|"
-    + col_name[11]
-    + "|"
-    + col_name[12]
-    + "|"
-    + col_name[13]
-    + "\n"
-)
-
-
-# create a list of dictionaries for staff data
-staff = []
-for row in res:
-    if row[6]:
-        # purge = row[5]
-        # purge += timedelta(days=365)
-        # purge += timedelta(days=365)
-        # note the use of row[5].strftime('%Y-%m-%d') (APPOINTMENT_END_DATE)
-        # to get a real date we can use
-        user = {
-            col_name[0]: xstr(row[0]),
-            col_name[1]: xstr(row[1]),
-            col_name[2]: xstr(row[2]),
-            col_name[3]: xstr(row[3]),
-            col_name[4]: xstr(row[4]),
-            col_name[5]: row[5],
-            col_name[6]: xstr(row[6]),
-            col_name[7]: xstr(row[7]),
-            col_name[8]: xstr(row[8]),
-            col_name[9]: xstr(row[9]),
-            col_name[10]: xstr(row[10]),
-            col_name[11]: xstr(row[11]),
-            col_name[12]: xstr(row[12]),
-            col_name[13]: xstr(row[13]),
-        }
-        staff.append(user)
-    else:
-        end_date = "Unknown"
-        if row[5]:
-            end_date = row[5].strftime("%Y-%m-%d")
-
-        staff_rejects.write(
-            xstr(row[0])
-            + "|"
-            + xstr(row[1])
-            + "|"
-            + xstr(row[2])
-            + "|"
-            + xstr(row[3])
-            + "|"
-            + xstr(row[4])
-            + "|"
-            + end_date
-            + "|"
-            + xstr(row[6])
-            + "|"
-            + xstr(row[7])
-            + "|"
-            + xstr(row[8])
-            + "|"
-            + xstr(row[9])
-            + "|"
-            + xstr(row[10])
-            + "|"
-            + xstr(row[11])
-            + "|"
-            + xstr(row[12])
-            + "|"
-            + xstr(row[13])
-            + "\n"
-        )
-cursor.close()
-connection.close()
 
-for i in range(0, len(staff)):
-    patron = staff[i]
-    patron_file = "STAFF/" + patron["MIT_ID"] + ".xml"
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create Alma patron XML files for MIT staff from the Data "
+        "Warehouse."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of rows to fetch from the Data Warehouse per round trip "
+        f"(default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes rendering patron records, 1 to render them in this "
+        "process (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of rows sent to a rendering process at a time "
+        f"(default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--state",
+        default=DEFAULT_STATE_FILE,
+        help="SQLite file of the records sent by the last run, used to write only new "
+        f"and changed patron files (default: {DEFAULT_STATE_FILE})",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Write a patron file for every staff, whether it changed or not",
+    )
+    args = parser.parse_args()
+
+    # make some dates for later
+    six_months = date.today() + relativedelta(months=+6)
+    two_years = six_months + relativedelta(years=+2)
+
+    departments = load_departments("staff_departments.txt")
+
+    state = PatronState(args.state)
+    delta = PatronDelta(state, "staff", full=args.full)
+
+    dsn = cx_Oracle.makedsn(
+        CONFIG.DATA_WAREHOUSE_HOST,
+        CONFIG.DATA_WAREHOUSE_PORT,
+        CONFIG.DATA_WAREHOUSE_SID,
+    )
+    cx_Oracle.init_oracle_client()
+    connection = cx_Oracle.connect(
+        CONFIG.DATA_WAREHOUSE_USER,
+        CONFIG.DATA_WAREHOUSE_PASSWORD,
+        dsn,
+    )
+    cursor = connection.cursor()
+    with open("rejects_staff_script.txt", "w") as staff_rejects:
+        for rendered in read_patrons(
+            cursor,
+            "staff",
+            STAFF_QUERY,
+            departments,
+            six_months,
+            two_years,
+            staff_rejects,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+        ):
+            if delta.emit(rendered.mit_id, rendered.xml):
+                with open("STAFF/" + rendered.mit_id + ".xml", "wb") as f:
+                    f.write(rendered.xml)
+    cursor.close()
+    connection.close()
+
+    removed = delta.removed()
+    with open("removed_staff.txt", "w") as removed_staff:
+        removed_staff.writelines(mit_id + "\n" for mit_id in removed)
+    delta.save()
+    state.close()
+    print(
+        f"Wrote {delta.emitted} of {len(delta.current)} staff patron files, "
+        f"{len(removed)} staff patrons removed since the last run"
+    )
+
+
+if __name__ == "__main__":
+    main()
 
-    # print (patron["APPOINTMENT_END_DATE"] +
-    #        "|" + patron["MIT_ID"] +
-    #        "|" + patron["FULL_NAME"])
-
-    # import staff record template #
-    tree = ET.parse("staff_template.xml")
-    root = tree.getroot()
-    for primary_id in root.iter("primary_id"):
-        primary = ""
-        if patron["KRB_NAME_UPPERCASE"]:
-            primary = patron["KRB_NAME_UPPERCASE"] + "@MIT.EDU"
-        else:
-            primary = patron["EMAIL_ADDRESS"]
-        primary_id.text = primary
-    # for full_name in root.iter('full_name'):
-    #    full_name.text = patron["FULL_NAME"]
-    name_split = re.split(",", patron["FULL_NAME"], 1)
-    for last_name in root.iter("last_name"):
-        last_name.text = name_split[0].strip()
-    for first_name in root.iter("first_name"):
-        first_name.text = name_split[1].strip()
-    for expiry_date in root.iter("expiry_date"):
-        # print(expiry_date.text)
-        # expiry_date.text = patron["APPOINTMENT_END_DATE"] + 'Z'
-        expiry_date.text = six_months.strftime("%Y-%m-%d") + "Z"
-    for purge_date in root.iter("purge_date"):
-        # print(purge_date.text)
-        # purge_date.text = patron["PURGE"] + 'Z'
-        purge_date.text = two_years.strftime("%Y-%m-%d") + "Z"
-    for user_group in root.iter("user_group"):
-        # print(purge_date.text)
-        user_group.text = patron["LIBRARY_PERSON_TYPE_CODE"]
-        user_group.set("desc", patron["LIBRARY_PERSON_TYPE"])
-
-    for user_identifiers in root.iter("user_identifiers"):
-        # for user_identifier in user_identifiers.find("user_identifier"):
-        for user_identifier in user_identifiers:
-            id_type = user_identifier.findall("id_type")
-            type = id_type[0]
-            id_value = user_identifier.findall("value")
-            value = id_value[0]
-
-            if type.text == "02":
-                value.text = patron["MIT_ID"]
-            elif type.text == "01":
-                if patron["LIBRARY_ID"] and patron["LIBRARY_ID"] != "NONE":
-                    value.text = patron["LIBRARY_ID"]
-                else:
-                    user_identifiers.remove(user_identifier)
-
-    for contact_info in root.iter("contact_info"):
-        addresses = contact_info.find("addresses")
-        if patron["OFFICE_ADDRESS"]:
-            addresses[0][0].text = patron["OFFICE_ADDRESS"]
-        else:
-            addresses[0][0].text = "NO ADDRESS ON FILE IN DATA WAREHOUSE"
-
-        emails = contact_info.find("emails")
-        if patron["EMAIL_ADDRESS"]:
-            emails[0][0].text = patron["EMAIL_ADDRESS"]
-        else:
-            ems = emails.findall("email")
-            for em in ems:
-                emails.remove(em)
-
-        phones = contact_info.find("phones")
-        if patron["OFFICE_PHONE"]:
-            phones[0][0].text = phone_format(patron["OFFICE_PHONE"])
-        else:
-            tels = phones.findall("phone")
-            for tel in tels:
-                phones.remove(tel)
-    for user_statistic in root.iter("user_statistic"):
-        if user_statistic[1].text == "DEPT":
-            if patron["ORG_UNIT_ID"] in departments:
-                user_statistic[0].text = departments[patron["ORG_UNIT_ID"]]
-            else:
-                user_statistic[0].text = "ZQ"
-                # sys.stderr.write("Unknown dept: " +
-                #                  patron["ORG_UNIT_ID"] + "\n")
-            if patron["ORG_UNIT_TITLE"]:
-                user_statistic[0].set("desc", patron["ORG_UNIT_TITLE"])
-            else:
-                user_statistic[0].set("desc", "Unknown")
-
-    tree.write(patron_file, encoding="UTF-8", xml_declaration=False)
-
-# End Oracle data import #
-#
 # Here are the Oracle columns for reference
 #
 # FULL_NAME    0
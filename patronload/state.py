@@ -0,0 +1,112 @@
+"""State of the patron records sent to Alma, for loading only the records that changed."""
+
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List, Set
+
+DEFAULT_STATE_FILE = "patron_state.db"
+
+
+def record_digest(xml: bytes) -> bytes:
+    """Return the 16 byte digest of a rendered patron record stored in the state."""
+    return hashlib.blake2b(xml, digest_size=16).digest()
+
+
+class PatronState:
+    """A SQLite store of the digest of the last patron record sent to Alma for each
+    kind of patron and MIT ID.
+
+    :param path: path of the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS patrons (
+                kind TEXT NOT NULL,
+                mit_id TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                PRIMARY KEY (kind, mit_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+
+    def digests(self, kind: str) -> Dict[str, bytes]:
+        """Return the stored record digest of each MIT ID of a kind of patron."""
+        return dict(
+            self.connection.execute(
+                "SELECT mit_id, digest FROM patrons WHERE kind = ?", (kind,)
+            )
+        )
+
+    def replace(self, kind: str, digests: Dict[str, bytes]):
+        """Replace the stored record digests of a kind of patron in one transaction."""
+        with self.connection:
+            self.connection.execute("DELETE FROM patrons WHERE kind = ?", (kind,))
+            self.connection.executemany(
+                "INSERT INTO patrons (kind, mit_id, digest) VALUES (?, ?, ?)",
+                ((kind, mit_id, digest) for mit_id, digest in digests.items()),
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PatronDelta:
+    """Track the patron records of one run against the records of the last run.
+
+    Call emit for each rendered record to find out whether it should be sent to
+    Alma, then save once every record has been written, so the state only ever
+    reflects complete runs.
+
+    :param state: the PatronState
+    :param kind: "staff" or "student"
+    :param full: emit every record, whether it changed or not
+    :param exclude: MIT IDs whose records are sent as another kind of patron, e.g.
+        students who are also staff. Their records are never emitted or stored.
+    """
+
+    def __init__(
+        self,
+        state: PatronState,
+        kind: str,
+        full: bool = False,
+        exclude: Iterable[str] = (),
+    ):
+        self.state = state
+        self.kind = kind
+        self.full = full
+        self.exclude: Set[str] = set(exclude)
+        self.previous = state.digests(kind)
+        self.current: Dict[str, bytes] = {}
+        self.emitted = 0
+
+    def emit(self, mit_id: str, xml: bytes) -> bool:
+        """Record a rendered patron record and return whether it is new or changed
+        since the last run, or this is a full run."""
+        if mit_id in self.exclude:
+            return False
+        digest = record_digest(xml)
+        self.current[mit_id] = digest
+        if self.full or self.previous.get(mit_id) != digest:
+            self.emitted += 1
+            return True
+        return False
+
+    def removed(self) -> List[str]:
+        """Return the sorted MIT IDs of the last run that are not in this run."""
+        return sorted(
+            set(self.previous).difference(self.current).difference(self.exclude)
+        )
+
+    def save(self):
+        """Store the record digests of this run as the state for the next run."""
+        self.state.replace(self.kind, self.current)
@@ -0,0 +1,192 @@
+"""Alma patron XML templates, compiled once and rendered for each patron."""
+
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+# ElementTree's own escaping functions are used so rendered records are identical to
+# the records ElementTree would serialize from a filled-in copy of the template.
+from xml.etree.ElementTree import _escape_attrib, _escape_cdata
+
+
+def _first(tag):
+    return lambda root: next(root.iter(tag), None)
+
+
+def _child(container_tag, index, tag=None):
+    def find(root):
+        container = next(root.iter(container_tag), None)
+        if container is None or len(container) <= index:
+            return None
+        element = container[index]
+        return element if tag is None else element.find(tag)
+
+    return find
+
+
+def _identifier(id_type, tag=None):
+    def find(root):
+        for user_identifier in root.iter("user_identifier"):
+            if user_identifier.findtext("id_type") == id_type:
+                return user_identifier if tag is None else user_identifier.find(tag)
+        return None
+
+    return find
+
+
+def _dept_statistic(root):
+    for user_statistic in root.iter("user_statistic"):
+        if user_statistic.findtext("category_type") == "DEPT":
+            return user_statistic.find("statistic_category")
+    return None
+
+
+# Functions finding the elements of a patron template whose text is filled in per
+# patron. Each slot's text is rendered from the value of the same name.
+TEXT_SLOTS: Dict[str, Callable] = {
+    "primary_id": _first("primary_id"),
+    "first_name": _first("first_name"),
+    "middle_name": _first("middle_name"),
+    "last_name": _first("last_name"),
+    "user_group": _first("user_group"),
+    "expiry_date": _first("expiry_date"),
+    "purge_date": _first("purge_date"),
+    "line1": _first("line1"),
+    "line3": _first("line3"),
+    "city": _first("city"),
+    "state_province": _first("state_province"),
+    "postal_code": _first("postal_code"),
+    "email_address": _first("email_address"),
+    "phone_number_1": _child("phones", 0, "phone_number"),
+    "phone_number_2": _child("phones", 1, "phone_number"),
+    "mit_id": _identifier("02", "value"),
+    "barcode": _identifier("01", "value"),
+    "dept_statistic": _dept_statistic,
+}
+
+# Functions finding the elements of a patron template with a desc attribute that is
+# filled in per patron.
+DESC_SLOTS: Dict[str, Callable] = {
+    "user_group_desc": _first("user_group"),
+    "dept_statistic_desc": _dept_statistic,
+}
+
+# Functions finding the elements of a patron template that are left out of a patron's
+# record when their name is in the removed sections.
+SECTIONS: Dict[str, Callable] = {
+    "email": _child("emails", 0),
+    "phone_1": _child("phones", 0),
+    "phone_2": _child("phones", 1),
+    "barcode_identifier": _identifier("01"),
+}
+
+
+class _Text(NamedTuple):
+    slot: str
+    tag: str
+    default: Optional[str]
+
+
+class _Desc(NamedTuple):
+    slot: str
+    default: str
+
+
+class _Section(NamedTuple):
+    name: str
+    parts: list
+
+
+_Part = Union[str, _Text, _Desc, _Section]
+
+
+class PatronTemplate:
+    """An Alma patron XML template compiled for rendering many patron records
+
+    The template is parsed and its slots found once, when it is compiled into a list
+    of constant XML fragments and the slots between them. Rendering a record joins the
+    fragments with the escaped slot values, so no tree is copied or serialized per
+    patron.
+
+    :param path: path of the template XML file
+    """
+
+    def __init__(self, path: str):
+        root = ET.parse(path).getroot()
+        self.slots = {}
+        for slots, kind in ((TEXT_SLOTS, "text"), (DESC_SLOTS, "desc")):
+            for name, find in slots.items():
+                element = find(root)
+                if element is not None:
+                    self.slots.setdefault(element, {})[kind] = name
+        self.sections = {}
+        for name, find in SECTIONS.items():
+            element = find(root)
+            if element is not None:
+                self.sections[element] = name
+        self.parts = _merge(self._compile(root))
+
+    def render(self, values: Dict[str, str], removed: Iterable[str] = ()) -> bytes:
+        """Return a patron record as UTF-8 XML, without an XML declaration
+
+        :param values: the text of each slot to fill in. Slots without a value keep
+            the text of the template, and an empty value empties the element.
+        :param removed: names of the sections to leave out of the record
+        """
+        out: List[str] = []
+        _render(self.parts, values, frozenset(removed), out)
+        return "".join(out).encode("utf-8")
+
+    def _compile(self, element: ET.Element) -> List[_Part]:
+        slots = self.slots.get(element, {})
+        if element not in self.sections and not any(
+            e in self.slots or e in self.sections for e in element.iter()
+        ):
+            return [ET.tostring(element, encoding="unicode")]
+        parts: List[_Part] = ["<" + element.tag]
+        for key, value in element.items():
+            if key == "desc" and "desc" in slots:
+                parts.append(_Desc(slots["desc"], value))
+            else:
+                parts.append(f' {key}="{_escape_attrib(value)}"')
+        if "text" in slots:
+            parts.append(_Text(slots["text"], element.tag, element.text))
+        elif element.text or len(element):
+            parts.append(">")
+            if element.text:
+                parts.append(_escape_cdata(element.text))
+            for child in element:
+                parts.extend(self._compile(child))
+            parts.append(f"</{element.tag}>")
+        else:
+            parts.append(" />")
+        if element.tail:
+            parts.append(_escape_cdata(element.tail))
+        if element in self.sections:
+            return [_Section(self.sections[element], _merge(parts))]
+        return parts
+
+
+def _merge(parts: List[_Part]) -> List[_Part]:
+    merged: List[_Part] = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return merged
+
+
+def _render(parts, values, removed, out):
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+        elif isinstance(part, _Text):
+            text = values.get(part.slot, part.default)
+            if text:
+                out.append(f">{_escape_cdata(text)}</{part.tag}>")
+            else:
+                out.append(" />")
+        elif isinstance(part, _Desc):
+            out.append(f' desc="{_escape_attrib(values.get(part.slot, part.default))}"')
+        elif part.name not in removed:
+            _render(part.parts, values, removed, out)
@@ -0,0 +1,57 @@
+"""Helpers for streaming patron data out of the MIT Data Warehouse."""
+
+from typing import Iterator, List
+
+# Number of rows fetched from Oracle per round trip. Peak memory of a patron load is
+# bounded by this rather than by the number of patrons.
+DEFAULT_BATCH_SIZE = 1000
+
+
+def xstr(s):
+    """Return an empty string if the type is NoneType
+
+    This avoids error when we're looking for a string throughout the script
+
+    :param s: an object to be checked if it is NoneType
+    """
+
+    if s is None:
+        return ""
+    return str(s)
+
+
+def stream_rows(cursor, query: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator:
+    """Execute a query and return an iterator over its rows that fetches them in
+    batches as they are consumed, rather than fetching every row up front.
+
+    The cursor's arraysize and prefetchrows are both set to batch_size, so the
+    execute round trip already returns the first batch and each later round trip
+    returns the next batch. The cursor description is available as soon as this
+    returns.
+
+    :param cursor: an open cx_Oracle cursor
+    :param query: the query to execute
+    :param batch_size: the number of rows to fetch per round trip
+    """
+    cursor.arraysize = batch_size
+    cursor.prefetchrows = batch_size
+    cursor.execute(query)
+    return _fetch_batches(cursor)
+
+
+def _fetch_batches(cursor) -> Iterator:
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            return
+        yield from rows
+
+
+def column_names(cursor) -> List[str]:
+    """Return the column names of the last query executed by a cursor."""
+    return [column[0] for column in cursor.description]
+
+
+def reject_line(values) -> str:
+    """Return a line for a rejects file: the values, pipe separated."""
+    return "|".join(xstr(value) for value in values) + "\n"
@@ -11,17 +11,9 @@
 # #install the dependencies
 # /usr/local/bin/pipenv install
 
-# #Run the staff load
-# /usr/local/bin/pipenv run python staff.py > /home/gituser/logs/patron-load.log 2>&1
-
-# #Run the student load
-# /usr/local/bin/pipenv run python student.py >> /home/gituser/logs/patron-load.log 2>&1
-
-# #make the folder if it doesn't already exist, this perl script errors out without the folder
-# mkdir SEND
-
-# #Run the "zip function" that also does a diff and makes sure the staff files take precedence 
-# perl scripts/pack_all_records.pl >> /home/gituser/logs/patron-load.log 2>&1
+# #Run the staff and student loads, packing the new and changed records into zips in
+# #SEND with staff records taking precedence over student records
+# /usr/local/bin/pipenv run python patron_load.py > /home/gituser/logs/patron-load.log 2>&1
 
 # #Delete existing zips if they exist, we cant double up zip files if an alma run fails, files, once used, are renamed to .old
 # aws s3 rm s3://$ALMA_BUCKET/exlibris/PatronLoad/ --exclude "*" --include "*.zip" >> /home/gituser/logs/patron-load.log 2>&1
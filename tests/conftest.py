@@ -10,10 +10,21 @@ from click.testing import CliRunner
 from moto import mock_s3, mock_ses, mock_ssm
 from requests import HTTPError, Response
 
+from llama import alma
 from llama.alma import Alma_API_Client
+from llama.rate_limiter import RateLimiter
 from llama.s3 import S3
 
 
+@pytest.fixture(autouse=True)
+def alma_rate_limiter(monkeypatch):
+    """Give each test its own shared Alma rate limiter so token and throttling state
+    does not leak between tests."""
+    rate_limiter = RateLimiter(requests_per_second=1000)
+    monkeypatch.setattr(alma, "ALMA_RATE_LIMITER", rate_limiter)
+    return rate_limiter
+
+
 @pytest.fixture(scope="function")
 def aws_credentials():
     os.environ["AWS_ACCESS_KEY_ID"] = "testing"
@@ -58,6 +69,11 @@ def mocked_alma(po_line_record_all_fields):
                 "http://example.com/acq/funds?q=fund_code~also-over-encumbered",
                 json={"total_record_count": 0},
             )
+            m.get(
+                "http://example.com/acq/funds?view=full&limit=100&offset=0",
+                complete_qs=True,
+                json=funds,
+            )
 
         # Invoice endpoints
         with open("tests/fixtures/invoices.json") as f:
@@ -270,7 +286,11 @@ def mocked_alma_with_errors():
 
 @pytest.fixture()
 def mocked_alma_api_client():
-    alma_api_client = Alma_API_Client("abc123", base_api_url="http://example.com/")
+    alma_api_client = Alma_API_Client(
+        "abc123",
+        base_api_url="http://example.com/",
+        rate_limiter=RateLimiter(requests_per_second=1000),
+    )
     alma_api_client.set_content_headers("application/json", "application/json")
     return alma_api_client
 
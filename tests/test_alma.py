@@ -1,8 +1,17 @@
+import asyncio
 import datetime
 import json
+from unittest import mock
+
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+from requests import HTTPError, Response
 
 from llama import CONFIG
-from llama.alma import Alma_API_Client
+from llama.alma import Alma_API_Client, AsyncAlmaClient
+from llama.cache import MetadataCache
+from llama.rate_limiter import RateLimiter
 
 
 def test_client_init_with_params():
@@ -18,6 +27,44 @@ def test_client_init_from_config():
     assert client.headers == {"Authorization": "apikey abc123"}
 
 
+def test_client_init_session_options():
+    client = Alma_API_Client(
+        api_key="abc123",
+        base_api_url="http://example.com/",
+        pool_maxsize=4,
+        connect_timeout=2,
+        read_timeout=30,
+    )
+    adapter = client.session.get_adapter("https://example.com/")
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 4
+    assert client.timeout == (2, 30)
+    assert client.session.headers["Connection"] == "keep-alive"
+
+
+def test_client_init_without_keep_alive():
+    client = Alma_API_Client(
+        api_key="abc123", base_api_url="http://example.com/", keep_alive=False
+    )
+    assert client.session.headers["Connection"] == "close"
+
+
+def test_alma_requests_use_client_session(mocked_alma, mocked_alma_api_client):
+    session = mocked_alma_api_client.session
+    with mock.patch.object(session, "request", wraps=session.request) as request:
+        mocked_alma_api_client.get_fund_by_code("ABC")
+        mocked_alma_api_client.get_vendor_details("BKHS")
+    assert request.call_count == 2
+    assert all(call.kwargs["timeout"] == (10, 60) for call in request.call_args_list)
+
+
+def test_client_context_manager_closes_session():
+    client = Alma_API_Client("abc123", base_api_url="http://example.com/")
+    with mock.patch.object(client.session, "close") as close:
+        with client:
+            pass
+    close.assert_called_once()
+
+
 def test_alma_set_content_headers():
     client = Alma_API_Client(api_key="abc123", base_api_url="http://example.com/")
     assert len(client.headers) == 1
@@ -67,6 +114,38 @@ def test_alma_get_fund_by_code(mocked_alma, mocked_alma_api_client):
     assert fund["fund"][0]["external_id"] == "1234567-000001"
 
 
+def test_alma_get_fund_by_code_uses_cache(mocked_alma, tmp_path):
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        client = Alma_API_Client(
+            "abc123", base_api_url="http://example.com/", cache=cache
+        )
+        assert client.get_fund_by_code("ABC") == client.get_fund_by_code("ABC")
+        client.get_fund_by_code("over-encumbered")
+        client.get_fund_by_code("over-encumbered")
+    assert [r.qs["q"][0] for r in mocked_alma.request_history] == [
+        "fund_code~abc",
+        "fund_code~over-encumbered",
+        "fund_code~over-encumbered",
+    ]
+
+
+def test_alma_get_vendor_details_uses_cache(mocked_alma, tmp_path):
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        client = Alma_API_Client(
+            "abc123", base_api_url="http://example.com/", cache=cache
+        )
+        vendor = client.get_vendor_details("BKHS")
+        assert client.get_vendor_details("BKHS") == vendor
+        assert cache.hits == 1
+    assert mocked_alma.call_count == 1
+
+
+def test_alma_get_funds(mocked_alma, mocked_alma_api_client):
+    funds = list(mocked_alma_api_client.get_funds())
+    assert [f["code"] for f in funds] == ["ABC", "DEF", "GHI", "JKL"]
+    assert mocked_alma.last_request.qs["view"] == ["full"]
+
+
 def test_alma_get_invoice(mocked_alma, mocked_alma_api_client):
     invoice = mocked_alma_api_client.get_invoice("558809630001021")
     assert invoice["number"] == "0501130657"
@@ -83,12 +162,29 @@ def test_alma_get_vendor_invoices(mocked_alma, mocked_alma_api_client):
     assert len(list(invoices)) == 5
 
 
+def test_alma_get_brief_po_lines_with_order(mocked_alma, mocked_alma_api_client):
+    po_line_stubs = mocked_alma_api_client.get_brief_po_lines(
+        "PURCHASE_NOLETTER", order_by="created_date", direction="desc"
+    )
+    assert next(po_line_stubs) == {"created_date": "2021-05-15Z", "number": "POL-789"}
+    assert mocked_alma.last_request.qs["order_by"] == ["created_date"]
+    assert mocked_alma.last_request.qs["direction"] == ["desc"]
+
+
 def test_alma_get_po_line_full_record(mocked_alma, mocked_alma_api_client):
     po_line_record = mocked_alma_api_client.get_full_po_line("POL-123")
     assert po_line_record["resource_metadata"]["title"] == "Book title"
     assert po_line_record["created_date"] == "2021-05-13Z"
 
 
+def test_alma_get_po_line_full_record_error_raises_error(
+    mocked_alma, mocked_alma_api_client
+):
+    mocked_alma.get("http://example.com/acq/po-lines/POL-404", status_code=404)
+    with pytest.raises(HTTPError):
+        mocked_alma_api_client.get_full_po_line("POL-404")
+
+
 def test_alma_mark_invoice_paid(mocked_alma):
     client = Alma_API_Client("abc123")
     paid = client.mark_invoice_paid(
@@ -123,3 +219,243 @@ def test_alma_get_paged(mocked_alma, mocked_alma_api_client):
 def test_alma_process_invoice(mocked_alma, mocked_alma_api_client):
     processed_invoice = mocked_alma_api_client.process_invoice("00000055555000000")
     assert processed_invoice["invoice_workflow_status"]["value"] == "Waiting to be Sent"
+
+
+def test_alma_requests_use_rate_limiter(mocked_alma):
+    limiter = RateLimiter(requests_per_second=10, burst=1)
+    client = Alma_API_Client(
+        "abc123", base_api_url="http://example.com/", rate_limiter=limiter
+    )
+    client.get_fund_by_code("ABC")
+    client.get_fund_by_code("DEF")
+    assert limiter.throttled_requests == 1
+
+
+def test_alma_clients_share_default_rate_limiter(alma_rate_limiter):
+    client_1 = Alma_API_Client("abc123", base_api_url="http://example.com/")
+    client_2 = Alma_API_Client("abc123", base_api_url="http://example.com/")
+    assert client_1.rate_limiter is client_2.rate_limiter is alma_rate_limiter
+
+
+def test_alma_get_paged_concurrently(mocked_alma, mocked_alma_api_client):
+    records = mocked_alma_api_client.get_paged(
+        endpoint="paged",
+        record_type="fake_records",
+        limit=10,
+        workers=2,
+    )
+    assert [r["record_number"] for r in records] == list(range(15))
+
+
+def test_alma_get_paged_concurrently_yields_pages_in_order(
+    mocked_alma, mocked_alma_api_client
+):
+    for offset in range(0, 100, 10):
+        mocked_alma.get(
+            f"http://example.com/many-pages?limit=10&offset={offset}",
+            complete_qs=True,
+            json={
+                "total_record_count": 95,
+                "fake_records": [
+                    {"record_number": i} for i in range(offset, min(offset + 10, 95))
+                ],
+            },
+        )
+    records = mocked_alma_api_client.get_paged(
+        endpoint="many-pages", record_type="fake_records", limit=10, workers=3
+    )
+    assert [r["record_number"] for r in records] == list(range(95))
+    assert mocked_alma.call_count == 10
+
+
+def test_alma_get_paged_uses_client_page_workers(mocked_alma):
+    client = Alma_API_Client(
+        "abc123", base_api_url="http://example.com/", page_workers=2
+    )
+    with mock.patch.object(
+        client, "_get_pages_concurrently", return_value=iter([])
+    ) as get_pages_concurrently:
+        assert list(client.get_vendor_invoices("BKHS")) == []
+    get_pages_concurrently.assert_called_once_with(
+        "acq/vendors/BKHS/invoices", "invoice", None, 100, 2, None
+    )
+
+
+def test_alma_get_paged_decodes_each_page_once(mocked_alma, mocked_alma_api_client):
+    with mock.patch(
+        "requests.Response.json", autospec=True, side_effect=Response.json
+    ) as response_json:
+        records = list(
+            mocked_alma_api_client.get_paged(
+                endpoint="paged", record_type="fake_records", limit=10
+            )
+        )
+    assert len(records) == 15
+    assert response_json.call_count == 2
+
+
+def test_alma_get_paged_reports_page_metrics(mocked_alma, mocked_alma_api_client):
+    pages = []
+    records = mocked_alma_api_client.get_paged(
+        endpoint="paged", record_type="fake_records", limit=10, on_page=pages.append
+    )
+    assert len(list(records)) == 15
+    assert [(p.offset, p.records) for p in pages] == [(0, 10), (10, 5)]
+    assert all(p.bytes > 0 and p.elapsed >= 0 for p in pages)
+
+
+def test_alma_get_paged_max_records(mocked_alma, mocked_alma_api_client):
+    records = mocked_alma_api_client.get_paged(
+        endpoint="paged", record_type="fake_records", limit=10, max_records=5
+    )
+    assert [r["record_number"] for r in records] == list(range(5))
+    assert mocked_alma.call_count == 1
+
+
+def test_alma_get_paged_concurrently_max_records(mocked_alma, mocked_alma_api_client):
+    records = mocked_alma_api_client.get_paged(
+        endpoint="paged",
+        record_type="fake_records",
+        limit=10,
+        workers=2,
+        max_records=12,
+    )
+    assert [r["record_number"] for r in records] == list(range(12))
+    assert mocked_alma.call_count == 2
+
+
+def test_alma_get_paged_stops_on_empty_page(mocked_alma, mocked_alma_api_client):
+    mocked_alma.get(
+        "http://example.com/short-paged",
+        json={"total_record_count": 50, "fake_records": []},
+    )
+    records = mocked_alma_api_client.get_paged(
+        endpoint="short-paged", record_type="fake_records", limit=10
+    )
+    assert list(records) == []
+    assert mocked_alma.call_count == 1
+
+
+def test_async_client_get_fund_by_code():
+    async def get_funds():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/"
+        ) as client:
+            return await asyncio.gather(
+                client.get_fund_by_code("ABC"), client.get_fund_by_code("DEF")
+            )
+
+    with aioresponses() as m:
+        m.get(
+            "http://example.com/acq/funds?q=fund_code~ABC&view=full",
+            payload={"fund": [{"code": "ABC"}], "total_record_count": 1},
+        )
+        m.get(
+            "http://example.com/acq/funds?q=fund_code~DEF&view=full",
+            payload={"fund": [{"code": "DEF"}], "total_record_count": 1},
+        )
+        funds = asyncio.run(get_funds())
+    assert [f["fund"][0]["code"] for f in funds] == ["ABC", "DEF"]
+
+
+def test_async_client_get_paged_yields_records_in_order():
+    async def get_records():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/", max_concurrency=2
+        ) as client:
+            return [
+                r
+                async for r in client.get_paged(
+                    "paged", "fake_records", params={"q": "x"}, limit=10
+                )
+            ]
+
+    with aioresponses() as m:
+        for offset in range(0, 55, 10):
+            m.get(
+                f"http://example.com/paged?q=x&limit=10&offset={offset}",
+                payload={
+                    "total_record_count": 55,
+                    "fake_records": [
+                        {"record_number": i}
+                        for i in range(offset, min(offset + 10, 55))
+                    ],
+                },
+            )
+        records = asyncio.run(get_records())
+    assert [r["record_number"] for r in records] == list(range(55))
+
+
+def test_async_client_get_paged_max_records():
+    async def get_records():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/"
+        ) as client:
+            return [
+                r
+                async for r in client.get_paged(
+                    "paged", "fake_records", limit=10, max_records=3
+                )
+            ]
+
+    with aioresponses() as m:
+        m.get(
+            "http://example.com/paged?limit=10&offset=0",
+            payload={
+                "total_record_count": 20,
+                "fake_records": [{"record_number": i} for i in range(10)],
+            },
+        )
+        records = asyncio.run(get_records())
+    assert [r["record_number"] for r in records] == [0, 1, 2]
+
+
+def test_async_client_mark_invoice_paid():
+    async def mark_paid():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/"
+        ) as client:
+            return await client.mark_invoice_paid(
+                "558809630001021", datetime.datetime(2021, 7, 22), "120", "USD"
+            )
+
+    with open("tests/fixtures/invoice_paid.json") as f:
+        invoice_paid = json.load(f)
+    with aioresponses() as m:
+        m.post(
+            "http://example.com/acq/invoices/558809630001021?op=paid",
+            payload=invoice_paid,
+        )
+        paid = asyncio.run(mark_paid())
+        request = next(iter(m.requests.values()))[0]
+    assert paid["payment"]["payment_status"]["value"] == "PAID"
+    assert json.loads(request.kwargs["data"])["payment"]["voucher_amount"] == "120"
+
+
+def test_async_client_error_response_raises_error():
+    async def get_po_line():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/"
+        ) as client:
+            return await client.get_full_po_line("POL-404")
+
+    with aioresponses() as m:
+        m.get("http://example.com/acq/po-lines/POL-404", status=404)
+        with pytest.raises(aiohttp.ClientResponseError):
+            asyncio.run(get_po_line())
+
+
+def test_async_client_uses_rate_limiter():
+    limiter = RateLimiter(requests_per_second=100, burst=1)
+
+    async def get_invoices():
+        async with AsyncAlmaClient(
+            "abc123", base_api_url="http://example.com/", rate_limiter=limiter
+        ) as client:
+            await asyncio.gather(*[client.get_invoice(i) for i in ("01", "02", "03")])
+
+    with aioresponses() as m:
+        for invoice_id in ("01", "02", "03"):
+            m.get(f"http://example.com/acq/invoices/{invoice_id}", payload={})
+        asyncio.run(get_invoices())
+    assert limiter.throttled_requests == 2
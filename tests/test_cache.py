@@ -0,0 +1,68 @@
+import os
+
+from freezegun import freeze_time
+
+from llama.cache import CACHE_FILE_NAME, MetadataCache, open_metadata_cache
+
+
+def test_metadata_cache_get_and_set(tmp_path):
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("vendors/AAA") is None
+        cache.set("vendors/AAA", {"code": "AAA"})
+        assert cache.get("vendors/AAA") == {"code": "AAA"}
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+
+def test_metadata_cache_persists_between_instances(tmp_path):
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        cache.set("vendors/AAA", {"code": "AAA"})
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("vendors/AAA") == {"code": "AAA"}
+
+
+def test_metadata_cache_expires_entries(tmp_path):
+    with freeze_time("2021-09-27 08:00:00") as frozen_time:
+        with MetadataCache(tmp_path / "cache.sqlite3", ttl=3600) as cache:
+            cache.set("vendors/AAA", {"code": "AAA"})
+            frozen_time.tick(3599)
+            assert cache.get("vendors/AAA") == {"code": "AAA"}
+            frozen_time.tick(2)
+            assert cache.get("vendors/AAA") is None
+
+
+def test_metadata_cache_evicts_least_recently_used(tmp_path):
+    with freeze_time("2021-09-27 08:00:00") as frozen_time:
+        with MetadataCache(tmp_path / "cache.sqlite3", max_bytes=40) as cache:
+            cache.set("vendors/AAA", {"code": "AAA"})
+            frozen_time.tick(1)
+            cache.set("vendors/BBB", {"code": "BBB"})
+            frozen_time.tick(1)
+            cache.get("vendors/AAA")
+            frozen_time.tick(1)
+            cache.set("vendors/CCC", {"code": "CCC"})
+            assert cache.get("vendors/AAA") == {"code": "AAA"}
+            assert cache.get("vendors/BBB") is None
+            assert cache.get("vendors/CCC") == {"code": "CCC"}
+
+
+def test_metadata_cache_refresh_ignores_existing_entries(tmp_path):
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        cache.set("vendors/AAA", {"code": "AAA"})
+    with MetadataCache(tmp_path / "cache.sqlite3", refresh=True) as cache:
+        assert cache.get("vendors/AAA") is None
+        cache.set("vendors/AAA", {"code": "AAA", "name": "New name"})
+    with MetadataCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("vendors/AAA") == {"code": "AAA", "name": "New name"}
+
+
+def test_open_metadata_cache_creates_directory(tmp_path):
+    cache_dir = tmp_path / "cache"
+    with open_metadata_cache(str(cache_dir)) as cache:
+        assert isinstance(cache, MetadataCache)
+    assert os.path.exists(cache_dir / CACHE_FILE_NAME)
+
+
+def test_open_metadata_cache_without_directory():
+    with open_metadata_cache(None) as cache:
+        assert cache is None
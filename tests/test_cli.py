@@ -1,9 +1,12 @@
+import json
+
 import boto3
 from freezegun import freeze_time
 from moto import mock_ses
 
 from llama import CONFIG
 from llama.cli import cli
+from llama.ssm import SSM
 
 
 @mock_ses
@@ -165,9 +168,49 @@ def test_sap_invoices_review_run(runner, mocked_alma, mocked_ses, mocked_ssm):
     assert result.exit_code == 0
 
 
-def test_sap_invoices_review_run_no_invoices(runner, mocked_alma_no_invoices):
+def test_sap_invoices_review_run_preload_funds(
+    caplog, runner, mocked_alma, mocked_ses, mocked_ssm
+):
+    result = runner.invoke(cli, ["sap-invoices", "--preload-funds"])
+    assert result.exit_code == 0
+    assert "4 funds preloaded from Alma" in caplog.text
+
+
+def test_sap_invoices_review_run_with_cache(
+    caplog, runner, mocked_alma, mocked_ses, mocked_ssm, tmp_path
+):
+    cache_dir = str(tmp_path / "cache")
+    result = runner.invoke(cli, ["sap-invoices", "--cache-dir", cache_dir])
+    assert result.exit_code == 0
+    assert "Alma metadata cache: 0 hits" in caplog.text
+    caplog.clear()
+    result = runner.invoke(cli, ["sap-invoices", "--cache-dir", cache_dir])
+    assert result.exit_code == 0
+    assert "Alma metadata cache: 5 hits, 1 misses" in caplog.text
+    caplog.clear()
+    result = runner.invoke(
+        cli, ["sap-invoices", "--cache-dir", cache_dir, "--refresh-cache"]
+    )
+    assert result.exit_code == 0
+    assert "Alma metadata cache: 0 hits" in caplog.text
+
+
+def test_sap_invoices_review_run_no_invoices(caplog, runner, mocked_alma_no_invoices):
     result = runner.invoke(cli, ["sap-invoices"])
     assert result.exit_code == 1
+    assert "Alma API requests throttled for 0.00 seconds" in caplog.text
+
+
+def test_sap_invoices_review_run_parallel(
+    caplog, runner, mocked_alma, mocked_ses, mocked_ssm
+):
+    result = runner.invoke(cli, ["sap-invoices", "--parallel"])
+    assert result.exit_code == 0
+    messages = caplog.messages
+    monograph_report = messages.index("Generating monographs report")
+    serial_start = messages.index("Starting file generation process for serial run")
+    assert monograph_report < serial_start
+    assert messages.index("Generating serials report") > serial_start
 
 
 def test_sap_invoices_review_run_real_run(runner, mocked_alma, mocked_ses, mocked_ssm):
@@ -187,9 +230,129 @@ def test_sap_invoices_final_run_real_run(
     mocked_sftp_server,
     mocked_ssm,
     test_sftp_private_key,
+    tmp_path,
+):
+    CONFIG.SAP_DROPBOX_HOST = mocked_sftp_server.host
+    CONFIG.SAP_DROPBOX_PORT = mocked_sftp_server.port
+    CONFIG.SAP_DROPBOX_KEY = test_sftp_private_key
+    result = runner.invoke(
+        cli,
+        ["sap-invoices", "--final-run", "--real-run", "--journal-dir", str(tmp_path)],
+    )
+    assert result.exit_code == 0
+    (journal_file,) = tmp_path.iterdir()
+    with open(journal_file) as f:
+        events = [json.loads(line)["event"] for line in f]
+    assert events.count("files_sent") == 2
+    assert events.count("sequence_updated") == 2
+    assert events.count("email_sent") == 2
+
+
+def test_sap_invoices_final_run_real_run_resume(
+    caplog,
+    runner,
+    mocked_alma,
+    mocked_ses,
+    mocked_sftp_server,
+    mocked_ssm,
+    test_sftp_private_key,
+    tmp_path,
 ):
     CONFIG.SAP_DROPBOX_HOST = mocked_sftp_server.host
     CONFIG.SAP_DROPBOX_PORT = mocked_sftp_server.port
     CONFIG.SAP_DROPBOX_KEY = test_sftp_private_key
-    result = runner.invoke(cli, ["sap-invoices", "--final-run", "--real-run"])
+    result = runner.invoke(
+        cli,
+        ["sap-invoices", "--final-run", "--real-run", "--journal-dir", str(tmp_path)],
+    )
     assert result.exit_code == 0
+    (journal_file,) = tmp_path.iterdir()
+
+    # Simulate the run failing after sending monograph files and marking the first
+    # monograph invoice paid
+    with open(journal_file) as f:
+        entries = f.readlines()
+    with open(journal_file, "w") as f:
+        f.writelines(entries[:4])
+    caplog.clear()
+    result = runner.invoke(
+        cli,
+        [
+            "sap-invoices",
+            "--final-run",
+            "--real-run",
+            "--journal-dir",
+            str(tmp_path),
+            "--resume",
+            journal_file.stem,
+        ],
+    )
+    assert result.exit_code == 0
+    assert "Resuming run, monograph files were already sent" in caplog.text
+    assert "Resuming run, monograph SAP sequence was already updated" in caplog.text
+    assert "Skipping 1 invoices already marked paid in this run" in caplog.text
+    assert "Sent data file 'dlibsapg.1003." in caplog.text
+    assert "Sent data file 'dlibsapg.1002." not in caplog.text
+
+
+def test_sap_invoices_resume_requires_final_real_run(runner, tmp_path):
+    result = runner.invoke(cli, ["sap-invoices", "--resume", "20220107000000"])
+    assert result.exit_code == 2
+    assert "may only be used with the '--final-run' and '--real-run'" in result.output
+
+
+def test_sap_invoices_resume_unknown_run(runner, tmp_path):
+    result = runner.invoke(
+        cli,
+        [
+            "sap-invoices",
+            "--final-run",
+            "--real-run",
+            "--journal-dir",
+            str(tmp_path),
+            "--resume",
+            "20220107000000",
+        ],
+    )
+    assert result.exit_code == 2
+    assert "no journal found for run '20220107000000'" in result.output
+
+
+def test_sap_invoices_final_run_real_run_parallel(
+    caplog,
+    runner,
+    mocked_alma,
+    mocked_ses,
+    mocked_sftp_server,
+    mocked_ssm,
+    test_sftp_private_key,
+    tmp_path,
+):
+    CONFIG.SAP_DROPBOX_HOST = mocked_sftp_server.host
+    CONFIG.SAP_DROPBOX_PORT = mocked_sftp_server.port
+    CONFIG.SAP_DROPBOX_KEY = test_sftp_private_key
+    result = runner.invoke(
+        cli,
+        [
+            "sap-invoices",
+            "--final-run",
+            "--real-run",
+            "--parallel",
+            "--journal-dir",
+            str(tmp_path),
+        ],
+    )
+    assert result.exit_code == 0
+    messages = caplog.messages
+    monograph_email = next(
+        i for i, m in enumerate(messages) if m.startswith("Monographs email sent")
+    )
+    serial_start = messages.index("Starting file generation process for serial run")
+    assert monograph_email < serial_start
+    assert caplog.text.count("Real run, updating SAP sequence") == 1
+    ssm = SSM()
+    assert ssm.get_parameter_value("/test/example/SAP_SEQUENCE").startswith("1003,")
+    (journal_file,) = tmp_path.iterdir()
+    with open(journal_file) as f:
+        events = [json.loads(line)["event"] for line in f]
+    assert events.count("sequence_updated") == 2
@@ -213,3 +213,21 @@ def test_ssm_safety_check_raises_error(monkeypatch):
         "Production SSM_PATH may ONLY be used in the production environment. "
         "Check your env variables and try again."
     )
+
+
+def test_optional_config_value_default(monkeypatch):
+    monkeypatch.delenv("ALMA_API_REQUESTS_PER_SECOND", raising=False)
+    config = Config()
+    assert config.ALMA_API_REQUESTS_PER_SECOND == "10"
+
+
+def test_optional_config_value_from_env(monkeypatch):
+    monkeypatch.setenv("ALMA_API_REQUESTS_PER_SECOND", "20")
+    config = Config()
+    assert config.ALMA_API_REQUESTS_PER_SECOND == "20"
+
+
+def test_prod_stage_optional_config_value_default(mocked_ssm, monkeypatch):
+    monkeypatch.setenv("WORKSPACE", "stage")
+    config = Config()
+    assert config.ALMA_API_REQUESTS_PER_SECOND == "10"
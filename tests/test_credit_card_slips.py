@@ -1,8 +1,29 @@
+from unittest import mock
+
+import pytest
 from defusedxml import ElementTree as ET
+from freezegun import freeze_time
+from requests import HTTPError
 
 from llama import credit_card_slips
 
 
+def test_compile_slot_index_matches_element_classes():
+    xml_template = credit_card_slips.load_xml_template(
+        "config/credit_card_slip_template.xml"
+    )
+    slot_index = credit_card_slips.compile_slot_index(xml_template)
+    for element_class, paths in slot_index.items():
+        elements = []
+        for path in paths:
+            element = xml_template
+            for i in path:
+                element = element[i]
+            elements.append(element)
+        assert elements == xml_template.findall(f'.//td[@class="{element_class}"]')
+    assert "poline" in slot_index
+
+
 def test_create_po_line_dict_all_fields(
     mocked_alma,
     mocked_alma_api_client,
@@ -87,6 +108,42 @@ def test_create_po_line_dicts(
         assert po_line_dict["vendor"] == "Corporation"
 
 
+def test_create_po_line_dicts_shares_fund_cache(
+    mocked_alma,
+    mocked_alma_api_client,
+    po_line_record_all_fields,
+    po_line_record_multiple_funds,
+):
+    po_line_records = [
+        po_line_record_all_fields,
+        po_line_record_multiple_funds,
+        po_line_record_all_fields,
+    ]
+    fund_cache = credit_card_slips.FundAccountCache(mocked_alma_api_client)
+    po_line_dicts = list(
+        credit_card_slips.create_po_line_dicts(
+            mocked_alma_api_client, po_line_records, fund_cache
+        )
+    )
+    assert [d["account_1"] for d in po_line_dicts] == ["1234567-000001"] * 3
+    assert fund_cache.misses == 2
+    assert fund_cache.hits == 2
+    fund_requests = [r for r in mocked_alma.request_history if "funds" in r.path]
+    assert len(fund_requests) == 2
+
+
+def test_fund_account_cache_expires_entries(mocked_alma, mocked_alma_api_client):
+    with freeze_time("2021-05-13") as frozen_time:
+        fund_cache = credit_card_slips.FundAccountCache(mocked_alma_api_client, ttl=60)
+        assert fund_cache.get_account("ABC") == "1234567-000001"
+        frozen_time.tick(30)
+        assert fund_cache.get_account("ABC") == "1234567-000001"
+        frozen_time.tick(31)
+        assert fund_cache.get_account("ABC") == "1234567-000001"
+    assert fund_cache.hits == 1
+    assert fund_cache.misses == 2
+
+
 def test_get_account_from_fund_code_with_fund_code(
     mocked_alma,
     mocked_alma_api_client,
@@ -123,6 +180,90 @@ def test_get_credit_card_full_po_lines_from_date(mocked_alma, mocked_alma_api_cl
         assert po_line_record["created_date"] == "2021-05-13Z"
 
 
+def test_get_credit_card_full_po_lines_from_date_concurrent_keeps_order(
+    mocked_alma, mocked_alma_api_client, po_line_record_all_fields
+):
+    po_line_numbers = [f"POL-{i}" for i in range(10)]
+    mocked_alma.get(
+        "http://example.com/acq/po-lines?acquisition_method=PURCHASE_NOLETTER",
+        json={
+            "total_record_count": 10,
+            "po_line": [
+                {"number": n, "created_date": "2021-05-13Z"} for n in po_line_numbers
+            ],
+        },
+    )
+    for number in po_line_numbers:
+        mocked_alma.get(
+            f"http://example.com/acq/po-lines/{number}",
+            json=dict(po_line_record_all_fields, number=number),
+        )
+    po_line_records = credit_card_slips.get_credit_card_full_po_lines_from_date(
+        mocked_alma_api_client, "2021-05-13", workers=4
+    )
+    assert [p["number"] for p in po_line_records] == po_line_numbers
+
+
+def test_get_credit_card_full_po_lines_from_date_raises_on_failed_fetch(
+    mocked_alma, mocked_alma_api_client
+):
+    mocked_alma.get(
+        "http://example.com/acq/po-lines?acquisition_method=PURCHASE_NOLETTER",
+        json={
+            "total_record_count": 2,
+            "po_line": [
+                {"number": "POL-123", "created_date": "2021-05-13Z"},
+                {"number": "POL-500", "created_date": "2021-05-13Z"},
+            ],
+        },
+    )
+    mocked_alma.get("http://example.com/acq/po-lines/POL-500", status_code=500)
+    with pytest.raises(HTTPError):
+        credit_card_slips.get_credit_card_full_po_lines_from_date(
+            mocked_alma_api_client, "2021-05-13", workers=2
+        )
+
+
+def test_get_credit_card_po_line_numbers_from_date_falls_back_to_full_scan(
+    caplog, mocked_alma, mocked_alma_api_client
+):
+    mocked_alma.get(
+        "http://example.com/acq/po-lines?order_by=created_date", status_code=400
+    )
+    po_line_numbers = credit_card_slips.get_credit_card_po_line_numbers_from_date(
+        mocked_alma_api_client, "2021-05-15"
+    )
+    assert po_line_numbers == ["POL-789"]
+    assert "scanning all PO lines" in caplog.text
+    assert "Scanned 1 brief PO lines, kept 1 created on 2021-05-15" in caplog.text
+
+
+def test_filter_po_lines_by_created_date_newest_first_stops_early():
+    brief_po_lines = [
+        {"number": "POL-3", "created_date": "2021-05-14Z"},
+        {"number": "POL-2", "created_date": "2021-05-13Z"},
+        {"number": "POL-1", "created_date": "2021-05-13Z"},
+    ] + [{"number": f"POL-0{i}", "created_date": "2021-05-12Z"} for i in range(500)]
+    po_line_numbers, scanned = credit_card_slips.filter_po_lines_by_created_date(
+        iter(brief_po_lines), "2021-05-13Z", newest_first=True
+    )
+    assert po_line_numbers == ["POL-2", "POL-1"]
+    assert scanned == 3 + credit_card_slips.EARLY_STOP_CONFIRMATION
+
+
+def test_filter_po_lines_by_created_date_unordered_scans_all(caplog):
+    brief_po_lines = [
+        {"number": f"POL-0{i}", "created_date": "2021-05-12Z"} for i in range(150)
+    ] + [{"number": "POL-1", "created_date": "2021-05-13Z"}]
+    brief_po_lines.insert(50, {"number": "POL-2", "created_date": "2021-05-13Z"})
+    po_line_numbers, scanned = credit_card_slips.filter_po_lines_by_created_date(
+        brief_po_lines, "2021-05-13Z", newest_first=True
+    )
+    assert po_line_numbers == ["POL-2", "POL-1"]
+    assert scanned == 152
+    assert "not ordered by created date" in caplog.text
+
+
 def test_get_po_line_created_date_with_date(po_line_record_all_fields):
     po_line_created_date = credit_card_slips.get_po_line_created_date(
         po_line_record_all_fields
@@ -165,6 +306,41 @@ def test_get_total_price_without_total_price():
     assert credit_card_slips.get_total_price(po_line_record, "15.00") == "15.00"
 
 
+def test_load_slot_index_uses_compiled_index():
+    with mock.patch("llama.credit_card_slips.compile_slot_index") as compile_slot_index:
+        slot_index = credit_card_slips.load_slot_index(
+            credit_card_slips.SLIP_TEMPLATE_FILE,
+            credit_card_slips.SLIP_SLOT_INDEX_FILE,
+        )
+    compile_slot_index.assert_not_called()
+    assert slot_index == credit_card_slips.compile_slot_index(
+        credit_card_slips.load_xml_template(credit_card_slips.SLIP_TEMPLATE_FILE)
+    )
+
+
+def test_load_slot_index_recompiles_stale_index(caplog, tmp_path):
+    template_file = tmp_path / "template.xml"
+    template_file.write_text('<ccslip><tr><td class="poline"/></tr></ccslip>')
+    index_file = tmp_path / "template.index.json"
+    credit_card_slips.save_slot_index(template_file, index_file)
+    assert credit_card_slips.load_slot_index(template_file, index_file) == {
+        "poline": [[0, 0]]
+    }
+    template_file.write_text('<ccslip><td class="vendor"/></ccslip>')
+    assert credit_card_slips.load_slot_index(template_file, index_file) == {
+        "vendor": [[0]]
+    }
+    assert "is out of date" in caplog.text
+
+
+def test_load_slot_index_missing_index(caplog, tmp_path):
+    slot_index = credit_card_slips.load_slot_index(
+        credit_card_slips.SLIP_TEMPLATE_FILE, tmp_path / "missing.json"
+    )
+    assert "poline" in slot_index
+    assert "not found" in caplog.text
+
+
 def test_load_xml_template():
     root = credit_card_slips.load_xml_template("config/credit_card_slip_template.xml")
     element_classes = [
@@ -201,3 +377,19 @@ def test_xml_data_from_dicts(mocked_alma):
     credit_card_slips_xml_string = credit_card_slips.xml_data_from_dicts(po_line_dicts)
     credit_card_slips_xml = ET.fromstring(credit_card_slips_xml_string)
     assert credit_card_slips_xml.find('.//td[@class="poline"]').text == "POL-123"
+
+
+def test_xml_data_from_dicts_multiple_slips_parses_template_once(mocked_alma):
+    po_line_dicts = [{"poline": f"POL-{i}"} for i in range(3)]
+    with mock.patch(
+        "llama.credit_card_slips.load_xml_template",
+        wraps=credit_card_slips.load_xml_template,
+    ) as load_xml_template:
+        credit_card_slips_xml_string = credit_card_slips.xml_data_from_dicts(
+            po_line_dicts
+        )
+    load_xml_template.assert_called_once()
+    credit_card_slips_xml = ET.fromstring(credit_card_slips_xml_string)
+    assert [
+        e.text for e in credit_card_slips_xml.findall('.//td[@class="poline"]')
+    ] == ["POL-0", "POL-1", "POL-2"]
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from llama.fixed_width import Field, FileTotals, FixedWidthLayout, FixedWidthWriter
+
+LAYOUT = FixedWidthLayout(
+    [
+        Field("record_type", 1, value="B"),
+        Field("name", 10),
+        Field("amount", 10, align=">", decimals=2),
+        Field("count", 5, align=">", fill="0", truncate=False),
+        Field("braces", 4, value="{}"),
+    ]
+)
+
+
+def test_fixed_width_layout_width():
+    assert LAYOUT.width == 30
+
+
+def test_fixed_width_layout_pack():
+    record = LAYOUT.pack({"name": "Danger Inc.", "amount": 1067.04, "count": 12})
+    assert record == "BDanger Inc   1067.0400012{}  "
+
+
+def test_fixed_width_layout_pack_missing_value_raises_error():
+    with pytest.raises(KeyError):
+        LAYOUT.pack({"name": "Danger Inc.", "amount": 1067.04})
+
+
+def test_fixed_width_layout_pack_value_too_long_raises_error():
+    with pytest.raises(ValueError):
+        LAYOUT.pack({"name": "Danger Inc.", "amount": 1067.04, "count": 123456})
+
+
+def test_fixed_width_layout_parse():
+    record = LAYOUT.pack({"name": "Danger", "amount": 150, "count": 3})
+    assert LAYOUT.parse(record + "\n") == {
+        "record_type": "B",
+        "name": "Danger",
+        "amount": 150.0,
+        "count": "3",
+        "braces": "{}",
+    }
+
+
+def test_fixed_width_layout_parse_wrong_width_raises_error():
+    with pytest.raises(ValueError):
+        LAYOUT.parse("B")
+
+
+def test_fixed_width_writer_totals():
+    out = io.StringIO()
+    writer = FixedWidthWriter(out)
+    writer.write(LAYOUT, {"name": "Danger", "amount": 0.1, "count": 1}, add_amount=0.1)
+    writer.write(LAYOUT, {"name": "Dañger", "amount": 0.2, "count": 2}, add_amount=0.2)
+    writer.write(LAYOUT, {"name": "Danger", "amount": 0.3, "count": 3})
+    assert writer.totals == FileTotals(
+        len(out.getvalue().encode("utf-8")), 3, pytest.approx(0.3)
+    )
+    assert writer.totals.bytes == 94
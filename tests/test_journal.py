@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from llama.journal import RunJournal
+
+
+def test_journal_records_and_reloads_entries(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    with RunJournal(path) as journal:
+        journal.record("run_started", date="2022-01-07T00:00:00")
+        journal.record("invoice_paid", invoice_id="01")
+        journal.record("invoice_paid", invoice_id="02")
+    with RunJournal(path) as journal:
+        assert [e["event"] for e in journal.entries] == [
+            "run_started",
+            "invoice_paid",
+            "invoice_paid",
+        ]
+        assert journal.find("run_started")["date"] == "2022-01-07T00:00:00"
+        assert journal.invoice_ids("invoice_paid") == {"01", "02"}
+
+
+def test_journal_find_matches_data(tmp_path):
+    with RunJournal(str(tmp_path / "run.jsonl")) as journal:
+        journal.record("files_sent", invoices_type="monograph")
+        assert journal.find("files_sent", invoices_type="monograph")
+        assert journal.find("files_sent", invoices_type="serial") is None
+        assert journal.find("email_sent") is None
+
+
+def test_journal_ignores_incomplete_last_entry(caplog, tmp_path):
+    path = tmp_path / "run.jsonl"
+    path.write_text(
+        json.dumps({"event": "invoice_paid", "invoice_id": "01"})
+        + '\n{"event": "invoice_pa'
+    )
+    with RunJournal(str(path)) as journal:
+        assert journal.invoice_ids("invoice_paid") == {"01"}
+    assert "Ignoring incomplete last entry" in caplog.text
+
+
+def test_journal_raises_error_for_corrupt_entry(tmp_path):
+    path = tmp_path / "run.jsonl"
+    path.write_text('{"event": "invoice_pa\n{"event": "invoice_paid"}\n')
+    with pytest.raises(json.JSONDecodeError):
+        RunJournal(str(path))
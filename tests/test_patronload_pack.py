@@ -0,0 +1,156 @@
+import os
+import zipfile
+from datetime import date
+
+import pytest
+
+from patronload.pack import (
+    RECORDS_FOOTER,
+    RECORDS_HEADER,
+    RecordArchives,
+    pack_patrons,
+)
+from patronload.render import RenderedRow, read_patrons
+from patronload.state import PatronDelta, PatronState
+from tests.test_patronload_records import STAFF_COLUMNS, STAFF_ROW
+
+
+def archive_xml(path):
+    with zipfile.ZipFile(path) as archive:
+        (name,) = archive.namelist()
+        assert name == os.path.basename(path)[:-4] + ".xml"
+        return archive.read(name)
+
+
+def records(*mit_ids, version=b""):
+    for mit_id in mit_ids:
+        yield RenderedRow(
+            mit_id=mit_id, xml=f"<user>{mit_id}</user>".encode() + version
+        )
+
+
+def test_record_archives_writes_user_records_file(tmp_path):
+    with RecordArchives(str(tmp_path), "staff", "20221007010000") as archives:
+        archives.add(b"<user>1</user>")
+        archives.add(b"<user>2</user>")
+    assert archives.paths == [str(tmp_path / "staff_20221007010000_1.zip")]
+    assert archives.records == 2
+    assert archive_xml(archives.paths[0]) == (
+        b"<?xml version='1.0' encoding='UTF-8'?>\n<userRecords>\n"
+        b"<user>1</user>\n<user>2</user>\n</userRecords>\n"
+    )
+    assert os.listdir(tmp_path) == ["staff_20221007010000_1.zip"]
+
+
+def test_record_archives_splits_records_by_size(tmp_path):
+    record = b"<user>" + b"x" * 88 + b"</user>"
+    max_bytes = len(RECORDS_HEADER) + 3 * (len(record) + 1) + len(RECORDS_FOOTER)
+    with RecordArchives(str(tmp_path), "student", "1", max_bytes) as archives:
+        for _ in range(7):
+            archives.add(record)
+    assert [os.path.basename(p) for p in archives.paths] == [
+        "student_1_1.zip",
+        "student_1_2.zip",
+        "student_1_3.zip",
+    ]
+    xml = [archive_xml(path) for path in archives.paths]
+    assert [x.count(b"<user>") for x in xml] == [3, 3, 1]
+    assert all(len(x) <= max_bytes for x in xml)
+
+
+def test_record_archives_writes_nothing_without_records(tmp_path):
+    with RecordArchives(str(tmp_path), "staff", "1") as archives:
+        pass
+    assert archives.paths == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_record_archives_removes_archive_on_error(tmp_path):
+    with pytest.raises(ValueError):
+        with RecordArchives(str(tmp_path), "staff", "1") as archives:
+            archives.add(b"<user>1</user>")
+            raise ValueError
+    assert archives.paths == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_pack_patrons_staff_take_precedence(tmp_path):
+    with PatronState(str(tmp_path / "state.db")) as state:
+        staff_delta = PatronDelta(state, "staff")
+        student_delta = PatronDelta(state, "student")
+        staff, students = pack_patrons(
+            records("1", "2"),
+            records("2", "3", version=b" "),
+            staff_delta,
+            student_delta,
+            str(tmp_path),
+            "1",
+        )
+    assert staff.records == 2
+    assert staff.patrons == 2
+    assert archive_xml(staff.paths[0]).count(b"<user>") == 2
+    assert students.records == 1
+    assert students.patrons == 1
+    assert b"<user>3</user> \n" in archive_xml(students.paths[0])
+    assert b"<user>2</user>" not in archive_xml(students.paths[0])
+
+
+def test_pack_patrons_packs_delta(tmp_path):
+    directory = str(tmp_path)
+    with PatronState(str(tmp_path / "state.db")) as state:
+        for run, (staff_ids, student_ids) in enumerate(
+            [(["1", "2"], ["3", "4"]), (["1", "4"], ["3", "5"])]
+        ):
+            staff_delta = PatronDelta(state, "staff")
+            student_delta = PatronDelta(state, "student")
+            staff, students = pack_patrons(
+                records(*staff_ids),
+                records(*student_ids),
+                staff_delta,
+                student_delta,
+                directory,
+                str(run),
+            )
+            staff_delta.save()
+            student_delta.save()
+    # 4 became staff and 5 is a new student
+    assert (staff.records, staff.removed) == (1, ["2"])
+    assert (students.records, students.removed) == (1, [])
+    assert b"<user>4</user>" in archive_xml(staff.paths[0])
+    assert b"<user>5</user>" in archive_xml(students.paths[0])
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = None
+
+    def execute(self, query):
+        self.description = [(name, None) for name in STAFF_COLUMNS]
+
+    def fetchmany(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def test_read_patrons_writes_rejects(tmp_path):
+    rejected_row = STAFF_ROW[:6] + (None,) + STAFF_ROW[7:]
+    cursor = FakeCursor([STAFF_ROW, rejected_row])
+    with open(tmp_path / "rejects.txt", "w") as rejects:
+        rendered = list(
+            read_patrons(
+                cursor,
+                "staff",
+                "SELECT",
+                {},
+                date(2022, 7, 7),
+                date(2024, 7, 7),
+                rejects,
+                batch_size=10,
+            )
+        )
+    assert [r.mit_id for r in rendered] == ["912345678"]
+    lines = (tmp_path / "rejects.txt").read_text().splitlines()
+    assert lines[0] == "|".join(STAFF_COLUMNS)
+    assert lines[1].startswith("Doe, Jane|")
+    assert len(lines) == 2
@@ -0,0 +1,210 @@
+import xml.etree.ElementTree as ET
+from datetime import date
+
+from patronload.records import (
+    STAFF_TEMPLATE_FILE,
+    STUDENT_TEMPLATE_FILE,
+    load_staff_template,
+    load_student_template,
+    render_staff_record,
+    render_student_record,
+    staff_from_row,
+    staff_reject_line,
+    student_from_row,
+)
+from patronload.template import PatronTemplate
+
+STAFF_COLUMNS = [
+    "FULL_NAME",
+    "OFFICE_ADDRESS",
+    "OFFICE_PHONE",
+    "MIT_ID",
+    "EMAIL_ADDRESS",
+    "APPOINTMENT_END_DATE",
+    "KRB_NAME_UPPERCASE",
+    "LIBRARY_PERSON_TYPE_CODE",
+    "LIBRARY_PERSON_TYPE",
+    "ORG_UNIT_ID",
+    "ORG_UNIT_TITLE",
+    "POSITION_TITLE",
+    "DIRECTORY_TITLE",
+    "LIBRARY_ID",
+]
+STAFF_ROW = (
+    "Doe, Jane",
+    "77 Massachusetts Ave",
+    "6172531000",
+    "912345678",
+    "jdoe@mit.edu",
+    date(2023, 6, 30),
+    "JDOE",
+    "11",
+    "Staff",
+    "10000001",
+    "Libraries",
+    None,
+    None,
+    "NONE",
+)
+STUDENT_COLUMNS = [
+    "MIT_ID",
+    "LAST_NAME",
+    "FIRST_NAME",
+    "MIDDLE_NAME",
+    "TERM_STREET1",
+    "TERM_STREET2",
+    "TERM_STREET3",
+    "TERM_CITY",
+    "TERM_STATE",
+    "TERM_ZIP",
+    "TERM_PHONE1",
+    "TERM_PHONE2",
+    "OFFICE_LOCATION",
+    "OFFICE_PHONE",
+    "STUDENT_YEAR",
+    "EMAIL_ADDRESS",
+    "KRB_NAME_UPPERCASE",
+    "HOME_DEPARTMENT",
+    "LIBRARY_ID",
+]
+STUDENT_ROW = (
+    "987654321",
+    "Smith",
+    "John",
+    None,
+    "3 Ames St",
+    "Room 101",
+    None,
+    "Cambridge",
+    "MA",
+    "02142",
+    None,
+    "6172532000",
+    None,
+    None,
+    "G",
+    "jsmith@mit.edu",
+    "JSMITH",
+    "6",
+    "39080012345678",
+)
+SIX_MONTHS = date(2022, 7, 7)
+TWO_YEARS = date(2024, 7, 7)
+
+
+def test_patron_template_renders_template_unchanged_without_values():
+    for path in (STAFF_TEMPLATE_FILE, STUDENT_TEMPLATE_FILE):
+        root = ET.parse(path).getroot()
+        expected = ET.tostring(root, encoding="UTF-8", xml_declaration=False)
+        assert PatronTemplate(path).render({}) == expected
+
+
+def test_patron_template_removes_sections_like_element_tree():
+    root = ET.parse(STUDENT_TEMPLATE_FILE).getroot()
+    user_identifiers = root.find("user_identifiers")
+    user_identifiers.remove(user_identifiers[1])
+    phones = root.find("contact_info/phones")
+    phones.remove(phones[0])
+    expected = ET.tostring(root, encoding="UTF-8", xml_declaration=False)
+    rendered = PatronTemplate(STUDENT_TEMPLATE_FILE).render(
+        {}, {"barcode_identifier", "phone_1"}
+    )
+    assert rendered == expected
+
+
+def test_patron_template_escapes_values():
+    template = PatronTemplate(STAFF_TEMPLATE_FILE)
+    rendered = template.render(
+        {"last_name": "O'Brien & <Sons>", "user_group_desc": 'Say "hi"'}
+    )
+    root = ET.fromstring(rendered)
+    assert root.findtext("last_name") == "O'Brien & <Sons>"
+    assert root.find("user_group").get("desc") == 'Say "hi"'
+
+
+def test_patron_template_empty_value_empties_element():
+    rendered = PatronTemplate(STAFF_TEMPLATE_FILE).render({"postal_code": ""})
+    assert b"<postal_code />" in rendered
+
+
+def test_staff_from_row_and_reject_line():
+    patron = staff_from_row(STAFF_COLUMNS, STAFF_ROW)
+    assert patron["MIT_ID"] == "912345678"
+    assert patron["APPOINTMENT_END_DATE"] == date(2023, 6, 30)
+    assert patron["POSITION_TITLE"] == ""
+    rejected_row = STAFF_ROW[:6] + (None,) + STAFF_ROW[7:]
+    assert staff_from_row(STAFF_COLUMNS, rejected_row) is None
+    assert staff_reject_line(rejected_row) == (
+        "Doe, Jane|77 Massachusetts Ave|6172531000|912345678|jdoe@mit.edu|"
+        "2023-06-30||11|Staff|10000001|Libraries|||NONE\n"
+    )
+
+
+def test_render_staff_record():
+    patron = staff_from_row(STAFF_COLUMNS, STAFF_ROW)
+    root = ET.fromstring(
+        render_staff_record(
+            load_staff_template(), patron, {"10000001": "AA"}, SIX_MONTHS, TWO_YEARS
+        )
+    )
+    assert root.findtext("primary_id") == "JDOE@MIT.EDU"
+    assert root.findtext("first_name") == "Jane"
+    assert root.findtext("last_name") == "Doe"
+    assert root.findtext("expiry_date") == "2022-07-07Z"
+    assert root.findtext("purge_date") == "2024-07-07Z"
+    assert root.find("user_group").get("desc") == "Staff"
+    assert [i.findtext("value") for i in root.iter("user_identifier")] == ["912345678"]
+    assert root.findtext(".//phone_number") == "617-253-1000"
+    statistic_category = root.find(".//statistic_category")
+    assert statistic_category.text == "AA"
+    assert statistic_category.get("desc") == "Libraries"
+
+
+def test_render_staff_record_without_phone_or_known_department():
+    patron = staff_from_row(STAFF_COLUMNS, STAFF_ROW)
+    patron.update({"OFFICE_PHONE": "", "ORG_UNIT_TITLE": ""})
+    root = ET.fromstring(
+        render_staff_record(load_staff_template(), patron, {}, SIX_MONTHS, TWO_YEARS)
+    )
+    assert root.find(".//phone") is None
+    statistic_category = root.find(".//statistic_category")
+    assert statistic_category.text == "ZQ"
+    assert statistic_category.get("desc") == "Unknown"
+
+
+def test_render_student_record():
+    patron = student_from_row(STUDENT_COLUMNS, STUDENT_ROW)
+    root = ET.fromstring(
+        render_student_record(
+            load_student_template(), patron, {"6": "EE"}, SIX_MONTHS, TWO_YEARS
+        )
+    )
+    assert root.findtext("primary_id") == "JSMITH@MIT.EDU"
+    assert root.findtext("middle_name") == ""
+    assert root.findtext("user_group") == "32"
+    assert root.findtext(".//line1") == "3 Ames St"
+    assert root.findtext(".//line3") == "Room 101"
+    assert [p.findtext("phone_number") for p in root.iter("phone")] == ["617-253-2000"]
+    assert [i.findtext("value") for i in root.iter("user_identifier")] == [
+        "987654321",
+        "39080012345678",
+    ]
+    assert root.findtext(".//statistic_category") == "EE"
+
+
+def test_render_student_record_special_group_and_two_phones():
+    patron = student_from_row(STUDENT_COLUMNS, STUDENT_ROW)
+    patron.update(
+        {"HOME_DEPARTMENT": "NIU", "OFFICE_PHONE": "6172533000", "TERM_PHONE1": "1"}
+    )
+    root = ET.fromstring(
+        render_student_record(
+            load_student_template(), patron, {}, SIX_MONTHS, TWO_YEARS
+        )
+    )
+    assert root.findtext("user_group") == "54"
+    assert [p.findtext("phone_number") for p in root.iter("phone")] == [
+        "617-253-3000",
+        "1",
+    ]
+    assert root.findtext(".//statistic_category") == "ZZ"
@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+
+from patronload.records import (
+    load_staff_template,
+    render_staff_record,
+    staff_from_row,
+    staff_reject_line,
+)
+from patronload.render import RenderedRow, render_rows
+from tests.test_patronload_records import STAFF_COLUMNS, STAFF_ROW
+
+SIX_MONTHS = date(2022, 7, 7)
+TWO_YEARS = date(2024, 7, 7)
+DEPARTMENTS = {"10000001": "AA"}
+
+
+def staff_rows(count):
+    for i in range(count):
+        row = list(STAFF_ROW)
+        row[0] = f"Lastname {i}, Firstname"
+        row[3] = f"9{i:08}"
+        row[6] = None if i % 10 == 3 else f"STAFF{i}"
+        yield tuple(row)
+
+
+def expected_rows(rows):
+    template = load_staff_template()
+    for row in rows:
+        patron = staff_from_row(STAFF_COLUMNS, row)
+        if patron:
+            yield RenderedRow(
+                mit_id=patron["MIT_ID"],
+                xml=render_staff_record(
+                    template, patron, DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+                ),
+            )
+        else:
+            yield RenderedRow(reject_line=staff_reject_line(row))
+
+
+def test_render_rows_in_process():
+    rendered = list(
+        render_rows(
+            "staff", STAFF_COLUMNS, staff_rows(25), DEPARTMENTS, SIX_MONTHS, TWO_YEARS
+        )
+    )
+    assert rendered == list(expected_rows(staff_rows(25)))
+    assert rendered[1].mit_id == "900000001"
+    assert rendered[3].xml is None
+    assert rendered[3].reject_line.startswith("Lastname 3, Firstname|")
+
+
+@pytest.mark.parametrize("workers,chunk_size", [(2, 1), (2, 7), (3, 100)])
+def test_render_rows_in_worker_processes_keeps_row_order(workers, chunk_size):
+    rendered = list(
+        render_rows(
+            "staff",
+            STAFF_COLUMNS,
+            staff_rows(50),
+            DEPARTMENTS,
+            SIX_MONTHS,
+            TWO_YEARS,
+            workers=workers,
+            chunk_size=chunk_size,
+        )
+    )
+    assert rendered == list(expected_rows(staff_rows(50)))
+
+
+def test_render_rows_reads_rows_as_chunks_are_rendered():
+    read = []
+
+    def rows():
+        for row in staff_rows(100):
+            read.append(row)
+            yield row
+
+    rendered = render_rows(
+        "staff",
+        STAFF_COLUMNS,
+        rows(),
+        DEPARTMENTS,
+        SIX_MONTHS,
+        TWO_YEARS,
+        workers=2,
+        chunk_size=5,
+    )
+    next(rendered)
+    # two chunks per worker are submitted, and one more once the first is done
+    assert len(read) == 25
+    assert len(list(rendered)) == 99
+    assert len(read) == 100
+
+
+def test_render_rows_with_no_rows():
+    assert (
+        list(render_rows("student", [], iter([]), {}, SIX_MONTHS, TWO_YEARS, workers=2))
+        == []
+    )
@@ -0,0 +1,66 @@
+from patronload.state import PatronDelta, PatronState, record_digest
+
+
+def run(state, kind, records, **kwargs):
+    delta = PatronDelta(state, kind, **kwargs)
+    emitted = [mit_id for mit_id, xml in records.items() if delta.emit(mit_id, xml)]
+    removed = delta.removed()
+    delta.save()
+    return emitted, removed
+
+
+def test_record_digest():
+    assert len(record_digest(b"<user />")) == 16
+    assert record_digest(b"<user />") != record_digest(b"<user>a</user>")
+
+
+def test_patron_state_persists_digests(tmp_path):
+    path = str(tmp_path / "state.db")
+    with PatronState(path) as state:
+        state.replace("staff", {"1": b"a", "2": b"b"})
+        state.replace("student", {"1": b"c"})
+    with PatronState(path) as state:
+        assert state.digests("staff") == {"1": b"a", "2": b"b"}
+        state.replace("staff", {"2": b"d"})
+        assert state.digests("staff") == {"2": b"d"}
+        assert state.digests("student") == {"1": b"c"}
+
+
+def test_patron_delta_emits_new_and_changed_records(tmp_path):
+    with PatronState(str(tmp_path / "state.db")) as state:
+        assert run(state, "staff", {"1": b"a", "2": b"b", "3": b"c"}) == (
+            ["1", "2", "3"],
+            [],
+        )
+        assert run(state, "staff", {"1": b"a", "2": b"B", "4": b"d"}) == (
+            ["2", "4"],
+            ["3"],
+        )
+        assert run(state, "staff", {"1": b"a", "2": b"B", "4": b"d"}) == ([], [])
+
+
+def test_patron_delta_full_emits_every_record(tmp_path):
+    with PatronState(str(tmp_path / "state.db")) as state:
+        run(state, "staff", {"1": b"a", "2": b"b"})
+        assert run(state, "staff", {"1": b"a"}, full=True) == (["1"], ["2"])
+
+
+def test_patron_delta_excludes_records_sent_as_another_kind(tmp_path):
+    with PatronState(str(tmp_path / "state.db")) as state:
+        run(state, "student", {"1": b"a", "2": b"b"})
+        # student 2 became staff, so is neither emitted, stored nor removed
+        assert run(state, "student", {"1": b"a", "2": b"b"}, exclude=["2"]) == (
+            [],
+            [],
+        )
+        assert state.digests("student") == {"1": record_digest(b"a")}
+        # and is emitted as a student again once they are no longer staff
+        assert run(state, "student", {"1": b"a", "2": b"b"}) == (["2"], [])
+
+
+def test_patron_delta_does_not_save_until_asked(tmp_path):
+    with PatronState(str(tmp_path / "state.db")) as state:
+        delta = PatronDelta(state, "staff")
+        assert delta.emit("1", b"a")
+        assert state.digests("staff") == {}
+        assert delta.emitted == 1
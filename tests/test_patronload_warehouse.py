@@ -0,0 +1,47 @@
+from datetime import date
+
+from patronload.warehouse import column_names, reject_line, stream_rows
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.arraysize = 100
+        self.prefetchrows = 2
+        self.description = None
+        self.executed = None
+        self.fetches = 0
+        self._position = 0
+
+    def execute(self, query):
+        self.executed = query
+        self.description = [("MIT_ID", None), ("FULL_NAME", None)]
+
+    def fetchmany(self):
+        self.fetches += 1
+        batch = self.rows[self._position : self._position + self.arraysize]
+        self._position += len(batch)
+        return batch
+
+
+def test_stream_rows_fetches_batches_as_rows_are_consumed():
+    cursor = FakeCursor([(str(i), f"Name {i}") for i in range(5)])
+    rows = stream_rows(cursor, "SELECT * FROM LIBRARY_EMPLOYEE", batch_size=2)
+    assert cursor.executed == "SELECT * FROM LIBRARY_EMPLOYEE"
+    assert cursor.arraysize == 2
+    assert cursor.prefetchrows == 2
+    assert cursor.fetches == 0
+    assert next(rows) == ("0", "Name 0")
+    assert cursor.fetches == 1
+    assert list(rows) == [(str(i), f"Name {i}") for i in range(1, 5)]
+    assert cursor.fetches == 4
+
+
+def test_column_names():
+    cursor = FakeCursor([])
+    stream_rows(cursor, "SELECT * FROM LIBRARY_EMPLOYEE")
+    assert column_names(cursor) == ["MIT_ID", "FULL_NAME"]
+
+
+def test_reject_line():
+    assert reject_line(("123", None, date(2022, 1, 7), 5)) == "123||2022-01-07|5\n"
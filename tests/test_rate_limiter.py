@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llama.rate_limiter import RateLimiter
+
+
+def test_rate_limiter_init_defaults():
+    limiter = RateLimiter(requests_per_second=25)
+    assert limiter.burst == 25
+    assert limiter.throttled_seconds == 0
+    assert limiter.throttled_requests == 0
+
+
+def test_rate_limiter_invalid_rate_raises_error():
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_second=0)
+
+
+def test_rate_limiter_invalid_burst_raises_error():
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_second=10, burst=0)
+
+
+def test_rate_limiter_ignores_clock_moving_backwards():
+    limiter = RateLimiter(requests_per_second=10, burst=2)
+    limiter._updated += 1_000_000
+    assert limiter.acquire() == 0.0
+    assert limiter.acquire() == 0.0
+
+
+def test_rate_limiter_does_not_wait_within_budget():
+    limiter = RateLimiter(requests_per_second=10, burst=5)
+    waits = [limiter.acquire() for _ in range(5)]
+    assert waits == [0.0] * 5
+    assert limiter.throttled_requests == 0
+
+
+def test_rate_limiter_waits_when_budget_exhausted():
+    limiter = RateLimiter(requests_per_second=20, burst=1)
+    start = time.monotonic()
+    limiter.acquire()
+    limiter.acquire()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+    assert limiter.throttled_requests == 2
+    assert limiter.throttled_seconds == pytest.approx(0.1, abs=0.02)
+
+
+def test_rate_limiter_reserve_queues_callers_in_order():
+    limiter = RateLimiter(requests_per_second=10, burst=1)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+    assert limiter.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limiter_shared_between_threads():
+    limiter = RateLimiter(requests_per_second=50, burst=5)
+    threads = [
+        threading.Thread(target=lambda: [limiter.acquire() for _ in range(3)])
+        for _ in range(5)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 15 requests with a burst of 5 leaves 10 to be spread at 50 per second
+    assert time.monotonic() - start >= 0.18
+    assert limiter.throttled_requests == 10
+
+
+def test_rate_limiter_acquire_async_waits_when_budget_exhausted():
+    limiter = RateLimiter(requests_per_second=20, burst=1)
+
+    async def acquire_tokens():
+        await asyncio.gather(*[limiter.acquire_async() for _ in range(3)])
+
+    start = time.monotonic()
+    asyncio.run(acquire_tokens())
+    assert time.monotonic() - start >= 0.09
+    assert limiter.throttled_requests == 2
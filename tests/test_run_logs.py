@@ -0,0 +1,60 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llama.run_logs import RunLogBuffer
+
+logger = logging.getLogger(__name__)
+
+
+def test_run_log_buffer_replays_runs_in_capture_order(caplog):
+    caplog.set_level(logging.INFO)
+    first_run_started = threading.Event()
+    second_run_finished = threading.Event()
+
+    def first_run():
+        logger.info("first run started")
+        first_run_started.set()
+        second_run_finished.wait(5)
+        logger.info("first run finished")
+
+    def second_run():
+        first_run_started.wait(5)
+        logger.info("second run started")
+        logger.info("second run finished")
+        second_run_finished.set()
+
+    with RunLogBuffer() as run_logs:
+        threads = [
+            threading.Thread(target=run_logs.capture(first_run)),
+            threading.Thread(target=run_logs.capture(second_run)),
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info("not in a run")
+        for thread in threads:
+            thread.join()
+        assert caplog.messages == ["not in a run"]
+    assert caplog.messages == [
+        "not in a run",
+        "first run started",
+        "first run finished",
+        "second run started",
+        "second run finished",
+    ]
+
+
+def test_run_log_buffer_replays_logs_of_failed_run(caplog):
+    caplog.set_level(logging.INFO)
+
+    def failing_run():
+        logger.info("about to fail")
+        raise ValueError("failed")
+
+    with RunLogBuffer() as run_logs, ThreadPoolExecutor() as executor:
+        future = executor.submit(run_logs.capture(failing_run))
+    with pytest.raises(ValueError):
+        future.result()
+    assert "about to fail" in caplog.messages
@@ -1,10 +1,12 @@
 import collections
+import io
 import json
 from datetime import datetime
 
 import pytest
 
 from llama import CONFIG, sap
+from llama.journal import RunJournal
 from llama.ssm import SSM
 
 
@@ -18,6 +20,66 @@ def test_retrieve_sorted_invoices(mocked_alma, mocked_alma_api_client):
     assert invoices[2]["number"] == "0501130657"
 
 
+def test_preload_funds(mocked_alma, mocked_alma_api_client):
+    retrieved_funds = sap.preload_funds(mocked_alma_api_client)
+    assert list(retrieved_funds) == ["ABC", "DEF", "GHI", "JKL"]
+    assert retrieved_funds["ABC"]["total_record_count"] == 1
+    assert retrieved_funds["ABC"]["fund"][0]["external_id"] == "1234567-000001"
+
+
+def test_parse_invoice_records_with_preloaded_funds(
+    mocked_alma, mocked_alma_api_client
+):
+    invoices = sap.retrieve_sorted_invoices(mocked_alma_api_client)
+    retrieved_funds = sap.preload_funds(mocked_alma_api_client)
+    problem_invoices, parsed_invoices = sap.parse_invoice_records(
+        mocked_alma_api_client, invoices, retrieved_funds
+    )
+    assert len(parsed_invoices) == 3
+    assert len(problem_invoices) == 2
+    fund_searches = [r for r in mocked_alma.request_history if "q" in r.qs]
+    assert {r.qs["q"][0] for r in fund_searches} == {"fund_code~over-encumbered"}
+
+
+def test_prefetch_vendors_and_funds(caplog, mocked_alma, mocked_alma_api_client):
+    invoices = sap.retrieve_sorted_invoices(mocked_alma_api_client)
+    retrieved_vendors, retrieved_funds = sap.prefetch_vendors_and_funds(
+        mocked_alma_api_client, invoices, workers=2
+    )
+    assert list(retrieved_vendors) == ["AAA", "VEND-S", "multibyte-address"]
+    assert retrieved_vendors["AAA"]["code"] == "AAA"
+    assert retrieved_funds["over-encumbered"]["total_record_count"] == 0
+    assert retrieved_funds["ABC"]["fund"][0]["external_id"] == "1234567-000001"
+    assert "Prefetched 3 distinct vendors for 5 vendor lookups" in caplog.text
+
+
+def test_prefetch_vendors_and_funds_vendor_address_error(
+    mocked_alma, mocked_alma_api_client
+):
+    with open("tests/fixtures/invoice_with_no_vendor_address.json") as f:
+        invoice = json.load(f)
+    retrieved_vendors, _ = sap.prefetch_vendors_and_funds(
+        mocked_alma_api_client, [invoice]
+    )
+    assert retrieved_vendors == {invoice["vendor"]["value"]: None}
+
+
+def test_parse_invoice_records_after_prefetch_makes_no_requests(
+    mocked_alma, mocked_alma_api_client
+):
+    invoices = sap.retrieve_sorted_invoices(mocked_alma_api_client)
+    retrieved_vendors, retrieved_funds = sap.prefetch_vendors_and_funds(
+        mocked_alma_api_client, invoices
+    )
+    call_count = mocked_alma.call_count
+    problem_invoices, parsed_invoices = sap.parse_invoice_records(
+        mocked_alma_api_client, invoices, retrieved_funds, retrieved_vendors
+    )
+    assert mocked_alma.call_count == call_count
+    assert len(parsed_invoices) == 3
+    assert len(problem_invoices) == 2
+
+
 def test_parse_invoice_records(mocked_alma, mocked_alma_api_client):
     invoices = sap.retrieve_sorted_invoices(mocked_alma_api_client)
     problem_invoices, parsed_invoices = sap.parse_invoice_records(
@@ -30,6 +92,7 @@ def test_parse_invoice_records(mocked_alma, mocked_alma_api_client):
     assert problem_invoices[1]["multibyte_errors"][0] == {
         "character": "‑",
         "field": "vendor:address:lines:0",
+        "position": 9,
     }
 
 
@@ -59,7 +122,25 @@ def test_contains_multibyte():
     has_multibyte = sap.check_for_multibyte(invoice_with_multibyte)
     assert has_multibyte[0]["field"] == "id:level 2:0"
     assert has_multibyte[0]["character"] == "‑"
+    assert has_multibyte[0]["position"] == 30
     assert has_multibyte[1]["field"] == "id:level 2:1"
+    assert has_multibyte[1]["position"] == 13
+
+
+def test_contains_multibyte_reports_every_character_in_field_order():
+    invoice_with_multibyte = {
+        "vendor": {"name": "Café Ñandú", "address": {"lines": ("ok", "Straße")}},
+        "number": "123",
+        "date": datetime(2021, 5, 12),
+        "total amount": 1.5,
+    }
+    has_multibyte = sap.check_for_multibyte(invoice_with_multibyte)
+    assert has_multibyte == [
+        {"field": "vendor:name", "character": "é", "position": 3},
+        {"field": "vendor:name", "character": "Ñ", "position": 5},
+        {"field": "vendor:name", "character": "ú", "position": 9},
+        {"field": "vendor:address:lines:1", "character": "ß", "position": 4},
+    ]
 
 
 def test_does_not_contain_multibyte():
@@ -444,6 +525,42 @@ def test_generate_sap_data_success(invoices_for_sap, sap_data_file):
     assert report == sap_data_file
 
 
+def test_write_sap_data_streams_to_file(invoices_for_sap, sap_data_file, tmp_path):
+    today = datetime(2021, 5, 18)
+    with open(tmp_path / "dlibsapg", "w") as f:
+        sap.write_sap_data(f, today, invoices_for_sap)
+    with open(tmp_path / "dlibsapg") as f:
+        assert f.read() == sap_data_file
+
+
+def test_write_report_matches_generate_report(invoices_for_sap):
+    today = datetime(2021, 5, 18)
+    report = io.StringIO()
+    sap.write_report(report, today, invoices_for_sap)
+    assert report.getvalue() == sap.generate_report(today, invoices_for_sap)
+
+
+def test_write_sap_data_totals_match_control_file(invoices_for_sap, sap_data_file):
+    today = datetime(2021, 5, 18)
+    totals = sap.write_sap_data(io.StringIO(), today, invoices_for_sap)
+    assert sap.generate_sap_control_from_totals(totals) == sap.generate_sap_control(
+        sap_data_file, sap.calculate_invoices_total_amount(invoices_for_sap)
+    )
+
+
+def test_parse_sap_data(invoices_for_sap, sap_data_file):
+    records = sap.parse_sap_data(sap_data_file)
+    headers = [r for r in records if r["record_type"] == "B"]
+    assert len(records) == len(sap_data_file.splitlines())
+    assert [h["total_amount"] for h in headers] == [
+        i["total amount"] for i in invoices_for_sap
+    ]
+    assert headers[0]["vendor_name"] == "Danger Inc."
+    assert headers[0]["document_date"] == "20210518"
+    assert records[1]["record_type"] == "D"
+    assert records[1]["amount"] == 150.0
+
+
 def test_calculate_invoices_total_amount():
     invoices = [dict(zip(["total amount"], [0.1])) for x in range(100)]
     total_amount = sap.calculate_invoices_total_amount(invoices)
@@ -580,6 +697,41 @@ def test_mark_invoices_paid_error(
     )
 
 
+def test_mark_invoices_paid_records_paid_invoices_in_journal(
+    invoices_for_sap_with_different_payment_method, mocked_alma, tmp_path
+):
+    with RunJournal(str(tmp_path / "run.jsonl")) as journal:
+        result = sap.mark_invoices_paid(
+            invoices_for_sap_with_different_payment_method,
+            datetime(2022, 1, 7),
+            journal=journal,
+        )
+        assert result == 2
+        assert journal.invoice_ids("invoice_paid") == {"0000055555000000"}
+
+
+def test_mark_invoices_paid_skips_invoices_paid_in_journal(
+    caplog, invoices_for_sap_with_different_payment_method, mocked_alma, tmp_path
+):
+    with RunJournal(str(tmp_path / "run.jsonl")) as journal:
+        journal.record("invoice_paid", invoice_id="0000055555000000")
+        result = sap.mark_invoices_paid(
+            invoices_for_sap_with_different_payment_method,
+            datetime(2022, 1, 7),
+            journal=journal,
+        )
+    assert result == 2
+    assert "Skipping 2 invoices already marked paid in this run" in caplog.text
+    paid_requests = [r for r in mocked_alma.request_history if r.method == "POST"]
+    assert [r.path for r in paid_requests] == ["/acq/invoices/0000055555000001"]
+
+
+def test_serialize_invoices_round_trip(invoices_for_sap):
+    serialized = sap.serialize_invoices(invoices_for_sap)
+    assert json.loads(json.dumps(serialized)) == serialized
+    assert sap.deserialize_invoices(serialized) == invoices_for_sap
+
+
 def test_run_not_final_not_real(
     caplog,
     invoices_for_sap_with_different_payment_method,
@@ -1,4 +1,10 @@
-from llama.sftp import SFTP
+from io import BytesIO
+from unittest.mock import patch
+
+import pytest
+from paramiko import SFTPAttributes
+
+from llama.sftp import SFTP, SFTPUploadError
 
 
 def test_sftp_authenticate(mocked_sftp_server, test_sftp_private_key):
@@ -23,3 +29,147 @@ def test_sftp_send_file(mocked_sftp_server, test_sftp_private_key):
     )
     response = sftp.send_file("I am a file", "dropbox/newfile.txt")
     assert (response.st_size) == 11
+
+
+def test_sftp_send_file_streams_bytes_file_and_iterable(
+    mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP(buffer_size=4) as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        sources = {
+            "dropbox/bytes.txt": b"I am a file",
+            "dropbox/stream.txt": BytesIO(b"I am a file"),
+            "dropbox/iterable.txt": iter([b"I am ", b"a file"]),
+        }
+        for path, contents in sources.items():
+            assert sftp.send_file(contents, path).st_size == 11
+            with sftp.sftp_session.open(path) as f:
+                assert f.read() == b"I am a file"
+
+
+def test_sftp_reuses_one_session_per_connection(
+    mocked_sftp_server, test_sftp_private_key
+):
+    sftp = SFTP()
+    sftp.authenticate(
+        host=mocked_sftp_server.host,
+        port=mocked_sftp_server.port,
+        username="test-dropbox-user",
+        private_key=test_sftp_private_key,
+    )
+    with patch.object(
+        sftp.client, "open_sftp", wraps=sftp.client.open_sftp
+    ) as open_sftp:
+        sftp.send_file("I am a file", "dropbox/data.txt")
+        sftp.send_file("I am another file", "dropbox/control.txt")
+    assert open_sftp.call_count == 1
+    sftp.close()
+    assert sftp.client.get_transport() is None
+
+
+def test_sftp_send_file_reports_upload(
+    caplog, mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP() as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        sftp.send_file("I am a file", "dropbox/newfile.txt")
+    (upload,) = sftp.uploads
+    assert upload.file_path == "dropbox/newfile.txt"
+    assert upload.bytes == 11
+    assert upload.bytes_per_second > 0
+    assert "Sent 11 bytes to 'dropbox/newfile.txt' in" in caplog.text
+
+
+def test_sftp_send_file_writes_temporary_file_then_renames(
+    mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP() as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        with patch.object(
+            sftp.sftp_session, "rename", wraps=sftp.sftp_session.rename
+        ) as rename:
+            sftp.send_file("I am a file", "dropbox/newfile.txt", verify_checksum=True)
+        rename.assert_called_once_with(
+            "dropbox/newfile.txt.part", "dropbox/newfile.txt"
+        )
+        assert "newfile.txt.part" not in sftp.sftp_session.listdir("dropbox")
+        with sftp.sftp_session.open("dropbox/newfile.txt") as f:
+            assert f.read() == b"I am a file"
+
+
+def test_sftp_send_file_size_mismatch_raises_error(
+    mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP() as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        short_attributes = SFTPAttributes()
+        short_attributes.st_size = 5
+        with patch.object(sftp.sftp_session, "stat", return_value=short_attributes):
+            with pytest.raises(SFTPUploadError) as error:
+                sftp.send_file("I am a file", "dropbox/newfile.txt")
+        assert error.value.file_path == "dropbox/newfile.txt.part"
+        assert "is 5 bytes on the server but 11 bytes were sent" in str(error.value)
+        assert sftp.sftp_session.listdir("dropbox") == []
+
+
+def test_sftp_send_file_checksum_mismatch_raises_error(
+    mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP() as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        open_file = sftp.sftp_session.open
+
+        def open_corrupted(file_path, mode="r", bufsize=-1):
+            remote_file = open_file(file_path, mode, bufsize)
+            if mode == "wb":
+                write = remote_file.write
+                remote_file.write = lambda data: write(bytes(data).upper())
+            return remote_file
+
+        with patch.object(sftp.sftp_session, "open", side_effect=open_corrupted):
+            with pytest.raises(SFTPUploadError, match="checksum"):
+                sftp.send_file(
+                    "I am a file", "dropbox/newfile.txt", verify_checksum=True
+                )
+        assert sftp.sftp_session.listdir("dropbox") == []
+
+
+def test_sftp_data_file_is_in_place_before_control_file_is_sent(
+    mocked_sftp_server, test_sftp_private_key
+):
+    with SFTP() as sftp:
+        sftp.authenticate(
+            host=mocked_sftp_server.host,
+            port=mocked_sftp_server.port,
+            username="test-dropbox-user",
+            private_key=test_sftp_private_key,
+        )
+        sftp.send_file("data", "dropbox/dlibsapg.1001.20210518000000")
+        listing_before_control = sftp.sftp_session.listdir("dropbox")
+        sftp.send_file("control", "dropbox/clibsapg.1001.20210518000000")
+    assert listing_before_control == ["dlibsapg.1001.20210518000000"]